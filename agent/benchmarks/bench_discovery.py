@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+对比串行与多进程用例发现的耗时。
+在临时目录下生成一个包含 5000 个测试文件的仓库，分别以 --jobs 1 和 --jobs N 扫描。
+
+用法: python benchmarks/bench_discovery.py [--files 5000] [--jobs 8]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'test_runner_plugin'))
+
+from find_test_cases import scan_project_for_test_cases  # noqa: E402
+
+CASES_PER_FILE = 10
+
+
+def generate_repo(root, files):
+    """生成合成测试仓库，每个文件包含若干带用例编号的测试函数和测试类"""
+    for i in range(files):
+        module_dir = os.path.join(root, f'module_{i % 50:02d}', f'sub_{i % 7}')
+        os.makedirs(module_dir, exist_ok=True)
+        lines = ['import pytest', '', '']
+        for j in range(CASES_PER_FILE):
+            lines += [
+                f'def test_case_{j}():',
+                f'    """测试用例编号：BENCH_TC{i:05d}_{j:02d}"""',
+                f'    assert {j} == {j}',
+                '',
+                '',
+            ]
+        lines += ['class TestGroup:', '    def test_in_class(self):', f'        """BENCH_CLS{i:05d}"""', '']
+        with open(os.path.join(module_dir, f'test_bench_{i:05d}.py'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+
+
+def timed(label, func):
+    st = time.perf_counter()
+    result = func()
+    cost = time.perf_counter() - st
+    print(f'{label:<12} {cost:8.3f}s  matched={len(result)}')
+    return cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description='用例发现性能对比')
+    parser.add_argument('--files', type=int, default=5000, help='生成的测试文件数 (默认: 5000)')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='并行进程数 (默认: CPU核数)')
+    args = parser.parse_args()
+
+    case_ids = [f'BENCH_TC{i:05d}_00' for i in range(0, args.files, 100)]
+    with tempfile.TemporaryDirectory() as root:
+        print(f'生成 {args.files} 个测试文件: {root}')
+        generate_repo(root, args.files)
+
+        serial = timed('serial', lambda: scan_project_for_test_cases(root, case_ids, jobs=1))
+        parallel = timed(f'jobs={args.jobs}', lambda: scan_project_for_test_cases(root, case_ids, jobs=args.jobs))
+        print(f'speedup      {serial / parallel:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+验证 Docker SDK 调用不阻塞事件循环。
+注入一个每次调用都阻塞约 100ms 的假 Docker 后端，并发运行 50 个任务，同时持续探测心跳接口的延迟，
+心跳的最大延迟应远小于单次 Docker 调用耗时（默认阈值 50ms）。
+
+用法: python benchmarks/bench_heartbeat_latency.py [--jobs 50] [--docker-latency 0.1] [--threshold 0.05]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import main  # noqa: E402
+import utils  # noqa: E402
+from const import CONTAINER_JOB_LABEL, CONTAINER_STOP_HOOKS, TASK_SETTINGS_MAP  # noqa: E402
+from container_events import container_events  # noqa: E402
+from docker_adapter import docker_client  # noqa: E402
+
+
+class FakeContainer:
+    def __init__(self, name, latency):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = 'running'
+        self.latency = latency
+
+    def wait(self):
+        time.sleep(self.latency * 3)
+        self.status = 'exited'
+        return {'StatusCode': 0}
+
+    def stop(self):
+        time.sleep(self.latency)
+
+    def remove(self, force=False):
+        time.sleep(self.latency)
+
+    def logs(self):
+        time.sleep(self.latency)
+        return b''
+
+
+class FakeContainers:
+    def __init__(self, latency, loop):
+        self.latency = latency
+        self.loop = loop
+        self.items = {}
+
+    def run(self, image, name=None, labels=None, **kwargs):
+        time.sleep(self.latency)
+        self.items[name] = FakeContainer(name, self.latency)
+        # 模拟Docker事件流: 容器运行一段时间后收到die事件
+        job_id = labels[CONTAINER_JOB_LABEL]
+        threading.Timer(
+            self.latency * 3,
+            lambda: self.loop.call_soon_threadsafe(container_events.resolve, job_id, 0),
+        ).start()
+        return self.items[name]
+
+    def get(self, name):
+        time.sleep(self.latency)
+        return self.items[name]
+
+    def list(self, all=False):
+        time.sleep(self.latency)
+        return list(self.items.values())
+
+
+class FakeDockerClient:
+    def __init__(self, latency, loop):
+        self.containers = FakeContainers(latency, loop)
+
+
+async def noop(*args, **kwargs):
+    return None
+
+
+async def probe(stop: asyncio.Event, interval: float):
+    """持续调用心跳接口, 记录每次调用的延迟(含事件循环调度延迟)"""
+    latencies = []
+    while not stop.is_set():
+        st = time.perf_counter()
+        await asyncio.sleep(0)
+        await main.heartbeat()
+        latencies.append(time.perf_counter() - st)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run(args):
+    docker_client.set_client(FakeDockerClient(args.docker_latency, asyncio.get_running_loop()))
+    # 只保留 Docker 调用路径, 跳过代码检出、依赖环境和平台通知
+    utils.DockerContainerHandler.prepare_repo = noop
+    utils.DockerContainerHandler.prepare_env = noop
+    utils.DockerContainerHandler.write_case_durations = lambda self: None
+    utils.DockerContainerHandler.get_task_cmd = lambda self: noop()
+    utils.DockerContainerHandler._get_task_volume = lambda self: {}
+    utils.DockerContainerHandler._get_task_env_vars = lambda self: {}
+    utils.replay_unsent_results = noop
+    CONTAINER_STOP_HOOKS.clear()
+
+    job_ids = [f'bench-{i}' for i in range(args.jobs)]
+    for job_id in job_ids:
+        TASK_SETTINGS_MAP[job_id] = {'id': job_id, 'status': 'created', 'container_id': None, 'cpus': None}
+
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe(stop, 0.005))
+    st = time.perf_counter()
+    await asyncio.gather(*(utils.DockerContainerHandler(job_id).run() for job_id in job_ids))
+    succeeded = sum(TASK_SETTINGS_MAP[job_id]['status'] == 'succeeded' for job_id in job_ids)
+    # 停止/删除也走同一线程池
+    await asyncio.gather(*(utils.DockerContainerHandler(job_id).delete() for job_id in job_ids))
+    cost = time.perf_counter() - st
+    stop.set()
+    latencies = sorted(await prober)
+
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0
+    print(f'jobs={args.jobs} succeeded={succeeded} total={cost:.2f}s')
+    print(f'heartbeat samples={len(latencies)} p99={p99 * 1000:.1f}ms max={latencies[-1] * 1000:.1f}ms')
+    return latencies[-1] if latencies else 0
+
+
+def main_():
+    parser = argparse.ArgumentParser(description='Docker调用期间的心跳延迟')
+    parser.add_argument('--jobs', type=int, default=50, help='并发任务数 (默认: 50)')
+    parser.add_argument('--docker-latency', type=float, default=0.1, help='假Docker每次调用的阻塞时间(秒)')
+    parser.add_argument('--threshold', type=float, default=0.05, help='心跳最大延迟阈值(秒)')
+    args = parser.parse_args()
+
+    worst = asyncio.run(run(args))
+    if worst > args.threshold:
+        print(f'FAIL: 心跳最大延迟 {worst * 1000:.1f}ms 超过阈值 {args.threshold * 1000:.0f}ms')
+        sys.exit(1)
+    print('OK')
+
+
+if __name__ == '__main__':
+    main_()
@@ -13,6 +13,34 @@ LOG_HOST_DIR = Path(__file__).parent / 'log' / 'test_logs'
 LOG_HOST_DIR.mkdir(parents=True, exist_ok=True)
 # PIP_PROXY = "https://bytedpypi.byted.org/simple"
 PIP_CACHE_DIR = '/root/.cache/pip'
+CACHE_DIR = Path(__file__).parent / '.cache'
+REPO_CACHE_DIR = CACHE_DIR / 'repos'  # 仓库 bare mirror 缓存目录
+WORKTREE_DIR = CACHE_DIR / 'worktrees'  # 任务代码检出目录（挂载到容器 /app）
+REPO_CACHE_MAX_MIRRORS = int(os.getenv("REPO_CACHE_MAX_MIRRORS", "20"))  # 最多保留的仓库镜像数
+ENV_CACHE_DIR = CACHE_DIR / 'envs'  # 依赖环境(virtualenv)缓存目录
+ENV_CACHE_MAX_BYTES = int(os.getenv("ENV_CACHE_MAX_BYTES", str(20 * 1024 ** 3)))  # 依赖环境缓存总大小上限
+AGENT_MAX_JOBS = int(os.getenv("AGENT_MAX_JOBS", "0"))  # 同时运行的任务数, 0 表示按CPU和内存自动计算
+JOB_MEMORY_BYTES = int(os.getenv("JOB_MEMORY_BYTES", str(2 * 1024 ** 3)))  # 自动计算槽位时每个任务预估占用的内存
+DOCKER_EXECUTOR_WORKERS = int(os.getenv("DOCKER_EXECUTOR_WORKERS", "8"))  # Docker API 调用线程数
+DOCKER_WAIT_WORKERS = int(os.getenv("DOCKER_WAIT_WORKERS", "4"))  # 等待一次性容器(构建依赖环境)退出的线程数
+DOCKER_SOCKET = os.getenv("DOCKER_SOCKET", "/var/run/docker.sock")
+CONTAINER_LABEL = "test-platform.agent"  # agent 创建的任务容器都带有该标签
+CONTAINER_JOB_LABEL = "test-platform.job_id"  # 任务容器对应的任务ID
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "600"))  # 事件流正常时全量状态同步的间隔(秒)
+LOG_ARCHIVE_CHUNK_BYTES = int(os.getenv("LOG_ARCHIVE_CHUNK_BYTES", str(1024 * 1024)))  # 压缩日志每个gzip成员的原始字节数
+LOG_COMPACT_DELAY = int(os.getenv("LOG_COMPACT_DELAY", "300"))  # 任务结束且日志超过该秒数未写入后压缩
+LOG_COMPACT_INTERVAL = int(os.getenv("LOG_COMPACT_INTERVAL", "60"))  # 压缩/清理任务日志的间隔(秒)
+LOG_COMPACT_CONCURRENCY = int(os.getenv("LOG_COMPACT_CONCURRENCY", "2"))  # 同时压缩的日志数
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "30"))  # 任务日志保留天数
+LOG_RETENTION_MAX_BYTES = int(os.getenv("LOG_RETENTION_MAX_BYTES", str(50 * 1024 ** 3)))  # 任务日志总大小上限
+PLATFORM_HTTP_POOL_SIZE = int(os.getenv("PLATFORM_HTTP_POOL_SIZE", "16"))  # 与平台的最大连接数
+PLATFORM_HTTP_KEEPALIVE = int(os.getenv("PLATFORM_HTTP_KEEPALIVE", "30"))  # 与平台的空闲连接保持时间(秒)
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "100"))  # 每批发送的容器停止通知数
+NOTIFY_MAX_BACKOFF = float(os.getenv("NOTIFY_MAX_BACKOFF", "300"))  # 容器停止通知重试的最长间隔(秒)
+WARM_POOL_SIZE = int(os.getenv("WARM_POOL_SIZE", "0"))  # 每个镜像保持的预热容器数, 0 表示不使用预热容器(预热容器可只读访问所有依赖环境和仓库镜像, 见 README)
+WARM_POOL_IMAGES = [image.strip() for image in os.getenv("WARM_POOL_IMAGES", "python:3.10").split(",") if image.strip()]  # 启动时即预热的镜像
+WARM_POOL_IDLE_TIMEOUT = float(os.getenv("WARM_POOL_IDLE_TIMEOUT", "1800"))  # 镜像超过该秒数没有任务使用时淘汰其预热容器
+WARM_POOL_LABEL = "test-platform.warm"  # 预热容器的标签(值为镜像)
 
 if not SERVER_IP:
     raise ValueError("SERVER_IP is not set")
@@ -31,6 +59,8 @@ class TaskRunRequest(BaseModel):
     branch: 分支名
     env_vars: 环境变量列表
     server: 服务器配置
+    case_durations: 用例历史耗时(秒), 用于容器内并行执行时按耗时分片
+    cpus: 容器CPU配额(核数), 同时决定容器内并行执行的worker数, 为空表示不限制且串行执行
     """
     job_id: int
     repo: str = 'https://code.byted.org/hred/board_and_test_test.git'
@@ -39,3 +69,5 @@ class TaskRunRequest(BaseModel):
     branch: str = 'dev_ada_laifu'
     env_vars: List[dict] | None = None
     server: dict | None = None
+    case_durations: Dict[str, float] = {}
+    cpus: float | None = None
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import aiohttp
+
+from typing import Any, Callable, Coroutine, Dict, Set
+from loguru import logger
+from const import CONTAINER_JOB_LABEL, CONTAINER_LABEL, DOCKER_SOCKET, TASK_SETTINGS_MAP
+
+TERMINAL_STATUSES = ("succeeded", "failed", "stopped")
+
+
+def container_labels(job_id: str) -> Dict[str, str]:
+    """任务容器的标签, 事件订阅和状态同步都按标签过滤"""
+    return {CONTAINER_LABEL: "1", CONTAINER_JOB_LABEL: job_id}
+
+
+class ContainerEventWatcher:
+    """
+    订阅 Docker 事件流(/events), 由容器的 start/die/oom 事件驱动任务状态变化
+    所有任务共用一条长连接, 不再为每个运行中的任务占用一个线程等待容器退出;
+    断线后从最后一个事件的时间点(since)续订, 全量的状态同步只作为兜底
+    """
+    def __init__(self, socket_path: str, reconnect_delay: float = 1.0):
+        self.socket_path = socket_path
+        self.reconnect_delay = reconnect_delay
+        self.connected = False
+        self._since: int | None = None  # 最后收到的事件时间(秒), 断线续订用
+        self._waiters: Dict[str, asyncio.Future] = {}  # job_id -> 等待容器退出的future
+        self._oom: Set[str] = set()  # 收到oom事件、尚未退出的任务
+        self._bound: Dict[str, str] = {}  # 容器ID -> job_id, 标签中没有任务ID的容器(认领的预热容器)
+        self._on_exit: Callable[[str, Dict[str, Any]], Coroutine[Any, Any, None]] | None = None
+
+    def expect(self, job_id: str) -> asyncio.Future:
+        """在创建容器之前登记等待, 避免容器很快退出时错过die事件"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[job_id] = future
+        return future
+
+    def discard(self, job_id: str):
+        """取消登记(容器创建失败时)"""
+        future = self._waiters.pop(job_id, None)
+        if future and not future.done():
+            future.cancel()
+
+    async def wait(self, job_id: str, future: asyncio.Future) -> Dict[str, Any]:
+        """等待容器退出, 返回与 container.wait() 相同格式的结果"""
+        try:
+            return await future
+        finally:
+            if self._waiters.get(job_id) is future:
+                del self._waiters[job_id]
+
+    def bind(self, container_id: str, job_id: str):
+        """登记容器对应的任务(预热容器创建时还不知道任务ID, 无法通过标签关联)"""
+        self._bound[container_id] = job_id
+
+    def unbind(self, container_id: str):
+        self._bound.pop(container_id, None)
+
+    def is_tracked(self, job_id: str) -> bool:
+        """任务是否有运行中的协程在等待容器退出"""
+        return job_id in self._waiters
+
+    def resolve(self, job_id: str, exit_code: int, oom: bool = False) -> bool:
+        """容器已退出, 唤醒等待的任务; 没有等待者时返回False"""
+        future = self._waiters.pop(job_id, None)
+        if not future or future.done():
+            return False
+        future.set_result({"StatusCode": exit_code, "OOMKilled": oom})
+        return True
+
+    async def _handle(self, event: Dict[str, Any]):
+        actor = event.get("Actor", {})
+        attributes = actor.get("Attributes", {})
+        action = event.get("Action")
+        job_id = attributes.get(CONTAINER_JOB_LABEL) or self._bound.get(actor.get("ID", ""))
+        if action == "die":
+            self._bound.pop(actor.get("ID", ""), None)
+        if not job_id:
+            return
+        task_info = TASK_SETTINGS_MAP.get(job_id)
+        if action == "start":
+            if task_info and task_info["status"] not in TERMINAL_STATUSES:
+                task_info["status"] = "running"
+                task_info["container_id"] = event["Actor"]["ID"]
+        elif action == "oom":
+            logger.warning(f"任务 {job_id} 的容器内存不足(OOM)")
+            self._oom.add(job_id)
+        elif action == "die":
+            exit_code = int(attributes.get("exitCode", -1))
+            oom = job_id in self._oom
+            self._oom.discard(job_id)
+            if self.resolve(job_id, exit_code, oom):
+                return
+            # 没有协程在等待(如agent重启前启动的容器), 直接更新状态并触发停止钩子
+            if task_info and task_info["status"] not in TERMINAL_STATUSES:
+                task_info["status"] = "succeeded" if exit_code == 0 else "failed"
+                task_info["oom"] = oom
+                if self._on_exit:
+                    await self._on_exit(job_id, task_info)
+
+    async def _consume(self):
+        params = {"filters": json.dumps({
+            "type": ["container"],
+            "label": [CONTAINER_LABEL],
+            "event": ["start", "die", "oom"],
+        })}
+        if self._since is not None:
+            # 续订断线期间的事件(同一秒内的事件可能重复, 处理逻辑是幂等的)
+            params["since"] = str(self._since)
+        connector = aiohttp.UnixConnector(path=self.socket_path)
+        timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            async with session.get("http://docker/events", params=params) as response:
+                response.raise_for_status()
+                self.connected = True
+                logger.info("已订阅Docker事件流")
+                async for line in response.content:
+                    if not line.strip():
+                        continue
+                    event = json.loads(line)
+                    self._since = event.get("time", self._since)
+                    try:
+                        await self._handle(event)
+                    except Exception as e:
+                        logger.error(f"处理Docker事件失败: {e}")
+
+    async def run(self, on_exit: Callable[[str, Dict[str, Any]], Coroutine[Any, Any, None]]):
+        """订阅事件流, 断线自动重连"""
+        self._on_exit = on_exit
+        while True:
+            try:
+                await self._consume()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Docker事件流断开: {e}")
+            self.connected = False
+            await asyncio.sleep(self.reconnect_delay)
+
+
+container_events = ContainerEventWatcher(DOCKER_SOCKET)
@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import docker
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+from docker.models.containers import Container
+from const import DOCKER_EXECUTOR_WORKERS, DOCKER_SOCKET, DOCKER_WAIT_WORKERS
+
+
+class AsyncDockerClient:
+    """
+    Docker SDK 的异步适配层
+    Docker SDK 是同步阻塞的, 所有调用都放到专用的有界线程池中执行, 避免阻塞事件循环(心跳、WebSocket日志等);
+    wait 这类长时间阻塞的调用使用单独的线程池, 不占用普通调用的线程
+    """
+    def __init__(self, client_factory: Callable[[], Any], max_workers: int, max_wait_workers: int):
+        self._client_factory = client_factory
+        self._client = None
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='docker')
+        self._wait_executor = ThreadPoolExecutor(max_workers=max_wait_workers, thread_name_prefix='docker-wait')
+
+    @property
+    def client(self):
+        """底层同步客户端(首次使用时创建, 避免导入模块时就连接Docker)"""
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    def set_client(self, client):
+        """替换底层客户端(用于测试或压测时注入假的Docker后端)"""
+        self._client = client
+
+    async def _call(self, func: Callable, *args, **kwargs):
+        """在Docker线程池中执行同步调用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def run_container(self, image: str, **kwargs) -> Container:
+        """创建并启动容器"""
+        return await self._call(self.client.containers.run, image, **kwargs)
+
+    async def get_container(self, name: str) -> Container:
+        """获取容器, 不存在时抛出 docker.errors.NotFound"""
+        return await self._call(self.client.containers.get, name)
+
+    async def list_containers(self, **filters) -> List[Container]:
+        """列出容器"""
+        return await self._call(self.client.containers.list, **filters)
+
+    async def stop(self, container: Container, **kwargs):
+        """停止容器"""
+        return await self._call(container.stop, **kwargs)
+
+    async def remove(self, container: Container, **kwargs):
+        """删除容器"""
+        return await self._call(container.remove, **kwargs)
+
+    async def rename(self, container: Container, name: str):
+        """重命名容器"""
+        return await self._call(container.rename, name)
+
+    async def update(self, container: Container, **kwargs):
+        """修改运行中容器的资源限制"""
+        return await self._call(container.update, **kwargs)
+
+    async def reload(self, container: Container):
+        """刷新容器状态(container.status/attrs)"""
+        return await self._call(container.reload)
+
+    async def logs(self, container: Container, **kwargs) -> bytes:
+        """获取容器日志"""
+        return await self._call(container.logs, **kwargs)
+
+    async def wait(self, container: Container, **kwargs) -> Dict[str, Any]:
+        """等待容器退出(长时间阻塞, 使用单独的线程池)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._wait_executor, functools.partial(container.wait, **kwargs))
+
+
+docker_client = AsyncDockerClient(
+    lambda: docker.DockerClient(base_url=f'unix://{DOCKER_SOCKET}'),
+    DOCKER_EXECUTOR_WORKERS,
+    DOCKER_WAIT_WORKERS,
+)
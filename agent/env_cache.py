@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from loguru import logger
+from const import ENV_CACHE_DIR, ENV_CACHE_MAX_BYTES, PIP_CACHE_DIR
+from docker_adapter import docker_client
+
+# 除仓库 requirements.txt 外, 测试插件自身依赖的包
+EXTRA_PACKAGES = ['requests', 'loguru']
+ENV_MOUNT_PATH = '/venv'
+
+
+def _dir_size(path: Path) -> int:
+    """统计目录占用字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+class EnvCache:
+    """
+    依赖环境缓存
+    以 (镜像, requirements.txt内容) 的哈希为key, 首次遇到时在一次性容器内构建 virtualenv,
+    之后的任务以只读方式挂载到 /venv, 跳过 pip 安装
+    """
+    def __init__(self, cache_dir: Path, max_bytes: int, pip_cache_path: Path):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.pip_cache_path = pip_cache_path
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, asyncio.Lock] = {}  # 每个环境一把锁, 并发任务共享同一次构建
+        self._leases: Dict[str, int] = {}  # 正在使用的环境引用计数
+        self._acquired: Dict[str, str] = {}  # job_id -> 环境key
+
+    @staticmethod
+    def env_key(image: str, requirements: bytes) -> str:
+        """根据镜像和依赖文件内容生成环境key"""
+        h = hashlib.sha256()
+        h.update(image.encode())
+        h.update(b'\0')
+        h.update(requirements)
+        h.update(b'\0')
+        h.update(' '.join(EXTRA_PACKAGES).encode())
+        return h.hexdigest()[:24]
+
+    def env_path(self, key: str) -> Path:
+        """环境目录"""
+        return self.cache_dir / key
+
+    def _read_meta(self, key: str) -> Dict[str, Any] | None:
+        meta_path = self.env_path(key) / 'meta.json'
+        try:
+            return json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    async def _build(self, key: str, image: str, workdir: Path) -> str:
+        """在一次性容器内构建 virtualenv, 返回构建输出"""
+        tmp = self.cache_dir / f'{key}.building'
+        await asyncio.to_thread(shutil.rmtree, tmp, True)
+        tmp.mkdir(parents=True, mode=0o777)
+        command = (
+            f"python -m venv {ENV_MOUNT_PATH} && "
+            f"if [ -f /app/requirements.txt ]; then {ENV_MOUNT_PATH}/bin/pip install -r /app/requirements.txt; fi && "
+            f"{ENV_MOUNT_PATH}/bin/pip install {' '.join(EXTRA_PACKAGES)}"
+        )
+        container = await docker_client.run_container(
+            image,
+            command=['sh', '-c', command],
+            detach=True,
+            volumes={
+                str(tmp): {'bind': ENV_MOUNT_PATH, 'mode': 'rw'},
+                str(workdir): {'bind': '/app', 'mode': 'ro'},
+                str(self.pip_cache_path): {'bind': PIP_CACHE_DIR, 'mode': 'rw'},
+            },
+        )
+        try:
+            result = await docker_client.wait(container)
+            output = (await docker_client.logs(container)).decode(errors='replace')
+        finally:
+            await docker_client.remove(container, force=True)
+        if result['StatusCode'] != 0:
+            await asyncio.to_thread(shutil.rmtree, tmp, True)
+            raise RuntimeError(f"构建依赖环境失败(exit={result['StatusCode']}): {output[-2000:]}")
+        await asyncio.to_thread(self._commit, key, image, tmp)
+        return output
+
+    def _commit(self, key: str, image: str, tmp: Path):
+        """构建完成后移动到最终目录再写 meta.json, meta.json 存在即代表环境可用"""
+        shutil.rmtree(self.env_path(key), ignore_errors=True)
+        tmp.rename(self.env_path(key))
+        (self.env_path(key) / 'meta.json').write_text(json.dumps({
+            'key': key,
+            'image': image,
+            'size': _dir_size(self.env_path(key)),
+            'created_at': time.time(),
+        }))
+
+    async def acquire(self, job_id: str, image: str, workdir: Path) -> Tuple[str, Path, str]:
+        """
+        获取任务的依赖环境, 不存在时构建
+        :return: (环境key, 主机环境目录, 构建输出; 命中缓存时为空)
+        """
+        requirements_path = workdir / 'requirements.txt'
+        requirements = await asyncio.to_thread(requirements_path.read_bytes) if requirements_path.exists() else b''
+        key = self.env_key(image, requirements)
+        self._leases[key] = self._leases.get(key, 0) + 1
+        output = ''
+        try:
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                if not self._read_meta(key):
+                    logger.info(f"构建依赖环境: {key} (image={image})")
+                    output = await self._build(key, image, workdir)
+                else:
+                    logger.info(f"命中依赖环境缓存: {key}")
+        except Exception:
+            self._leases[key] -= 1
+            raise
+        os.utime(self.env_path(key) / 'meta.json')  # 更新访问时间, 用于LRU淘汰
+        self._acquired[job_id] = key
+        await self.evict()
+        return key, self.env_path(key), output
+
+    def release(self, job_id: str):
+        """任务结束后释放环境引用"""
+        key = self._acquired.pop(job_id, None)
+        if key:
+            self._leases[key] = max(self._leases.get(key, 1) - 1, 0)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """列出所有缓存的环境"""
+        envs = []
+        for path in self.cache_dir.iterdir():
+            meta = self._read_meta(path.name)
+            if not meta:
+                continue
+            envs.append({
+                **meta,
+                'last_used': (path / 'meta.json').stat().st_mtime,
+                'in_use': self._leases.get(path.name, 0),
+            })
+        return sorted(envs, key=lambda e: e['last_used'], reverse=True)
+
+    async def purge(self, key: str | None = None) -> List[str]:
+        """删除指定(或全部)未被使用的环境, 返回已删除的key"""
+        purged = []
+        for env in self.list():
+            if key and env['key'] != key:
+                continue
+            if env['in_use']:
+                logger.warning(f"环境 {env['key']} 正在使用, 跳过删除")
+                continue
+            async with self._locks.setdefault(env['key'], asyncio.Lock()):
+                await asyncio.to_thread(shutil.rmtree, self.env_path(env['key']), True)
+            purged.append(env['key'])
+        return purged
+
+    async def evict(self):
+        """总大小超过上限时按LRU淘汰未被使用的环境"""
+        envs = self.list()
+        total = sum(env['size'] for env in envs)
+        for env in reversed(envs):
+            if total <= self.max_bytes:
+                break
+            if env['in_use']:
+                continue
+            logger.info(f"淘汰依赖环境: {env['key']} ({env['size']} bytes)")
+            await self.purge(env['key'])
+            total -= env['size']
+
+
+env_cache = EnvCache(ENV_CACHE_DIR, ENV_CACHE_MAX_BYTES, Path(__file__).parent / '.cache' / 'pip')
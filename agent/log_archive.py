@@ -0,0 +1,309 @@
+import asyncio
+import bisect
+import gzip
+import json
+import os
+import shutil
+import time
+
+from pathlib import Path
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Tuple
+from fastapi import Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from loguru import logger
+from const import (
+    LOG_ARCHIVE_CHUNK_BYTES,
+    LOG_COMPACT_CONCURRENCY,
+    LOG_COMPACT_DELAY,
+    LOG_COMPACT_INTERVAL,
+    LOG_HOST_DIR,
+    LOG_RETENTION_DAYS,
+    LOG_RETENTION_MAX_BYTES,
+    TASK_SETTINGS_MAP,
+)
+from log_tail import accepts_gzip, gzip_file, log_followers, read_file
+
+LOG_FILE = 'pytest.log'
+ARCHIVE_FILE = 'pytest.log.gz'
+INDEX_FILE = 'pytest.log.gz.idx'
+ARCHIVE_VERSION = 1
+GZIP_LEVEL = 6
+
+
+def compress_log(src: Path, chunk_size: int) -> Dict[str, Any]:
+    """
+    将日志压缩为多成员gzip(每 chunk_size 字节原始数据一个成员), 并写入索引
+    多成员gzip仍是标准gzip文件, 可直接用 gzip -d 解压; 按索引可只解压范围涉及的成员
+    """
+    archive = src.with_name(ARCHIVE_FILE)
+    index_path = src.with_name(INDEX_FILE)
+    tmp = archive.with_suffix('.gz.tmp')
+    members: List[List[int]] = []  # [原始偏移, 压缩偏移, 压缩长度]
+    raw_offset = compressed_offset = 0
+    with open(src, 'rb') as fin, open(tmp, 'wb') as fout:
+        while True:
+            chunk = fin.read(chunk_size)
+            if not chunk and members:
+                break
+            data = gzip.compress(chunk, compresslevel=GZIP_LEVEL, mtime=0)
+            fout.write(data)
+            members.append([raw_offset, compressed_offset, len(data)])
+            raw_offset += len(chunk)
+            compressed_offset += len(data)
+            if not chunk:
+                break
+    index = {
+        'version': ARCHIVE_VERSION,
+        'size': raw_offset,
+        'compressed_size': compressed_offset,
+        'mtime': src.stat().st_mtime,
+        'members': members,
+    }
+    tmp.rename(archive)
+    # 索引最后写入, 索引存在即代表归档完整
+    index_tmp = index_path.with_suffix('.idx.tmp')
+    index_tmp.write_text(json.dumps(index))
+    index_tmp.rename(index_path)
+    src.unlink()
+    return index
+
+
+class LogArchive:
+    """单个任务的压缩日志(只读)"""
+    def __init__(self, path: Path, index: Dict[str, Any]):
+        self.path = path
+        self.index = index
+        self.size: int = index['size']
+        self._starts = [member[0] for member in index['members']]
+
+    @classmethod
+    def open(cls, job_dir: Path) -> 'LogArchive | None':
+        """读取任务的归档, 不存在或不完整时返回None"""
+        try:
+            index = json.loads((job_dir / INDEX_FILE).read_text())
+        except (OSError, ValueError):
+            return None
+        return cls(job_dir / ARCHIVE_FILE, index)
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.size:x}-{int(self.index["mtime"]):x}"'
+
+    def _read_member(self, i: int) -> bytes:
+        _, compressed_offset, compressed_length = self.index['members'][i]
+        with open(self.path, 'rb') as f:
+            f.seek(compressed_offset)
+            return gzip.decompress(f.read(compressed_length))
+
+    async def iter_range(self, start: int, end: int) -> AsyncIterator[bytes]:
+        """解压并产出原始日志的 [start, end) 字节, 只解压涉及的成员"""
+        end = min(end, self.size)
+        i = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        while start < end and i < len(self._starts):
+            member_start = self._starts[i]
+            data = await asyncio.to_thread(self._read_member, i)
+            piece = data[start - member_start:end - member_start]
+            if piece:
+                yield piece
+            start = member_start + len(data)
+            i += 1
+
+    async def tail_offset(self, lines: int) -> int:
+        """最后 lines 行的起始字节偏移, 从最后一个成员向前解压"""
+        newlines = 0
+        for i in range(len(self._starts) - 1, -1, -1):
+            data = await asyncio.to_thread(self._read_member, i)
+            end = len(data) - 1 if i == len(self._starts) - 1 and data.endswith(b'\n') else len(data)
+            index = end
+            while True:
+                index = data.rfind(b'\n', 0, index)
+                if index < 0:
+                    break
+                newlines += 1
+                if newlines == lines:
+                    return self._starts[i] + index + 1
+        return 0
+
+
+def parse_range(header: str, size: int) -> Tuple[int, int] | None:
+    """
+    解析单个 Range(bytes=a-b / bytes=a- / bytes=-n), 返回 [start, end)
+    格式不支持时返回None(按完整内容响应), 范围不可满足时抛出ValueError
+    """
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        raise ValueError(f'unsatisfiable range: {header}')
+    return start, end
+
+
+def archive_response(archive: LogArchive, request: Request) -> Response:
+    """
+    下载已压缩的任务日志
+    客户端接受 gzip 且不是范围请求时直接发送归档文件; 否则只解压请求范围涉及的成员
+    """
+    headers = {"Vary": "Accept-Encoding", "Accept-Ranges": "bytes", "ETag": archive.etag}
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", archive.etag) != archive.etag:
+        range_header = None  # 内容已变化, 返回完整内容
+    if not range_header and accepts_gzip(request.headers.get("accept-encoding", "")):
+        headers["Content-Encoding"] = "gzip"
+        return FileResponse(archive.path, media_type="text/plain", headers=headers)
+
+    start, end, status_code = 0, archive.size, 200
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, archive.size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{archive.size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{archive.size}"
+    headers["Content-Length"] = str(end - start)
+    if request.method == "HEAD":
+        return Response(status_code=status_code, media_type="text/plain", headers=headers)
+    return StreamingResponse(archive.iter_range(start, end), status_code=status_code,
+                             media_type="text/plain", headers=headers)
+
+
+def log_file_response(f: BinaryIO, request: Request) -> Response:
+    """
+    下载未压缩的任务日志, f 为已打开的 pytest.log(响应结束时关闭)
+    从打开的文件读取, 期间日志被压缩归档、原文件被删除也不影响本次下载; ETag 与压缩后的归档一致, 续传不受压缩影响
+    """
+    file_stat = os.fstat(f.fileno())
+    size = file_stat.st_size
+    etag = f'"{size:x}-{int(file_stat.st_mtime):x}"'
+    headers = {"Vary": "Accept-Encoding", "Accept-Ranges": "bytes", "ETag": etag}
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) != etag:
+        range_header = None  # 内容已变化, 返回完整内容
+    if (request.method == "GET" and not range_header
+            and accepts_gzip(request.headers.get("accept-encoding", ""))):
+        headers["Content-Encoding"] = "gzip"
+        return StreamingResponse(gzip_file(f), media_type="text/plain", headers=headers)
+
+    start, end, status_code = 0, size, 200
+    if range_header:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            f.close()
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        if byte_range:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    headers["Content-Length"] = str(end - start)
+    if request.method == "HEAD":
+        f.close()
+        return Response(status_code=status_code, media_type="text/plain", headers=headers)
+    return StreamingResponse(read_file(f, start, end), status_code=status_code,
+                             media_type="text/plain", headers=headers)
+
+
+def _dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+class LogArchiveStore:
+    """
+    任务日志生命周期管理
+    后台压缩已结束任务的 pytest.log(并发数有限制), 并按保留天数和总大小清理旧任务的日志目录
+    """
+    def __init__(self, log_dir: Path, concurrency: int):
+        self.log_dir = log_dir
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @staticmethod
+    def job_id_of(job_dir: Path) -> str:
+        return job_dir.name[len('job_'):]
+
+    def is_active(self, job_id: str) -> bool:
+        """任务是否仍在运行或排队(日志还会增长)"""
+        task_info = TASK_SETTINGS_MAP.get(job_id)
+        return bool(task_info) and task_info.get('status') not in ('succeeded', 'failed', 'stopped')
+
+    def _compactable(self) -> List[Path]:
+        """已结束且超过 LOG_COMPACT_DELAY 秒未写入的任务日志"""
+        now = time.time()
+        candidates = []
+        for job_dir in self.log_dir.glob('job_*'):
+            log_path = job_dir / LOG_FILE
+            try:
+                mtime = log_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            job_id = self.job_id_of(job_dir)
+            # 仍有客户端在实时查看的日志暂不压缩
+            if now - mtime < LOG_COMPACT_DELAY or self.is_active(job_id) or job_id in log_followers.followers:
+                continue
+            candidates.append(log_path)
+        return candidates
+
+    async def _compact_one(self, log_path: Path):
+        async with self._semaphore:
+            try:
+                index = await asyncio.to_thread(compress_log, log_path, LOG_ARCHIVE_CHUNK_BYTES)
+                logger.info(f"压缩任务日志: {log_path} ({index['size']} -> {index['compressed_size']} bytes)")
+            except Exception as e:
+                logger.error(f"压缩任务日志失败: {log_path} ({e})")
+
+    async def compact(self):
+        """压缩所有符合条件的任务日志"""
+        candidates = await asyncio.to_thread(self._compactable)
+        await asyncio.gather(*(self._compact_one(path) for path in candidates))
+
+    def _expired(self) -> List[Path]:
+        """超过保留天数, 或总大小超限时最旧的任务日志目录"""
+        now = time.time()
+        job_dirs = []
+        for job_dir in self.log_dir.glob('job_*'):
+            if self.is_active(self.job_id_of(job_dir)):
+                continue
+            job_dirs.append((job_dir.stat().st_mtime, job_dir, _dir_size(job_dir)))
+        job_dirs.sort()
+        total = sum(size for _, _, size in job_dirs)
+        expired = []
+        for mtime, job_dir, size in job_dirs:
+            if now - mtime > LOG_RETENTION_DAYS * 86400 or total > LOG_RETENTION_MAX_BYTES:
+                expired.append(job_dir)
+                total -= size
+        return expired
+
+    async def enforce_retention(self):
+        """按保留策略删除旧任务的日志目录"""
+        for job_dir in await asyncio.to_thread(self._expired):
+            logger.info(f"清理过期任务日志: {job_dir}")
+            await asyncio.to_thread(shutil.rmtree, job_dir, True)
+
+    async def run(self):
+        """后台定时压缩和清理"""
+        while True:
+            try:
+                await self.compact()
+                await self.enforce_retention()
+            except Exception as e:
+                logger.error(f"任务日志压缩/清理失败: {e}")
+            await asyncio.sleep(LOG_COMPACT_INTERVAL)
+
+
+log_archive_store = LogArchiveStore(LOG_HOST_DIR, LOG_COMPACT_CONCURRENCY)
@@ -0,0 +1,316 @@
+import asyncio
+import os
+import zlib
+
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, Set, Tuple
+from loguru import logger
+
+try:
+    from watchfiles import awatch
+except ImportError:  # 未安装 watchfiles 时退化为轮询
+    awatch = None
+
+TAIL_BLOCK_SIZE = 64 * 1024  # 从文件末尾向前查找行首时每次读取的字节数
+READ_CHUNK_SIZE = 1024 * 1024  # 每次读取新增内容的最大字节数
+MAX_PARTIAL_LINE = 64 * 1024  # 未换行的内容超过该长度时不再等待换行, 直接推送
+POLL_INTERVAL = 0.2  # 轮询间隔(秒)
+SUBSCRIBER_QUEUE_SIZE = 256  # 每个订阅者缓存的数据块数, 超出后从文件补读
+FRAME_MAX_BYTES = int(os.getenv("LOG_FRAME_MAX_BYTES", str(64 * 1024)))  # 单个日志帧的最大字节数
+FRAME_MAX_DELAY = float(os.getenv("LOG_FRAME_MAX_DELAY_MS", "100")) / 1000  # 日志帧的最长合并等待时间
+GZIP_CHUNK_SIZE = 256 * 1024  # 压缩下载时每次读取的字节数
+GZIP_LEVEL = 6
+
+
+def tail_offset(path: Path, lines: int) -> int:
+    """从文件末尾向前查找, 返回最后 lines 行的起始字节偏移(不读取整个文件)"""
+    try:
+        with open(path, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            if lines <= 0 or end == 0:
+                return end
+            position = end
+            # 文件末尾的换行属于最后一行, 不计入
+            f.seek(end - 1)
+            newlines = -1 if f.read(1) == b'\n' else 0
+            while position > 0:
+                size = min(TAIL_BLOCK_SIZE, position)
+                position -= size
+                f.seek(position)
+                block = f.read(size)
+                index = len(block)
+                while True:
+                    index = block.rfind(b'\n', 0, index)
+                    if index < 0:
+                        break
+                    newlines += 1
+                    if newlines == lines:
+                        return position + index + 1
+            return 0
+    except FileNotFoundError:
+        return 0
+
+
+def read_range(path: Path, start: int, end: int | None = None) -> bytes:
+    """读取 [start, end) 字节, end 为 None 时读到文件末尾(最多 READ_CHUNK_SIZE)"""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(start)
+            size = READ_CHUNK_SIZE if end is None else min(end - start, READ_CHUNK_SIZE)
+            return f.read(size)
+    except FileNotFoundError:
+        return b''
+
+
+def _file_size(path: Path) -> int:
+    try:
+        return os.stat(path).st_size
+    except FileNotFoundError:
+        return 0
+
+
+class LogFollower:
+    """
+    跟踪单个任务的日志文件, 同一任务的所有订阅者共用一个跟踪协程
+    文件变化通过 inotify(watchfiles) 通知, 不可用时轮询; 文件读取都在线程中执行
+    推送的数据块都以完整的行结尾, 并带有在文件中的字节偏移
+    """
+    def __init__(self, path: Path, offset: int):
+        self.path = path
+        self.offset = offset  # 已推送给订阅者的字节数
+        self.subscribers: Set[asyncio.Queue] = set()
+        self._stop = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _changes(self) -> AsyncIterator[None]:
+        """文件可能有新内容时产出"""
+        if awatch is not None and self.path.parent.exists():
+            # 先读一次: 订阅后、开始监听前写入的内容不会产生文件事件
+            yield
+            try:
+                # 超时也产出一次, 补读开始读取到监听生效之间写入的内容
+                async for _ in awatch(
+                    self.path.parent,
+                    watch_filter=lambda change, path: path == str(self.path),
+                    stop_event=self._stop,
+                    debounce=200,
+                    step=20,
+                    yield_on_timeout=True,
+                    recursive=False,
+                ):
+                    yield
+                return
+            except Exception as e:
+                # inotify 不可用(如达到 max_user_watches 上限)时退化为轮询
+                logger.warning(f"监听日志文件失败, 改为轮询: {self.path} ({e})")
+        while not self._stop.is_set():
+            yield
+            await asyncio.sleep(POLL_INTERVAL)
+
+    async def _read_new(self):
+        """读取新增的完整行并推送给订阅者"""
+        while True:
+            if await asyncio.to_thread(_file_size, self.path) < self.offset:
+                logger.warning(f"日志文件被截断, 从头开始跟踪: {self.path}")
+                self.offset = 0
+            data = await asyncio.to_thread(read_range, self.path, self.offset)
+            if not data:
+                return
+            cut = data.rfind(b'\n') + 1
+            if cut == 0:
+                if len(data) < MAX_PARTIAL_LINE:
+                    return  # 等待这一行写完
+                cut = len(data)
+            chunk = (self.offset, data[:cut])
+            self.offset += cut
+            for queue in self.subscribers:
+                try:
+                    queue.put_nowait(chunk)
+                except asyncio.QueueFull:
+                    pass  # 订阅者发现偏移不连续时会从文件补读
+            if len(data) < READ_CHUNK_SIZE:
+                return
+
+    async def _run(self):
+        try:
+            async for _ in self._changes():
+                await self._read_new()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"跟踪日志文件失败: {self.path} ({e})")
+
+
+class LogSubscription:
+    """单个订阅者: 先补发历史内容, 再接收跟踪协程推送的新内容"""
+    def __init__(self, path: Path, start: int, history_end: int, queue: asyncio.Queue):
+        self.path = path
+        self.offset = start  # 已交给调用方的字节偏移
+        self.history_end = history_end
+        self.queue = queue
+
+    async def _read_until(self, end: int) -> AsyncIterator[Tuple[int, bytes]]:
+        """从文件读取 [self.offset, end) 的内容"""
+        while self.offset < end:
+            data = await asyncio.to_thread(read_range, self.path, self.offset, end)
+            if not data:
+                return
+            yield self.offset, data
+            self.offset += len(data)
+
+    async def __aiter__(self) -> AsyncIterator[Tuple[int, bytes]]:
+        """产出 (字节偏移, 数据)"""
+        async for chunk in self._read_until(self.history_end):
+            yield chunk
+        while True:
+            offset, data = await self.queue.get()
+            if offset < self.offset:
+                if offset != 0:
+                    continue  # 已从文件补读过
+                self.offset = 0  # 日志文件被截断后重新开始
+            if offset > self.offset:
+                # 队列满时丢弃过的数据, 从文件补读
+                async for chunk in self._read_until(offset):
+                    yield chunk
+            yield offset, data
+            self.offset = offset + len(data)
+
+
+class LogFollowerRegistry:
+    """按任务管理日志跟踪协程, 最后一个订阅者退出时停止跟踪"""
+    def __init__(self):
+        self.followers: Dict[str, LogFollower] = {}
+
+    @asynccontextmanager
+    async def subscribe(self, job_id: str, path: Path, lines: int = 500, offset: int | None = None):
+        """
+        订阅任务日志
+        :param lines: 从最后 lines 行开始推送
+        :param offset: 从指定字节偏移开始推送(优先于 lines)
+        """
+        start = offset if offset is not None else await asyncio.to_thread(tail_offset, path, lines)
+        follower = self.followers.get(job_id)
+        if follower is None:
+            follower = LogFollower(path, await asyncio.to_thread(_file_size, path))
+            # 等待期间可能已有其他订阅者创建了跟踪协程
+            if job_id in self.followers:
+                follower = self.followers[job_id]
+            else:
+                self.followers[job_id] = follower
+                follower.start()
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # 登记和记录历史截止偏移在同一次调度中完成, 之后的新内容都会进入队列
+        follower.subscribers.add(queue)
+        subscription = LogSubscription(path, min(start, follower.offset), follower.offset, queue)
+        try:
+            yield subscription
+        finally:
+            follower.subscribers.discard(queue)
+            if not follower.subscribers and self.followers.get(job_id) is follower:
+                follower.stop()
+                del self.followers[job_id]
+
+
+async def coalesce(
+    chunks: AsyncIterator[Tuple[int, bytes]],
+    max_bytes: int = FRAME_MAX_BYTES,
+    max_delay: float = FRAME_MAX_DELAY,
+) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    将连续的日志数据块合并成帧: 累计超过 max_bytes 或第一块数据已等待 max_delay 秒时产出
+    帧尽量在换行处切分, 产出 (字节偏移, 数据)
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    pending: asyncio.Future | None = None
+    buffer = bytearray()
+    start = 0
+    deadline = 0.0
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(deadline - loop.time(), 0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                yield start, bytes(buffer)
+                start += len(buffer)
+                buffer.clear()
+                continue
+            try:
+                offset, data = pending.result()
+            except StopAsyncIteration:
+                if buffer:
+                    yield start, bytes(buffer)
+                return
+            finally:
+                pending = None
+            if buffer and offset != start + len(buffer):
+                # 偏移不连续(日志文件被截断), 先发出已合并的内容
+                yield start, bytes(buffer)
+                buffer.clear()
+            if not buffer:
+                start = offset
+                deadline = loop.time() + max_delay
+            buffer += data
+            while len(buffer) >= max_bytes:
+                cut = buffer.rfind(b'\n', 0, max_bytes) + 1 or buffer.find(b'\n', max_bytes) + 1 or len(buffer)
+                yield start, bytes(buffer[:cut])
+                start += cut
+                del buffer[:cut]
+                deadline = loop.time() + max_delay
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Accept-Encoding 是否接受 gzip(忽略 q=0)"""
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding.strip().lower() == "gzip":
+            return params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+async def gzip_file(f: BinaryIO) -> AsyncIterator[bytes]:
+    """边读边压缩已打开的文件(结束后关闭), 读取和压缩都在线程中执行"""
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def read_and_compress() -> bytes | None:
+        chunk = f.read(GZIP_CHUNK_SIZE)
+        return compressor.compress(chunk) if chunk else None
+
+    try:
+        while (data := await asyncio.to_thread(read_and_compress)) is not None:
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+async def read_file(f: BinaryIO, start: int, end: int) -> AsyncIterator[bytes]:
+    """产出已打开文件的 [start, end) 字节(结束后关闭), 读取在线程中执行"""
+    def read_chunk() -> bytes:
+        f.seek(start)
+        return f.read(min(end - start, READ_CHUNK_SIZE))
+
+    try:
+        while start < end and (data := await asyncio.to_thread(read_chunk)):
+            start += len(data)
+            yield data
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+log_followers = LogFollowerRegistry()
@@ -1,12 +1,11 @@
 import asyncio
-import os
 import signal
 import sys
-import aiofiles
 
-from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
+
 from loguru import logger
-from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi import FastAPI, HTTPException, Request, WebSocket
 import docker
 import docker.errors
 
@@ -16,14 +15,26 @@ from const import (
     TASK_SETTINGS_MAP,
     TaskRunRequest,
 )
+from env_cache import env_cache
+from repo_cache import repo_cache
+from log_tail import coalesce, log_followers
+from log_archive import LogArchive, archive_response, log_file_response
+from platform_client import platform_client
+from scheduler import scheduler
+from warm_pool import warm_pool
 from utils import (
     DockerContainerHandler,
-    stream_full_log_file,
     trigger_container_stop_hooks,
 )
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await platform_client.close()  # 关闭与平台的长连接
+
+
+app = FastAPI(lifespan=lifespan)
 
 def signal_handler(signum, frame):
     """
@@ -44,6 +55,12 @@ logger.info(f"LOG_HOST_DIR: {LOG_HOST_DIR}")
 @app.post("/tasks/{job_id}/stop")
 async def stop_task(job_id: str):
     """停止任务"""
+    if scheduler.cancel(job_id):
+        # 排队中的任务还没有容器, 直接出队即可
+        TASK_SETTINGS_MAP[job_id]["status"] = "stopped"
+        await trigger_container_stop_hooks(job_id, TASK_SETTINGS_MAP[job_id])
+        del TASK_SETTINGS_MAP[job_id]
+        return {"job_id": job_id, "status": "stopped"}
     try:
         # 初始化容器处理器，调用stop方法停止容器
         container_handler = DockerContainerHandler(job_id)
@@ -62,40 +79,27 @@ async def get_task_status(job_id: str):
     """获取任务状态"""
     if job_id not in TASK_SETTINGS_MAP:
         raise HTTPException(status_code=404, detail="Task not found")
-    return TASK_SETTINGS_MAP[job_id]
+    return {**TASK_SETTINGS_MAP[job_id], "queue_position": scheduler.queue_position(job_id)}
 
 
-@app.get("/tasks/{job_id}/log")
-async def download_log(job_id: str):
-    """下载任务日志（流式响应）"""
-    log_path = f"{LOG_HOST_DIR}/job_{job_id}/pytest.log"
-
-    # 获取文件大小用于Content-Length头
+@app.api_route("/tasks/{job_id}/log", methods=["GET", "HEAD"])
+async def download_log(job_id: str, request: Request):
+    """
+    下载任务日志
+    支持 Range/If-Range 断点续传和 HEAD 请求; 客户端接受 gzip 且不是范围请求时压缩传输
+    """
+    job_dir = LOG_HOST_DIR / f"job_{job_id}"
+    log_path = job_dir / "pytest.log"
     try:
-        file_stat = await asyncio.to_thread(os.stat, log_path)
-        file_size = file_stat.st_size
-    except Exception as e:
-        print(f"[Agent Error] Failed to get file size: {e}")
-        file_size = None
-
-    async def log_stream():
-        try:
-            async with aiofiles.open(log_path, mode='rb') as f:
-                while True:
-                    chunk = await f.read(1024)
-                    if not chunk:
-                        break
-                    yield chunk
-                    await asyncio.sleep(0)  # 让出事件循环，避免长时间占用
-        except Exception as e:
-            print(f"[Agent Error] Streaming failed: {e}")
-
-    # 构建响应头
-    headers = {}
-    if file_size is not None:
-        headers["Content-Length"] = str(file_size)
-    # 返回流式响应，媒体类型为纯文本
-    return StreamingResponse(log_stream(), media_type="text/plain", headers=headers)
+        # 只打开一次, 之后从该文件读取(后台压缩可能随时删除 pytest.log)
+        f = await asyncio.to_thread(open, log_path, 'rb')
+    except FileNotFoundError:
+        # 已结束任务的日志会被压缩归档
+        archive = await asyncio.to_thread(LogArchive.open, job_dir)
+        if archive is None:
+            raise HTTPException(status_code=404, detail="Log not found")
+        return archive_response(archive, request)
+    return log_file_response(f, request)
 
 
 @app.get("/tasks", tags=['task'])
@@ -144,25 +148,111 @@ async def execute_task(task_info: TaskRunRequest):
         "container_id": None,
         "env_vars": task_info.env_vars,
         "server": task_info.server,
+        "case_durations": task_info.case_durations,
+        "cpus": task_info.cpus,
     }
-    # 创建容器处理器并异步启动任务（不阻塞当前请求）
+    # 创建容器处理器并交给调度器（有空闲槽位立即启动，否则排队，不阻塞当前请求）
     container_handler = DockerContainerHandler(tasks_key)
-    # 异步执行容器运行逻辑
-    asyncio.create_task(container_handler.run())
-    return TASK_SETTINGS_MAP[tasks_key]
+    scheduler.submit(tasks_key, container_handler.run)
+    return {**TASK_SETTINGS_MAP[tasks_key], "queue_position": scheduler.queue_position(tasks_key)}
 
 
 @app.websocket("/ws/logs/{job_id}")
-async def ws_logs(websocket: WebSocket, job_id: str):
-    """WebSocket 实时日志推送"""
+async def ws_logs(websocket: WebSocket, job_id: str, offset: int | None = None):
+    """
+    WebSocket 实时日志推送
+    每条消息是一个JSON帧 {"offset": 起始字节偏移, "next": 结束字节偏移, "data": 日志内容},
+    多行日志按大小或时间合并成一帧; 断线重连时携带 ?offset=<上一帧的next> 只接收缺失的内容
+    """
     # 建立WebSocket连接
     await websocket.accept()
-    log_path = f"{LOG_HOST_DIR}/job_{job_id}/pytest.log"
-    await stream_full_log_file(log_path, websocket)
+    job_dir = LOG_HOST_DIR / f"job_{job_id}"
+    log_path = job_dir / "pytest.log"
+
+    archive = None if log_path.exists() else await asyncio.to_thread(LogArchive.open, job_dir)
+    if archive is not None:
+        # 日志已压缩归档(任务早已结束), 推送完历史内容后关闭连接
+        start = offset if offset is not None else await archive.tail_offset(500)
+
+        async def archived_chunks():
+            position = start
+            async for data in archive.iter_range(start, archive.size):
+                yield position, data
+                position += len(data)
+
+        async for frame_start, data in coalesce(archived_chunks(), max_delay=0):
+            await websocket.send_json({
+                "offset": frame_start,
+                "next": frame_start + len(data),
+                "data": data.decode(errors='replace'),
+            })
+        await websocket.close()
+        return
+
+    async def push():
+        # 同一任务的所有连接共用一个日志跟踪协程, 未指定偏移时先推送最后500行再推送新增内容
+        async with log_followers.subscribe(job_id, log_path, lines=500, offset=offset) as subscription:
+            async for start, data in coalesce(subscription):
+                await websocket.send_json({
+                    "offset": start,
+                    "next": start + len(data),
+                    "data": data.decode(errors='replace'),
+                })
+
+    async def wait_disconnect():
+        # 日志没有新内容时也能及时发现客户端断开, 释放订阅
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    tasks = [asyncio.create_task(push()), asyncio.create_task(wait_disconnect())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # 客户端断开时发送会抛出异常, 这里统一回收
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+@app.get("/warm_pool", tags=['cache'])
+async def warm_pool_stats():
+    """预热容器池状态: 各镜像的空闲容器数、命中/未命中次数、淘汰次数"""
+    return warm_pool.stats()
+
+
+@app.get("/env_cache", tags=['cache'])
+async def list_env_cache():
+    """列出缓存的依赖环境"""
+    return env_cache.list()
+
+
+@app.delete("/env_cache", tags=['cache'])
+async def purge_env_cache():
+    """清空所有未被使用的依赖环境"""
+    return {"purged": await env_cache.purge()}
+
+
+@app.delete("/env_cache/{key}", tags=['cache'])
+async def delete_env_cache(key: str):
+    """删除指定的依赖环境"""
+    if not any(env['key'] == key for env in env_cache.list()):
+        raise HTTPException(status_code=404, detail="Env not found")
+    purged = await env_cache.purge(key)
+    if not purged:
+        raise HTTPException(status_code=409, detail="Env is in use")
+    return {"purged": purged}
 
 
 @app.get("/heartbeat")
 async def heartbeat():
-    """服务心跳检测"""
+    """服务心跳检测, 同时上报容量(槽位使用情况、已缓存的镜像和仓库)供平台调度任务"""
     logger.debug(TASK_SETTINGS_MAP)
-    return {"status": "alive"}
+    envs, repos = await asyncio.gather(asyncio.to_thread(env_cache.list), asyncio.to_thread(repo_cache.cached_repos))
+    return {
+        "status": "alive",
+        "scheduler": scheduler.stats(),
+        "images": sorted({env["image"] for env in envs}),
+        "repos": repos,
+    }
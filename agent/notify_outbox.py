@@ -0,0 +1,194 @@
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from loguru import logger
+from const import (
+    CACHE_DIR,
+    NOTIFY_BATCH_SIZE,
+    NOTIFY_MAX_BACKOFF,
+    SERVER_IP,
+)
+from platform_client import platform_client
+
+BASE_BACKOFF = 1.0  # 首次重试的等待时间(秒)
+IDLE_INTERVAL = 30.0  # 没有待发送通知时的最长等待时间(秒)
+
+
+def _is_permanent(status_code: int) -> bool:
+    """任务记录不存在等 4xx 错误重试也不会成功(超时和限流除外)"""
+    return 400 <= status_code < 500 and status_code not in (408, 429)
+
+
+class NotifyOutbox:
+    """
+    容器停止通知的本地发件箱(SQLite, WAL模式)
+    停止hook只把通知写入发件箱, 由后台协程异步发送; 同一任务的多条通知合并为最新的一条,
+    发送失败按指数退避重试, 平台确认后才删除(至少一次), 平台恢复后按批发送积压的通知
+    """
+    def __init__(self, db_path: Path, batch_size: int, max_backoff: float):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.max_backoff = max_backoff
+        self._conn: sqlite3.Connection | None = None
+        # 连接在 asyncio.to_thread 的多个线程中使用, sqlite3 连接不能并发使用, 所有访问都持有该锁
+        self._db_lock = threading.Lock()
+        self._wakeup: asyncio.Event | None = None
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """调用方需持有 _db_lock"""
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS outbox ("
+                " job_id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " version INTEGER NOT NULL DEFAULT 1,"  # 每次合并+1, 删除时校验, 避免删掉发送期间写入的新通知
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt REAL NOT NULL,"
+                " created_at REAL NOT NULL)"
+            )
+            self._conn = conn
+        return self._conn
+
+    @property
+    def wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _put(self, job_id: str, payload: Dict[str, Any]):
+        now = time.time()
+        with self._db_lock:
+            self.conn.execute(
+                "INSERT INTO outbox (job_id, payload, next_attempt, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(job_id) DO UPDATE SET payload=excluded.payload, version=version+1, "
+                "attempts=0, next_attempt=excluded.next_attempt",
+                (job_id, json.dumps(payload), now, now),
+            )
+
+    async def enqueue(self, job_id: str, payload: Dict[str, Any]):
+        """写入通知(同一任务未发送的通知被替换为最新的一条)并唤醒发送协程"""
+        await asyncio.to_thread(self._put, job_id, payload)
+        self.wakeup.set()
+
+    def _due(self) -> List[Tuple[str, Dict[str, Any], int, int]]:
+        with self._db_lock:
+            rows = self.conn.execute(
+                "SELECT job_id, payload, version, attempts FROM outbox WHERE next_attempt <= ? "
+                "ORDER BY next_attempt LIMIT ?",
+                (time.time(), self.batch_size),
+            ).fetchall()
+        return [(job_id, json.loads(payload), version, attempts) for job_id, payload, version, attempts in rows]
+
+    def _next_due_in(self) -> float:
+        with self._db_lock:
+            row = self.conn.execute("SELECT MIN(next_attempt) FROM outbox").fetchone()
+        if row[0] is None:
+            return IDLE_INTERVAL
+        return min(max(row[0] - time.time(), 0.0), IDLE_INTERVAL)
+
+    def _ack(self, delivered: List[Tuple[str, int]]):
+        with self._db_lock:
+            self.conn.executemany("DELETE FROM outbox WHERE job_id = ? AND version = ?", delivered)
+
+    def _retry(self, failed: List[Tuple[str, int, int]]):
+        now = time.time()
+        with self._db_lock:
+            self.conn.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt = ? WHERE job_id = ? AND version = ?",
+                [
+                    (attempts + 1, now + self._backoff(attempts), job_id, version)
+                    for job_id, version, attempts in failed
+                ],
+            )
+
+    def _backoff(self, attempts: int) -> float:
+        """指数退避加随机抖动"""
+        delay = min(BASE_BACKOFF * 2 ** attempts, self.max_backoff)
+        return random.uniform(delay / 2, delay)
+
+    def pending(self) -> int:
+        """待发送的通知数"""
+        with self._db_lock:
+            return self.conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    async def _send_batch(self, items: List[Tuple[str, Dict[str, Any], int, int]]) -> Dict[str, bool]:
+        """
+        批量发送, 返回 job_id -> 是否已处理完成(成功, 或平台明确拒绝且重试无意义)
+        """
+        url = f"{SERVER_IP}/api/test_task/record/container_stops"
+        body = {"items": [{"job_id": int(job_id), **payload} for job_id, payload, _, _ in items]}
+        async with platform_client.session.post(url, json=body) as response:
+            if response.status in (404, 405):
+                # 平台版本较旧, 没有批量接口
+                return await self._send_each(items)
+            if response.status != 200:
+                logger.warning(f"批量发送容器停止通知失败: {response.status} {await response.text()}")
+                return {job_id: False for job_id, _, _, _ in items}
+            data = await response.json()
+        done = {job_id: True for job_id, _, _, _ in items}
+        for failure in data.get("failed", []):
+            job_id = str(failure["job_id"])
+            permanent = _is_permanent(failure.get("status_code", 500))  # 重试无意义的直接丢弃
+            if permanent:
+                logger.error(f"平台拒绝任务 {job_id} 的容器停止通知: {failure.get('detail')}")
+            done[job_id] = permanent
+        return done
+
+    async def _send_each(self, items: List[Tuple[str, Dict[str, Any], int, int]]) -> Dict[str, bool]:
+        done = {}
+        for job_id, payload, _, _ in items:
+            url = f"{SERVER_IP}/api/test_task/record/{job_id}/container_stop"
+            async with platform_client.session.post(url, json=payload) as response:
+                done[job_id] = response.status == 200 or _is_permanent(response.status)
+                if response.status != 200:
+                    logger.warning(f"发送任务 {job_id} 的容器停止通知失败: {response.status} {await response.text()}")
+        return done
+
+    async def flush(self) -> int:
+        """发送所有到期的通知, 返回已处理的条数"""
+        total = 0
+        while items := await asyncio.to_thread(self._due):
+            try:
+                done = await self._send_batch(items)
+            except Exception as e:
+                logger.warning(f"发送容器停止通知失败, 稍后重试: {e}")
+                done = {}
+            delivered = [(job_id, version) for job_id, _, version, _ in items if done.get(job_id)]
+            failed = [(job_id, version, attempts) for job_id, _, version, attempts in items if not done.get(job_id)]
+            await asyncio.to_thread(self._ack, delivered)
+            await asyncio.to_thread(self._retry, failed)
+            total += len(delivered)
+            if delivered:
+                logger.info(f"已发送 {len(delivered)} 条容器停止通知")
+            if failed:
+                break  # 平台暂不可用, 等待退避结束
+        return total
+
+    async def run(self):
+        """后台发送协程"""
+        while True:
+            self.wakeup.clear()
+            try:
+                await self.flush()
+                timeout = await asyncio.to_thread(self._next_due_in)
+            except Exception as e:
+                logger.error(f"容器停止通知发件箱处理失败: {e}")
+                timeout = IDLE_INTERVAL
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+
+notify_outbox = NotifyOutbox(CACHE_DIR / 'notify_outbox.db', NOTIFY_BATCH_SIZE, NOTIFY_MAX_BACKOFF)
@@ -0,0 +1,37 @@
+import aiohttp
+
+from const import PLATFORM_HTTP_KEEPALIVE, PLATFORM_HTTP_POOL_SIZE
+
+
+class PlatformClient:
+    """
+    向平台发送通知(容器停止、补报结果)的共用会话
+    复用长连接, 避免每次通知都重新建立TCP连接; 在agent关闭时释放
+    """
+    def __init__(self, pool_size: int, keepalive: int):
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """首次使用时创建(需要在事件循环中)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=30, sock_connect=5),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+platform_client = PlatformClient(PLATFORM_HTTP_POOL_SIZE, PLATFORM_HTTP_KEEPALIVE)
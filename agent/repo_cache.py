@@ -0,0 +1,172 @@
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+from loguru import logger
+from const import REPO_CACHE_DIR, REPO_CACHE_MAX_MIRRORS, WORKTREE_DIR
+
+REPO_URL_FILE = 'platform-repo-url'  # 镜像目录内记录仓库地址(不含认证信息)的文件
+
+
+class GitCommandError(RuntimeError):
+    """git 命令执行失败"""
+
+
+async def run_git(*args: str, cwd: Path | None = None) -> str:
+    """异步执行git命令, 返回标准输出"""
+    proc = await asyncio.create_subprocess_exec(
+        'git', *args,
+        cwd=str(cwd) if cwd else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env={**os.environ, 'GIT_TERMINAL_PROMPT': '0'},
+    )
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise GitCommandError(f"git {args[0]} failed: {stderr.decode(errors='replace').strip()}")
+    return stdout.decode().strip()
+
+
+class RepoCache:
+    """
+    仓库镜像缓存
+    每个仓库在主机上保留一份 bare mirror, 任务只增量 fetch 新对象,
+    再通过 worktree 检出到任务目录, 挂载进容器, 避免每次全量 clone
+    """
+    def __init__(self, cache_dir: Path, worktree_dir: Path, max_mirrors: int):
+        self.cache_dir = cache_dir
+        self.worktree_dir = worktree_dir
+        self.max_mirrors = max_mirrors
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.worktree_dir.mkdir(parents=True, exist_ok=True)
+        self._locks: Dict[str, asyncio.Lock] = {}  # 每个仓库一把锁
+        self._fetch_started: Dict[str, float] = {}  # 最近一次fetch的开始时间
+        self._leases: Dict[str, int] = {}  # 正在使用的镜像引用计数
+        self._checkouts: Dict[str, Tuple[str, Path]] = {}  # job_id -> (仓库key, worktree路径)
+
+    @staticmethod
+    def normalize_url(repo: str) -> str:
+        """去掉认证信息、协议和 .git 后缀的仓库地址, 如 gitlab.com/group/project"""
+        url = repo.split('@', 1)[-1] if repo.startswith('https://') and '@' in repo else repo
+        url = url.replace('https://', '').rstrip('/')
+        if url.endswith('.git'):
+            url = url[:-4]
+        return url
+
+    @classmethod
+    def repo_key(cls, repo: str) -> str:
+        """根据仓库地址生成缓存key(去掉认证信息)"""
+        return hashlib.sha1(cls.normalize_url(repo).encode()).hexdigest()[:16]
+
+    def mirror_path(self, key: str) -> Path:
+        """镜像仓库路径"""
+        return self.cache_dir / f'{key}.git'
+
+    def index_path(self, repo_url: str) -> Path:
+        """用例索引目录(与镜像放在一起, 随镜像一起淘汰)"""
+        path = self.mirror_path(self.repo_key(repo_url)) / 'case-index'
+        path.mkdir(parents=True, exist_ok=True, mode=0o777)
+        return path
+
+    async def _ensure_mirror(self, key: str, repo_url: str):
+        """创建镜像或增量拉取, 并发任务共享同一次fetch"""
+        requested_at = time.monotonic()
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            mirror = self.mirror_path(key)
+            if self._fetch_started.get(key, 0) >= requested_at and mirror.exists():
+                # 等锁期间已有其他任务完成了fetch, 直接复用
+                return
+            started_at = time.monotonic()
+            if not mirror.exists():
+                logger.info(f"创建仓库镜像: {mirror}")
+                tmp = mirror.with_suffix('.tmp')
+                await asyncio.to_thread(shutil.rmtree, tmp, True)
+                await run_git('clone', '--mirror', repo_url, str(tmp))
+                tmp.rename(mirror)
+            else:
+                logger.info(f"增量拉取仓库镜像: {mirror}")
+                await run_git('remote', 'set-url', 'origin', repo_url, cwd=mirror)
+                await run_git('fetch', '--prune', 'origin', cwd=mirror)
+            self._fetch_started[key] = started_at
+            (mirror / REPO_URL_FILE).write_text(self.normalize_url(repo_url))
+            os.utime(mirror)  # 更新访问时间, 用于LRU淘汰
+
+    async def checkout(self, job_id: str, repo_url: str, branch: str) -> Tuple[Path, str]:
+        """
+        为任务检出代码
+        :return: (worktree路径, commit sha)
+        """
+        key = self.repo_key(repo_url)
+        self._leases[key] = self._leases.get(key, 0) + 1
+        try:
+            await self._ensure_mirror(key, repo_url)
+            mirror = self.mirror_path(key)
+            worktree = self.worktree_dir / f'job_{job_id}'
+            async with self._locks[key]:
+                if worktree.exists():
+                    await self._remove_worktree(mirror, worktree)
+                await run_git('worktree', 'add', '--detach', '--force', str(worktree), branch, cwd=mirror)
+                commit = await run_git('rev-parse', 'HEAD', cwd=worktree)
+        except Exception:
+            self._leases[key] -= 1
+            raise
+        self._checkouts[job_id] = (key, worktree)
+        await self.evict()
+        return worktree, commit
+
+    async def _remove_worktree(self, mirror: Path, worktree: Path):
+        """删除worktree(容器内以root写入的文件也一并清理)"""
+        try:
+            await run_git('worktree', 'remove', '--force', str(worktree), cwd=mirror)
+        except GitCommandError as e:
+            logger.warning(f"删除worktree失败, 直接删除目录: {e}")
+        await asyncio.to_thread(shutil.rmtree, worktree, True)
+        await run_git('worktree', 'prune', cwd=mirror)
+
+    async def release(self, job_id: str):
+        """任务结束后释放worktree"""
+        checkout = self._checkouts.pop(job_id, None)
+        if not checkout:
+            return
+        key, worktree = checkout
+        try:
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                await self._remove_worktree(self.mirror_path(key), worktree)
+        except Exception as e:
+            logger.error(f"释放任务 {job_id} 的worktree失败: {e}")
+        finally:
+            self._leases[key] = max(self._leases.get(key, 1) - 1, 0)
+
+    def cached_repos(self) -> List[str]:
+        """已缓存镜像的仓库地址(去掉认证信息), 上报给平台用于任务调度"""
+        repos = []
+        for mirror in self.cache_dir.glob('*.git'):
+            try:
+                repos.append((mirror / REPO_URL_FILE).read_text().strip())
+            except OSError:
+                continue
+        return repos
+
+    async def evict(self):
+        """按最近使用时间(LRU)淘汰多余的镜像, 正在使用的镜像不淘汰"""
+        mirrors = sorted(self.cache_dir.glob('*.git'), key=lambda p: p.stat().st_mtime)
+        excess = len(mirrors) - self.max_mirrors
+        for mirror in mirrors:
+            if excess <= 0:
+                break
+            key = mirror.name[:-len('.git')]
+            if self._leases.get(key):
+                continue
+            logger.info(f"淘汰仓库镜像: {mirror}")
+            async with self._locks.setdefault(key, asyncio.Lock()):
+                await asyncio.to_thread(shutil.rmtree, mirror, True)
+            self._fetch_started.pop(key, None)
+            excess -= 1
+
+
+repo_cache = RepoCache(REPO_CACHE_DIR, WORKTREE_DIR, REPO_CACHE_MAX_MIRRORS)
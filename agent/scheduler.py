@@ -0,0 +1,82 @@
+import asyncio
+import os
+
+from collections import OrderedDict
+from typing import Any, Callable, Coroutine, Dict, Set
+from loguru import logger
+from const import AGENT_MAX_JOBS, JOB_MEMORY_BYTES, TASK_SETTINGS_MAP
+
+
+def default_slots() -> int:
+    """根据CPU核数和内存计算可同时运行的任务数"""
+    cpus = os.cpu_count() or 1
+    try:
+        memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return cpus
+    return max(1, min(cpus, memory // JOB_MEMORY_BYTES))
+
+
+class JobScheduler:
+    """
+    任务准入控制
+    同时运行的任务数不超过 slots, 超出的任务进入队列(状态为 queued), 有空闲槽位时按先进先出启动
+    """
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.running: Set[str] = set()
+        self.queue: OrderedDict[str, Callable[[], Coroutine[Any, Any, None]]] = OrderedDict()
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def submit(self, job_id: str, run: Callable[[], Coroutine[Any, Any, None]]):
+        """提交任务, 有空闲槽位时立即启动, 否则排队"""
+        if len(self.running) < self.slots:
+            self._start(job_id, run)
+        else:
+            self.queue[job_id] = run
+            TASK_SETTINGS_MAP[job_id]["status"] = "queued"
+            logger.info(f"任务 {job_id} 进入队列, 排队位置: {len(self.queue)}")
+
+    def _start(self, job_id: str, run: Callable[[], Coroutine[Any, Any, None]]):
+        self.running.add(job_id)
+        if TASK_SETTINGS_MAP.get(job_id, {}).get("status") == "queued":
+            TASK_SETTINGS_MAP[job_id]["status"] = "created"
+        self._tasks[job_id] = asyncio.create_task(self._run(job_id, run))
+
+    async def _run(self, job_id: str, run: Callable[[], Coroutine[Any, Any, None]]):
+        try:
+            await run()
+        finally:
+            self.running.discard(job_id)
+            self._tasks.pop(job_id, None)
+            self._drain()
+
+    def _drain(self):
+        """启动排队中的任务直到槽位用满"""
+        while self.queue and len(self.running) < self.slots:
+            job_id, run = self.queue.popitem(last=False)
+            logger.info(f"任务 {job_id} 出队启动")
+            self._start(job_id, run)
+
+    def queue_position(self, job_id: str) -> int | None:
+        """任务在队列中的位置(从1开始), 不在队列中返回None"""
+        for position, queued_id in enumerate(self.queue, start=1):
+            if queued_id == job_id:
+                return position
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """取消排队中的任务(不涉及容器操作), 任务不在队列中返回False"""
+        return self.queue.pop(job_id, None) is not None
+
+    def stats(self) -> Dict[str, int]:
+        """槽位使用情况"""
+        return {
+            "slots": self.slots,
+            "running": len(self.running),
+            "queued": len(self.queue),
+            "free_slots": max(self.slots - len(self.running), 0),
+        }
+
+
+scheduler = JobScheduler(AGENT_MAX_JOBS or default_slots())
@@ -8,7 +8,25 @@
 import os
 import ast
 import argparse
+import hashlib
+import heapq
+import json
 import sys
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+INDEX_VERSION = 2
+INDEX_FILE = 'case_index.json'
+# 跳过一些常见的非测试目录
+EXCLUDED_DIRS = {'.git', '__pycache__', '.pytest_cache', 'TestLog'}
+# 文件数少于该值时不启用进程池（进程启动开销大于收益）
+PARALLEL_MIN_FILES = 64
+# 每次 pytest 调用最多传入的测试文件数，避免命令行超长
+PYTEST_BATCH_FILES = 200
+# 测试环境配置文件，并行执行时由父进程写入一次，worker 不再写入
+ENV_CONFIG_FILE = '/app/env.json'
+ENV_CONFIG_READY = 'ENV_CONFIG_READY'
 
 
 def extract_case_id_from_function(func_node):
@@ -41,59 +59,209 @@ def extract_case_id_from_function(func_node):
     return case_id
 
 
-def find_test_methods_in_file(file_path):
+def parse_test_methods(content, file_path):
     """
-    在指定的文件中查找所有以 'test_' 开头的函数，并提取其用例编号。
+    解析文件内容，查找所有以 'test_' 开头的函数（包括类中的方法），并提取其用例编号。
+    返回的 nodeid 为 pytest 可识别的 "文件::类::函数" 格式。
     """
     test_methods = []
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
         tree = ast.parse(content, filename=file_path)
     except SyntaxError as e:
         print(f"⚠️  文件 {file_path} 存在语法错误: {e}", file=sys.stderr)
         return test_methods
+
+    def visit(body, scope):
+        for node in body:
+            if isinstance(node, ast.ClassDef):
+                visit(node.body, scope + [node.name])
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name.startswith('test_'):
+                case_id = extract_case_id_from_function(node)
+                if case_id:
+                    qualname = '::'.join(scope + [node.name])
+                    test_methods.append({
+                        'file_path': file_path,
+                        'function_name': node.name,
+                        'qualname': qualname,
+                        'nodeid': f"{file_path}::{qualname}",
+                        'case_id': case_id
+                    })
+
+    visit(tree.body, [])
+    return test_methods
+
+
+def find_test_methods_in_file(file_path):
+    """
+    在指定的文件中查找所有以 'test_' 开头的函数，并提取其用例编号。
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            content = f.read()
     except Exception as e:
         print(f"⚠️  读取文件 {file_path} 时出错: {e}", file=sys.stderr)
-        return test_methods
+        return []
+    return parse_test_methods(content, file_path)
 
-    for node in ast.walk(tree):
-        if isinstance(node, ast.FunctionDef) and node.name.startswith('test_'):
-            case_id = extract_case_id_from_function(node)
-            if case_id:
-                test_methods.append({
-                    'file_path': file_path,
-                    'function_name': node.name,
-                    'case_id': case_id
-                })
-    return test_methods
+
+def _parse_file_if_changed(args):
+    """
+    进程池任务：读取文件并计算内容哈希，哈希与已知值不同时才解析。
+    返回 (文件路径, 哈希, 用例列表)，未变化时用例列表为 None，读取失败时哈希为 None。
+    """
+    file_path, known_sha1 = args
+    try:
+        with open(file_path, 'rb') as f:
+            content = f.read()
+    except Exception as e:
+        print(f"⚠️  读取文件 {file_path} 时出错: {e}", file=sys.stderr)
+        return file_path, None, None
+    digest = hashlib.sha1(content).hexdigest()
+    if digest == known_sha1:
+        return file_path, digest, None
+    return file_path, digest, parse_test_methods(content, file_path)
 
 
-def scan_project_for_test_cases(project_root, case_ids):
+def parse_files(tasks, jobs=1):
     """
-    扫描项目目录，查找匹配指定用例编号的测试用例。
+    批量解析文件，jobs > 1 时将文件分散到多个进程并合并结果（保持输入顺序）。
+    :param tasks: [(文件路径, 已知哈希或None), ...]
     """
-    matched_cases = []
+    if jobs <= 1 or len(tasks) < PARALLEL_MIN_FILES:
+        return [_parse_file_if_changed(task) for task in tasks]
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_parse_file_if_changed, tasks, chunksize=chunksize))
 
-    for root, _, files in os.walk(project_root):
-        # 跳过一些常见的非测试目录
-        if any(part in root for part in ['.git', '__pycache__', '.pytest_cache', 'TestLog']):
-            continue
-            
+
+def iter_test_files(project_root):
+    """
+    遍历项目目录下所有 test_*.py 文件，遍历时直接剪掉排除的目录。
+    """
+    for root, dirs, files in os.walk(project_root):
+        dirs[:] = [d for d in dirs if d not in EXCLUDED_DIRS]
         for file in files:
             if file.startswith('test_') and file.endswith('.py'):
-                file_path = os.path.join(root, file)
-                test_methods = find_test_methods_in_file(file_path)
-                for method_info in test_methods:
-                    if method_info['case_id'] in case_ids:
-                        matched_cases.append(method_info)
+                yield os.path.join(root, file)
+
+
+def load_index(index_dir, project_root):
+    """
+    加载磁盘上的用例索引，格式不兼容或项目根目录不一致时返回空索引。
+    索引结构: {"version", "root", "commit", "files": {相对路径: {"sha1", "cases": [...]}}}
+    """
+    empty = {'version': INDEX_VERSION, 'root': project_root, 'commit': None, 'files': {}}
+    try:
+        with open(os.path.join(index_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if index.get('version') != INDEX_VERSION or index.get('root') != project_root:
+        return empty
+    return index
+
+
+def save_index(index_dir, index):
+    """
+    原子写入用例索引（先写临时文件再替换，避免并发任务读到半个文件）。
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    # 索引目录由多个容器共享，容器内的 pid 经常相同，临时文件名必须唯一
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=f'{INDEX_FILE}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.chmod(tmp_path, 0o644)  # mkstemp 创建的文件只有属主可读
+        os.replace(tmp_path, os.path.join(index_dir, INDEX_FILE))
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def update_index(index, project_root, jobs=1):
+    """
+    增量更新索引：只重新解析内容哈希发生变化的文件。
+    """
+    tasks = []
+    for file_path in iter_test_files(project_root):
+        entry = index['files'].get(os.path.relpath(file_path, project_root))
+        tasks.append((file_path, entry['sha1'] if entry else None))
+
+    files = {}
+    reparsed = 0
+    for file_path, digest, methods in parse_files(tasks, jobs):
+        if digest is None:
+            continue
+        rel_path = os.path.relpath(file_path, project_root)
+        if methods is None:
+            files[rel_path] = index['files'][rel_path]
+            continue
+        files[rel_path] = {
+            'sha1': digest,
+            'cases': [
+                {'function_name': m['function_name'], 'qualname': m['qualname'], 'case_id': m['case_id']}
+                for m in methods
+            ],
+        }
+        reparsed += 1
+    index['files'] = files
+    return reparsed
+
 
+def build_case_lookup(index, project_root):
+    """
+    构建 用例编号 -> 用例信息列表 的字典，查找时为 O(1)。
+    """
+    lookup = {}
+    for rel_path, entry in index['files'].items():
+        file_path = os.path.join(project_root, rel_path)
+        for case in entry['cases']:
+            lookup.setdefault(case['case_id'], []).append({
+                'file_path': file_path,
+                'function_name': case['function_name'],
+                'qualname': case['qualname'],
+                'nodeid': f"{file_path}::{case['qualname']}",
+                'case_id': case['case_id'],
+            })
+    return lookup
+
+
+def scan_project_for_test_cases(project_root, case_ids, index_dir=None, commit=None, jobs=1):
+    """
+    扫描项目目录，查找匹配指定用例编号的测试用例。
+    指定 index_dir 时使用磁盘索引: 同一 commit 直接命中索引，否则只重新解析变更的文件。
+    jobs > 1 时使用多进程解析。
+    """
+    if not index_dir:
+        matched_cases = []
+        tasks = [(file_path, None) for file_path in iter_test_files(project_root)]
+        for _, _, methods in parse_files(tasks, jobs):
+            for method_info in methods or []:
+                if method_info['case_id'] in case_ids:
+                    matched_cases.append(method_info)
+        return matched_cases
+
+    index = load_index(index_dir, project_root)
+    if not commit or index.get('commit') != commit:
+        reparsed = update_index(index, project_root, jobs)
+        index['commit'] = commit
+        try:
+            save_index(index_dir, index)
+        except OSError as e:
+            print(f"⚠️  保存用例索引失败: {e}", file=sys.stderr)
+        print(f"🔍 用例索引已更新, 重新解析 {reparsed}/{len(index['files'])} 个文件", file=sys.stderr)
+    else:
+        print(f"🔍 命中用例索引: {commit}", file=sys.stderr)
+
+    lookup = build_case_lookup(index, project_root)
+    matched_cases = []
+    for case_id in dict.fromkeys(case_ids):
+        matched_cases.extend(lookup.get(case_id, []))
     return matched_cases
 
 
 def main():
     import time
-    import subprocess
     st = time.time()
     parser = argparse.ArgumentParser(description='通过用例编号查找匹配的测试用例路径。')
     parser.add_argument('case_ids', metavar='CASE_ID', type=str, nargs='+',
@@ -104,6 +272,16 @@ def main():
                         help='执行pytest测试')
     parser.add_argument('--pytest-args', type=str, default='',
                         help='传递给pytest的额外参数')
+    parser.add_argument('--index-dir', type=str, default=None,
+                        help='用例索引目录，指定后增量更新并复用索引')
+    parser.add_argument('--commit', type=str, default=None,
+                        help='当前代码的commit，与索引一致时跳过扫描')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='解析用例的进程数 (默认: 1, 0 表示按容器CPU配额自动计算)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行执行用例的pytest进程数 (默认: 1, 0 表示按容器CPU配额自动计算)')
+    parser.add_argument('--durations-file', type=str, default=None,
+                        help='历史用例耗时文件 (JSON: {用例编号: 秒})，用于并行执行时按耗时分片')
 
     args = parser.parse_args()
 
@@ -115,31 +293,172 @@ def main():
     # print(f"🔍 正在扫描项目目录: {project_root}")
     # print(f"🔍 查找用例编号: {args.case_ids}")
 
-    matched_cases = scan_project_for_test_cases(project_root, args.case_ids)
+    jobs = args.jobs if args.jobs > 0 else detect_cpu_quota()
+    matched_cases = scan_project_for_test_cases(
+        project_root, args.case_ids, index_dir=args.index_dir, commit=args.commit, jobs=jobs)
 
     if not matched_cases:
         print("❌ 未找到匹配的测试用例。")
         sys.exit(1)
 
     # print(f"✅ 找到 {len(matched_cases)} 个匹配的测试用例:")
-    path_list = []
-    for case in matched_cases:
-        # 输出格式可以是 pytest 可识别的格式
-        nodeid = f"{case['file_path']}"
-        path_list.append(nodeid)
+    # 输出格式为 pytest 可识别的 nodeid，只执行选中的用例而不是整个文件
+    nodeids = list(dict.fromkeys(case['nodeid'] for case in matched_cases))
 
     if args.run:
-        # 构造pytest命令
-        pytest_cmd = ["pytest", "-sv", "-p", "test_runner_plugin"] + path_list
-        if args.pytest_args:
-            pytest_cmd += args.pytest_args.split()
-        print(f"🚀 执行命令: {' '.join(pytest_cmd)}")
-        # 执行pytest命令
-        result = subprocess.run(pytest_cmd)
-        sys.exit(result.returncode)
+        pytest_args = args.pytest_args.split() if args.pytest_args else []
+        workers = args.workers if args.workers > 0 else detect_cpu_quota()
+        if workers > 1 and len(matched_cases) > 1:
+            durations = load_durations(args.durations_file)
+            sys.exit(run_pytest_parallel(matched_cases, durations, workers, pytest_args))
+        sys.exit(run_pytest(nodeids, pytest_args))
     else:
-        print(' '.join(path_list))
+        print(' '.join(nodeids))
     # print(f"✅ 耗时: {time.time() - st} 秒")
 
+
+def run_pytest(nodeids, pytest_args, batch_files=PYTEST_BATCH_FILES, prefix=None):
+    """
+    执行选中的用例。
+    nodeid 列表写入参数文件，由 test_runner_plugin 在收集阶段按 nodeid 过滤；
+    命令行只传入去重后的测试文件，并按 batch_files 分批执行，避免命令行超长。
+    指定 prefix 时（并行执行），输出逐行加上前缀后打印，便于区分日志所属的 worker。
+    """
+    import subprocess
+
+    files = list(dict.fromkeys(nodeid.split('::', 1)[0] for nodeid in nodeids))
+    with tempfile.NamedTemporaryFile('w', prefix='case_nodeids_', suffix='.txt', delete=False) as f:
+        f.write('\n'.join(nodeids))
+        nodeids_file = f.name
+
+    returncode = 0
+    try:
+        for i in range(0, len(files), batch_files):
+            batch = files[i:i + batch_files]
+            pytest_cmd = ["pytest", "-sv", "-p", "test_runner_plugin",
+                          "--case-nodeids-file", nodeids_file] + batch + pytest_args
+            _print_line(prefix, f"🚀 执行命令: {' '.join(pytest_cmd)}")
+            if prefix is None:
+                result = subprocess.run(pytest_cmd)
+                returncode = returncode or result.returncode
+                continue
+            with subprocess.Popen(pytest_cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                  text=True, errors='replace', bufsize=1) as proc:
+                for line in proc.stdout:
+                    _print_line(prefix, line.rstrip('\n'))
+            returncode = returncode or proc.returncode
+    finally:
+        os.remove(nodeids_file)
+    return returncode
+
+
+_print_lock = threading.Lock()
+
+
+def _print_line(prefix, line):
+    """并行执行时多个 worker 共用标准输出，按行加锁打印"""
+    with _print_lock:
+        print(f"{prefix} {line}" if prefix else line, flush=True)
+
+
+def detect_cpu_quota():
+    """
+    获取容器可用的CPU数：优先读取 cgroup 的 CPU 配额，其次是CPU亲和性，最后是CPU核数。
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = None
+    try:
+        # cgroup v2: "<quota> <period>" 或 "max <period>"
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            value, period = f.read().split()
+        if value != 'max':
+            quota = int(value) / int(period)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                value = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+            if value > 0:
+                quota = value / period
+        except (OSError, ValueError):
+            pass
+    if quota:
+        cpus = min(cpus, max(1, int(quota)))
+    return max(1, cpus)
+
+
+def load_durations(durations_file):
+    """加载历史用例耗时 {用例编号: 秒}"""
+    if not durations_file:
+        return {}
+    try:
+        with open(durations_file, 'r', encoding='utf-8') as f:
+            return {k: float(v) for k, v in json.load(f).items() if v is not None}
+    except (OSError, ValueError) as e:
+        print(f"⚠️  读取用例耗时文件失败: {e}", file=sys.stderr)
+        return {}
+
+
+def shard_cases(matched_cases, durations, workers):
+    """
+    按历史耗时将用例分配到各个 worker：耗时长的先分配，每次分给当前总耗时最小的 worker（LPT）。
+    没有历史耗时的用例按已知耗时的中位数估算。
+    """
+    known = sorted(durations.values())
+    default = known[len(known) // 2] if known else 1.0
+    cases = sorted(
+        dict((case['nodeid'], case) for case in matched_cases).values(),
+        key=lambda case: durations.get(case['case_id'], default),
+        reverse=True,
+    )
+    shards = [[] for _ in range(min(workers, len(cases)))]
+    heap = [(0.0, i) for i in range(len(shards))]
+    for case in cases:
+        load, i = heapq.heappop(heap)
+        shards[i].append(case['nodeid'])
+        heapq.heappush(heap, (load + durations.get(case['case_id'], default), i))
+    return shards
+
+
+def write_env_config(path=ENV_CONFIG_FILE):
+    """
+    写入测试环境配置（先写临时文件再替换，读取方不会看到写了一半的文件），
+    并通过环境变量通知 pytest worker 配置已就绪。
+    """
+    config = json.loads(os.environ.get('WALLY_CONFIG', '{}'))
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.env.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(config, f, indent=4, ensure_ascii=False)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    os.environ[ENV_CONFIG_READY] = '1'
+
+
+def run_pytest_parallel(matched_cases, durations, workers, pytest_args):
+    """
+    在容器内启动多个 pytest 进程并行执行用例，每个 worker 的日志带 [w<编号>] 前缀。
+    用例结果由 test_runner_plugin 按用例上报，与 worker 无关。
+    """
+    # 各 worker 共用同一个工作目录，配置文件只在这里写一次
+    write_env_config()
+    shards = shard_cases(matched_cases, durations, workers)
+    print(f"🚀 并行执行: {len(shards)} 个 worker, 用例数: {[len(shard) for shard in shards]}", flush=True)
+    with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+        futures = [
+            executor.submit(run_pytest, shard, pytest_args, PYTEST_BATCH_FILES, f"[w{i}]")
+            for i, shard in enumerate(shards)
+        ]
+        returncodes = [future.result() for future in futures]
+    return next((code for code in returncodes if code), 0)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+from test_runner_plugin import find_test_cases
+from test_runner_plugin.find_test_cases import detect_cpu_quota, shard_cases
+
+
+def _cases(*case_ids):
+    return [{'case_id': case_id, 'nodeid': f'test_a.py::test_{case_id}'} for case_id in case_ids]
+
+
+def test_shard_cases_balances_by_duration():
+    durations = {'A': 7, 'B': 5, 'C': 4, 'D': 3, 'E': 1}
+    shards = shard_cases(_cases('A', 'B', 'C', 'D', 'E'), durations, 2)
+    loads = sorted(sum(durations[nodeid.rsplit('_', 1)[-1]] for nodeid in shard) for shard in shards)
+    assert loads == [10, 10]
+
+
+def test_shard_cases_uses_median_for_unknown_cases():
+    # 未知耗时按中位数(5)估算, 先分配耗时最长的 A
+    shards = shard_cases(_cases('A', 'B', 'X'), {'A': 9, 'B': 5, 'C': 1}, 2)
+    assert shards == [['test_a.py::test_A'], ['test_a.py::test_B', 'test_a.py::test_X']]
+
+
+def test_shard_cases_never_creates_empty_shards():
+    shards = shard_cases(_cases('A', 'B'), {}, 8)
+    assert len(shards) == 2
+    assert sorted(nodeid for shard in shards for nodeid in shard) == ['test_a.py::test_A', 'test_a.py::test_B']
+
+
+def test_shard_cases_dedups_nodeids():
+    cases = _cases('A') + [{'case_id': 'A2', 'nodeid': 'test_a.py::test_A'}]
+    assert shard_cases(cases, {}, 4) == [['test_a.py::test_A']]
+
+
+def _fake_cgroup(monkeypatch, files, cpus=16):
+    def fake_open(path, *args, **kwargs):
+        if path not in files:
+            raise FileNotFoundError(path)
+        return io.StringIO(files[path])
+    monkeypatch.setattr(find_test_cases, 'open', fake_open, raising=False)
+    monkeypatch.setattr(find_test_cases.os, 'sched_getaffinity', lambda pid: set(range(cpus)), raising=False)
+
+
+@pytest.mark.parametrize('files, expected', [
+    ({'/sys/fs/cgroup/cpu.max': '250000 100000\n'}, 2),  # cgroup v2, 2.5 核向下取整
+    ({'/sys/fs/cgroup/cpu.max': 'max 100000\n'}, 16),  # 不限制时使用CPU亲和性
+    ({'/sys/fs/cgroup/cpu.max': '50000 100000\n'}, 1),  # 不足 1 核时至少 1 个
+    ({'/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '400000', '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000'}, 4),
+    ({'/sys/fs/cgroup/cpu/cpu.cfs_quota_us': '-1', '/sys/fs/cgroup/cpu/cpu.cfs_period_us': '100000'}, 16),
+    ({}, 16),
+])
+def test_detect_cpu_quota(monkeypatch, files, expected):
+    _fake_cgroup(monkeypatch, files)
+    assert detect_cpu_quota() == expected
+
+
+def test_detect_cpu_quota_is_capped_by_affinity(monkeypatch):
+    _fake_cgroup(monkeypatch, {'/sys/fs/cgroup/cpu.max': '800000 100000\n'}, cpus=4)
+    assert detect_cpu_quota() == 4
+
+
+def test_write_env_config_marks_ready(monkeypatch, tmp_path):
+    monkeypatch.setenv('WALLY_CONFIG', '{"dut": "10.0.0.1"}')
+    monkeypatch.delenv(find_test_cases.ENV_CONFIG_READY, raising=False)
+    path = tmp_path / 'env.json'
+    find_test_cases.write_env_config(str(path))
+    assert path.read_text(encoding='utf-8').startswith('{')
+    assert '"dut": "10.0.0.1"' in path.read_text(encoding='utf-8')
+    assert list(tmp_path.iterdir()) == [path]
+    assert find_test_cases.os.environ[find_test_cases.ENV_CONFIG_READY] == '1'
+
+
+def test_save_index_replaces_atomically(tmp_path):
+    index = {'version': find_test_cases.INDEX_VERSION, 'root': '/app/test_case', 'commit': 'abc', 'files': {}}
+    find_test_cases.save_index(str(tmp_path), index)
+    find_test_cases.save_index(str(tmp_path), {**index, 'commit': 'def'})
+    assert find_test_cases.load_index(str(tmp_path), '/app/test_case')['commit'] == 'def'
+    assert [path.name for path in tmp_path.iterdir()] == [find_test_cases.INDEX_FILE]
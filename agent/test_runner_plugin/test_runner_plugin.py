@@ -2,6 +2,9 @@ import re
 import inspect
 import json
 import os
+import queue
+import random
+import threading
 import time
 import pytest
 import requests
@@ -11,6 +14,120 @@ case_start_time = {}
 SERVER_IP = os.environ.get("SERVER_IP")
 TASK_ID = os.environ.get("TASK_ID")
 CONFIG = os.environ.get("WALLY_CONFIG", "{}")
+REPORT_BATCH_SIZE = int(os.environ.get("REPORT_BATCH_SIZE", "20"))  # 攒够多少条结果上报一次
+REPORT_FLUSH_INTERVAL = int(os.environ.get("REPORT_FLUSH_INTERVAL_MS", "500")) / 1000  # 最长多久上报一次
+REPORT_QUEUE_SIZE = int(os.environ.get("REPORT_QUEUE_SIZE", "1000"))  # 待上报队列上限
+REPORT_MAX_RETRIES = int(os.environ.get("REPORT_MAX_RETRIES", "3"))  # 上报失败重试次数
+RESULT_JOURNAL_DIR = os.environ.get("RESULT_JOURNAL_DIR", "/logs")  # 未上报结果的落盘目录, 容器退出后由 agent 补报
+
+
+class ResultReporter:
+    """
+    后台上报测试结果
+    测试进程只把结果放入有界队列, 由后台线程按条数/时间批量上报并带退避重试,
+    上报失败或队列已满的结果写入本地 journal, 容器退出后由 agent 补报
+    """
+    _STOP = object()
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=REPORT_QUEUE_SIZE)
+        self.session = requests.Session()
+        self.journal_path = os.path.join(RESULT_JOURNAL_DIR, f"unsent_results.{os.getpid()}.jsonl")
+        self._journal_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="result-reporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, result):
+        """提交一条结果（不阻塞测试进程）"""
+        try:
+            self.queue.put_nowait(result)
+        except queue.Full:
+            logger.warning(f'❗上报队列已满, 结果写入本地: {result["result"]["case_node"]}')
+            self._spill([result])
+
+    def close(self, timeout=30):
+        """测试结束时上报剩余结果"""
+        self.queue.put(self._STOP)
+        self._thread.join(timeout)
+        # 超时未发完的结果落盘
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                leftover.append(item)
+        if leftover:
+            self._spill(leftover)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is self._STOP:
+                self._flush(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + REPORT_FLUSH_INTERVAL
+            if len(batch) >= REPORT_BATCH_SIZE or (deadline is not None and time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+                deadline = None
+
+    def _flush(self, batch):
+        """批量上报一批结果，失败的写入 journal"""
+        if not batch:
+            return
+        if not self._send_with_retry(batch):
+            self._spill(batch)
+
+    def _send_with_retry(self, batch):
+        payload = {
+            "record_id": TASK_ID,
+            "results": [result["result"] for result in batch],
+        }
+        for attempt in range(REPORT_MAX_RETRIES + 1):
+            try:
+                response = self.session.post(f'{SERVER_IP}/api/test_task/case_results', json=payload, timeout=10)
+                if response.status_code == 200:
+                    data = response.json()
+                    logger.info(f'✅ 上报结果成功, {data["succeeded"]}/{len(batch)}')
+                    for failure in data.get("failed", []):
+                        # 单条失败（如用例记录不存在）重试也不会成功, 只记录
+                        logger.error(f'❗上报结果出错, {failure["case_index"]}: {failure["detail"]}')
+                    return True
+                logger.error(f'❗批量上报结果出错, status: {response.status_code}')
+                logger.debug(json.dumps(payload, indent=4, ensure_ascii=False))
+                logger.debug(response.text)
+                if response.status_code < 500:
+                    # 4xx 重试也不会成功, 交给 agent 补报时再处理
+                    return False
+            except Exception as e:
+                logger.error(f'❗批量上报结果出错: {e}')
+            if attempt < REPORT_MAX_RETRIES:
+                # 指数退避 + 抖动
+                time.sleep(min(0.5 * 2 ** attempt, 5) * (0.5 + random.random()))
+        return False
+
+    def _spill(self, results):
+        """将未上报的结果追加到 journal"""
+        try:
+            with self._journal_lock, open(self.journal_path, 'a', encoding='utf-8') as f:
+                for result in results:
+                    f.write(json.dumps(result, ensure_ascii=False) + '\n')
+        except OSError as e:
+            logger.error(f'❗写入未上报结果失败: {e}')
+
+
+reporter = None
 
 
 def _send_test_result(item, report, start_time):
@@ -29,26 +146,73 @@ def _send_test_result(item, report, start_time):
                 "duration": int(duration)
             }
         }
-        response = requests.post(f'{SERVER_IP}/api/test_task/case_result', json=result)
-        if response.status_code != 200:
-            logger.error(f'❗上报结果出错, {item.nodeid}')
-            logger.debug(json.dumps(result, indent=4))
-            logger.debug(response.json())
-        else:
-            logger.info(f'✅ 上报结果成功, {response.json()}')
+        reporter.submit(result)
     except Exception as e:
-        logger.error(f'❗上报结果出错, {item.nodeid}')
-        logger.debug(e.with_traceback(Exception.__traceback__))
+        logger.error(f'❗上报结果出错, {item.nodeid}: {e}')
+
+
+def pytest_addoption(parser):
+    """注册插件参数"""
+    parser.addoption(
+        "--case-nodeids-file", action="store", default=None,
+        help="只执行文件中列出的用例 nodeid (每行一个)",
+    )
+
+
+def _item_key(item, qualname):
+    """用例的 绝对路径::类::函数 标识"""
+    return f"{getattr(item, 'path', item.fspath)}::{qualname}"
+
+
+def pytest_collection_modifyitems(session, config, items):
+    """按 nodeid 文件过滤收集到的用例"""
+    nodeids_file = config.getoption("--case-nodeids-file")
+    if not nodeids_file:
+        return
+    with open(nodeids_file, 'r', encoding='utf-8') as f:
+        selected = {line.strip() for line in f if line.strip()}
+
+    selected_items, deselected_items = [], []
+    matched = set()
+    keys = []
+    for item in items:
+        # 参数化用例 nodeid 形如 test_fn[param]，按基础 nodeid 匹配所有参数组合
+        qualname = item.nodeid.split('::', 1)[-1].split('[', 1)[0]
+        key = _item_key(item, qualname)
+        keys.append((item, key))
+        if key in selected:
+            matched.add(key)
+
+    # 未精确匹配的 nodeid 退化为按 文件+函数名 匹配（如继承的测试方法、动态生成的类）
+    fallback = {
+        (nodeid.split('::', 1)[0], nodeid.rsplit('::', 1)[-1])
+        for nodeid in selected - matched
+    }
+    for item, key in keys:
+        name = getattr(item, 'originalname', None) or item.name.split('[', 1)[0]
+        if key in matched or (str(getattr(item, 'path', item.fspath)), name) in fallback:
+            selected_items.append(item)
+        else:
+            deselected_items.append(item)
+
+    if fallback:
+        logger.warning(f"⚠️ 以下用例未精确匹配, 按函数名匹配: {sorted(selected - matched)}")
+    if deselected_items:
+        config.hook.pytest_deselected(items=deselected_items)
+        items[:] = selected_items
 
 
 @pytest.hookimpl(tryfirst=True)
 def pytest_configure(config):
     """在 pytest 配置阶段创建 config.json 文件"""
+    global reporter
+    reporter = ResultReporter()
     try:
-        with open('/app/env.json', 'w', encoding='utf-8') as f:
-            json.dump(json.loads(CONFIG), f, indent=4, ensure_ascii=False)
-
-        logger.info(f"✅ 配置文件已创建: /app/env.json")
+        # 并行执行时配置文件已由父进程写入, 各 worker 只读取
+        if not os.environ.get("ENV_CONFIG_READY"):
+            with open('/app/env.json', 'w', encoding='utf-8') as f:
+                json.dump(json.loads(CONFIG), f, indent=4, ensure_ascii=False)
+            logger.info(f"✅ 配置文件已创建: /app/env.json")
         with open('/app/env.json', 'r', encoding='utf-8') as f:
             config_content = json.load(f)
             logger.info(f"✅ 配置内容: {json.dumps(config_content, indent=4, ensure_ascii=False)}")
@@ -56,6 +220,12 @@ def pytest_configure(config):
         logger.error(f"❌ 创建配置文件失败: {str(e)}")
 
 
+def pytest_unconfigure(config):
+    """测试结束, 等待剩余结果上报完成"""
+    if reporter:
+        reporter.close()
+
+
 @pytest.hookimpl(hookwrapper=True, trylast=True)
 def pytest_runtest_makereport(item, call):
     """ runtest hook"""
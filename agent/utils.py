@@ -1,56 +1,31 @@
 import asyncio
 import os
 import socket
-import aiohttp
 import json
 import consul
-import docker
 import docker.errors
 
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Callable, Union, Coroutine, Any, Dict
 from loguru import logger
-from fastapi import WebSocket
 from const import (
     CONTAINER_STOP_HOOKS,
     GITLAB_ACCESS_TOKEN,
+    CONTAINER_LABEL,
     LOG_HOST_DIR,
+    RECONCILE_INTERVAL,
     SERVER_IP,
     TASK_SETTINGS_MAP,
 )
-
-client = docker.DockerClient(base_url='unix://var/run/docker.sock')
-
-async def stream_full_log_file(log_path: str, websocket: WebSocket):
-    """WebSocket 日志实时推送"""
-    # 检查文件行数，如果超过500行则只读取最后500行
-    max_lines = 500
-    with open(log_path, "r") as f:
-        lines = f.readlines()
-
-    if len(lines) > max_lines:
-        # 发送最近500行历史日志
-        for line in lines[-max_lines:]:
-            await websocket.send_text(line.strip())
-        # 记录当前文件读取位置
-        position = len(''.join(lines))
-    else:
-        # 发送所有历史日志
-        for line in lines:
-            await websocket.send_text(line.strip())
-        position = len(''.join(lines))
-
-    # 实时监听日志文件新增内容
-    with open(log_path, "r") as f:
-        # 跳到上次读取的位置
-        f.seek(position)
-        while True:
-            line = f.readline()
-            if not line:
-                await asyncio.sleep(0.2)
-                continue
-            await websocket.send_text(line.strip())
+from repo_cache import repo_cache
+from env_cache import ENV_MOUNT_PATH, env_cache
+from docker_adapter import docker_client
+from container_events import TERMINAL_STATUSES, container_events, container_labels
+from log_archive import log_archive_store
+from platform_client import platform_client
+from notify_outbox import notify_outbox
+from warm_pool import warm_pool
 
 
 def get_plugin_path():
@@ -89,11 +64,15 @@ class DockerContainerHandler:
         self.pip_cache_path = Path(__file__).parent / '.cache' / 'pip'  # pip缓存路径（加速依赖安装）
         self.pip_cache_path.mkdir(parents=True, exist_ok=True, mode=0o777)  # 创建目录（权限777）
         self.pytest_log_path = "/logs/pytest.log"  # 容器内测试日志路径
+        self.workdir: Path | None = None  # 主机上的代码检出目录（挂载到容器 /app）
+        self.env_path: Path | None = None  # 主机上缓存的依赖环境目录（只读挂载到容器 /venv）
+        self.index_path: Path | None = None  # 主机上的用例索引目录（挂载到容器 /index）
+        self.mirror_path: Path | None = None  # 主机上的仓库镜像（worktree 的 .git 指向这里）
 
     async def stop(self):
         """停止容器并清理任务记录"""
-        # 同步调用Docker SDK的stop方法（通过asyncio.to_thread适配同步函数）
-        await asyncio.to_thread(self.container.stop)
+        # Docker SDK 调用在专用线程池中执行，不阻塞事件循环
+        await docker_client.stop(await self.get_container())
         # 触发容器停止钩子（如向平台发送通知）
         await trigger_container_stop_hooks(self.job_id, TASK_SETTINGS_MAP[self.job_id])
         # 从全局任务字典中删除该任务
@@ -101,15 +80,14 @@ class DockerContainerHandler:
             del TASK_SETTINGS_MAP[self.job_id]
         return {"job_id": self.job_id, "status": "stopped"}
 
-    @property
-    def container(self):
+    async def get_container(self):
         """获取当前任务对应的Docker容器实例"""
-        return client.containers.get(self.container_name)
+        return await docker_client.get_container(self.container_name)
 
     @property
     async def logs(self):
         """获取容器日志(返回Docker原生日志)"""
-        return self.container.logs()
+        return await docker_client.logs(await self.get_container())
 
     @property
     def env_vars(self):
@@ -121,28 +99,29 @@ class DockerContainerHandler:
 
     async def delete(self):
         """强制删除容器并清理任务记录"""
-        await asyncio.to_thread(self.container.remove, force=True)  # 强制删除（即使容器运行中）
+        await docker_client.remove(await self.get_container(), force=True)  # 强制删除（即使容器运行中）
         if self.job_id in TASK_SETTINGS_MAP:
             del TASK_SETTINGS_MAP[self.job_id]
 
     async def get_task_cmd(self):
         """生成容器内执行测试的Shell命令"""
         task_info = TASK_SETTINGS_MAP[self.job_id]
-        # 构建Shell命令（分步骤执行：拉代码→装依赖→执行测试→归档日志）
+        # 指定了CPU配额时按配额并行执行(--workers 0 在容器内按 cgroup 配额计算), 否则串行执行
+        workers = 0 if task_info.get('cpus') else 1
+        # 构建Shell命令（分步骤执行：执行测试→归档日志，镜像内有pigz时多线程压缩），代码和依赖环境已由主机准备并挂载
         command = f"""\
             ( \
-            echo '🐳 Git clone test repo' && \
-            git clone --depth=1 -b {task_info['branch']} {self.git_repo} /app && \
-            echo '🐳 Install requirements' && \
-            pip install -r /app/requirements.txt && \
-            pip install requests && \
-            pip install loguru && \
+            echo '🐳 Use cached test repo: {task_info['branch']}@{task_info.get('commit', '')}' && \
+            echo '🐳 Use cached env: {task_info.get('env_key', '')}' && \
+            export PATH={ENV_MOUNT_PATH}/bin:$PATH && \
             echo '🐳 Run pytest' && \
             echo '🐳 Case indices: {self.cases_index}' && \
             echo '🐳 Env vars: {self.env_vars}' && \
-            python /plugins/find_test_cases.py {self.cases_index} --project-root /app/test_case --run \
+            python /plugins/find_test_cases.py {self.cases_index} --project-root /app/test_case \
+                --index-dir /index --commit {task_info.get('commit', '')} --jobs 0 \
+                --workers {workers} --durations-file /logs/case_durations.json --run \
             ) 2>&1 | tee -a {self.pytest_log_path} && \
-            tar -czvf /logs/log.tar.gz /app/TestLog
+            tar -cvf - /app/TestLog | $(command -v pigz || echo gzip) > /logs/log.tar.gz
         """
         return command
 
@@ -169,6 +148,12 @@ class DockerContainerHandler:
         task_info = TASK_SETTINGS_MAP[self.job_id]
         return task_info['image']
 
+    @property
+    def nano_cpus(self):
+        """容器CPU配额（单位：1e-9 核），未配置时不限制"""
+        cpus = TASK_SETTINGS_MAP[self.job_id].get('cpus')
+        return int(cpus * 1e9) if cpus else None
+
     def _get_task_env_vars(self):
         """构建容器内的环境变量（包含系统级配置）"""
         task_info = TASK_SETTINGS_MAP[self.job_id]
@@ -192,27 +177,83 @@ class DockerContainerHandler:
             str(self.pip_cache_path): {'bind': '/root/.cache/pip', 'mode': 'rw'},  # pip缓存（读写）
             str(self.plugin_path): {'bind': '/plugins', 'mode': 'ro'},  # 测试插件（只读）
             str(self.log_dir): {'bind': '/logs', 'mode': 'rw'},  # 日志目录（读写）
+            str(self.workdir): {'bind': '/app', 'mode': 'rw'},  # 测试代码（读写，测试会写入TestLog）
+            str(self.env_path): {'bind': ENV_MOUNT_PATH, 'mode': 'ro'},  # 依赖环境（只读）
+            str(self.index_path): {'bind': '/index', 'mode': 'rw'},  # 用例索引（读写）
+            # worktree 的 .git 文件记录的是镜像在主机上的绝对路径, 挂载到容器内相同路径, 容器内 git 读操作才能使用（只读）
+            str(self.mirror_path): {'bind': str(self.mirror_path), 'mode': 'ro'},
         }
 
+    async def prepare_repo(self):
+        """从主机仓库镜像缓存中检出任务代码（增量fetch + worktree）"""
+        task_info = TASK_SETTINGS_MAP[self.job_id]
+        self.workdir, commit = await repo_cache.checkout(self.job_id, self.git_repo, task_info['branch'])
+        task_info['commit'] = commit
+        self.index_path = repo_cache.index_path(self.git_repo)
+        self.mirror_path = repo_cache.mirror_path(repo_cache.repo_key(self.git_repo))
+        logger.info(f"任务 {self.job_id} 检出代码: {task_info['branch']}@{commit}")
+
+    def write_case_durations(self):
+        """将用例历史耗时写入日志目录（容器内 /logs/case_durations.json），供并行执行分片使用"""
+        task_info = TASK_SETTINGS_MAP[self.job_id]
+        with open(self.log_dir / 'case_durations.json', 'w') as f:
+            json.dump(task_info.get('case_durations') or {}, f)
+
+    async def prepare_env(self):
+        """获取(首次则构建)与镜像和requirements.txt匹配的依赖环境"""
+        task_info = TASK_SETTINGS_MAP[self.job_id]
+        key, self.env_path, output = await env_cache.acquire(self.job_id, self.task_image, self.workdir)
+        task_info['env_key'] = key
+        if output:
+            # 将依赖安装输出写入任务日志，便于排查
+            with open(self.log_dir / 'pytest.log', 'a') as f:
+                f.write(output)
+
     async def execute_docker_task(self):
         """创建并运行Docker容器，执行测试任务"""
+        await self.prepare_repo()
+        await self.prepare_env()
+        self.write_case_durations()
         command = await self.get_task_cmd()
         logger.debug(f"执行命令: {command}")
         logger.debug(f"环境变量: {self.env_vars}")
 
-        # 启动Docker容器（detach=True：后台运行）
-        container = client.containers.run(
-            self.task_image,  # 容器镜像（如python:3.10）
-            command=f'sh -c "{command}"',  # 执行Shell命令
-            name=self.container_name,  # 容器名
-            detach=True,  # 后台运行
-            auto_remove=False,  # 不自动删除（需手动清理）
-            volumes=self._get_task_volume(),  # 挂载卷配置
-            environment=self._get_task_env_vars(),  # 环境变量配置
-        )
+        # 先登记等待再创建容器，容器退出由Docker事件流(die事件)通知，不占用线程
+        exited = container_events.expect(self.job_id)
+        try:
+            # 优先认领预热容器(已创建并启动), 没有时再创建新容器
+            container = await warm_pool.claim(
+                self.job_id,
+                self.task_image,
+                name=self.container_name,
+                command=command,
+                environment=self._get_task_env_vars(),
+                volumes=self._get_task_volume(),
+                nano_cpus=self.nano_cpus,
+            )
+            if container is not None:
+                # 预热容器早已启动, 不会再收到start事件
+                TASK_SETTINGS_MAP[self.job_id]["status"] = "running"
+            else:
+                # 启动Docker容器（detach=True：后台运行）
+                container = await docker_client.run_container(
+                    self.task_image,  # 容器镜像（如python:3.10）
+                    command=f'sh -c "{command}"',  # 执行Shell命令
+                    name=self.container_name,  # 容器名
+                    detach=True,  # 后台运行
+                    auto_remove=False,  # 不自动删除（需手动清理）
+                    volumes=self._get_task_volume(),  # 挂载卷配置
+                    environment=self._get_task_env_vars(),  # 环境变量配置
+                    nano_cpus=self.nano_cpus,  # CPU配额（容器内并行执行的worker数据此计算）
+                    labels=container_labels(self.job_id),  # 事件订阅和状态同步按标签过滤
+                )
+        except Exception:
+            container_events.discard(self.job_id)
+            raise
+        TASK_SETTINGS_MAP[self.job_id]["container_id"] = container.id # 更新全局任务字典中的容器ID
 
-        result = await asyncio.to_thread(container.wait) # 等待容器执行完成（获取退出状态）
-        TASK_SETTINGS_MAP[self.job_id]["container_id"] = container.id # 更新全局任务字典中的容器ID和状态
+        result = await container_events.wait(self.job_id, exited) # 等待容器执行完成（获取退出状态）
+        TASK_SETTINGS_MAP[self.job_id]["oom"] = result.get("OOMKilled", False)
         if result["StatusCode"] == 0:  # 退出码0表示成功
             TASK_SETTINGS_MAP[self.job_id]["status"] = "succeeded"
         else:  # 非0退出码表示失败
@@ -228,8 +269,19 @@ class DockerContainerHandler:
             logger.exception(e)
             TASK_SETTINGS_MAP[self.job_id]["status"] = "failed"
         finally:
-            # 无论成功失败，都触发容器停止钩子
-            await trigger_container_stop_hooks(self.job_id, TASK_SETTINGS_MAP[self.job_id])
+            # 补报测试插件未能上报的结果（在停止钩子之前，保证平台汇总任务状态时结果完整）
+            try:
+                await replay_unsent_results(self.job_id, self.log_dir)
+            except Exception as e:
+                logger.error(f"补报任务 {self.job_id} 结果异常: {e}")
+            try:
+                # 先将移入预热容器槽位的任务目录移回, 再释放代码检出目录
+                await warm_pool.release(self.job_id)
+                await repo_cache.release(self.job_id)
+                env_cache.release(self.job_id)
+            finally:
+                # 无论成功失败，都触发容器停止钩子
+                await trigger_container_stop_hooks(self.job_id, TASK_SETTINGS_MAP[self.job_id])
 
 
 def register_agent_service():
@@ -259,30 +311,60 @@ def register_container_stop_hook(hook: Callable[[str, Dict[str, Any]], Union[Non
 
 
 async def default_container_stop_hook(job_id: str, task_info: Dict[str, Any]):
-    """默认的容器停止hook, 向平台发送通知"""
-    server_ip = os.getenv('SERVER_IP')
-    if not server_ip:
+    """默认的容器停止hook, 将通知写入发件箱, 由后台协程发送给平台(不阻塞任务结束流程)"""
+    if not SERVER_IP:
         logger.warning(
             "SERVER_IP not set, skipping container stop notification")
         return
-    platform_url = f"{server_ip}/api/test_task/record/{job_id}/container_stop"
     payload = {
         "status": task_info.get("status", "unknown").capitalize(),
-        "container_id": task_info.get("container_id"),
+        "container_id": task_info.get("container_id") or "",
         "timestamp": datetime.now().isoformat()
     }
+    await notify_outbox.enqueue(job_id, payload)
+    logger.info(f"Queued container stop notification for job {job_id}")
 
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(platform_url, json=payload) as response:
-                if response.status == 200:
-                    logger.info(
-                        f"Successfully notified platform about container stop for job {job_id}")
-                else:
-                    logger.error(f"Failed to notify platform: {response.status}")
-                    logger.error(f"Response content: {await response.text()}")
-    except Exception as e:
-        logger.error(f"Error notifying platform about container stop: {e}")
+
+async def replay_unsent_results(job_id: str, log_dir: Path, batch_size: int = 200):
+    """容器退出后通过批量接口补报测试插件落盘的未上报结果(unsent_results.<pid>.jsonl)"""
+    journals = sorted(log_dir.glob('unsent_results*.jsonl'))
+    if not journals:
+        return
+    url = f"{SERVER_IP}/api/test_task/case_results"
+    session = platform_client.session
+    for journal in journals:
+        results = []
+        with open(journal, 'r', encoding='utf-8', errors='replace') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    results.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # 容器被强制结束时最后一行可能只写了一半
+                    logger.warning(f"跳过任务 {job_id} 无法解析的结果记录: {line[:200]!r}")
+        remaining = []
+        for i in range(0, len(results), batch_size):
+            batch = results[i:i + batch_size]
+            payload = {"record_id": str(job_id), "results": [r["result"] for r in batch]}
+            try:
+                async with session.post(url, json=payload) as response:
+                    if response.status != 200:
+                        logger.error(f"补报任务 {job_id} 结果失败: {response.status} {await response.text()}")
+                        remaining.extend(batch)
+                        continue
+                    data = await response.json()
+                    if data.get("failed"):
+                        logger.warning(f"补报任务 {job_id} 部分结果失败: {data['failed']}")
+            except Exception as e:
+                logger.error(f"补报任务 {job_id} 结果失败: {e}")
+                remaining.extend(batch)
+        logger.info(f"补报任务 {job_id} 结果: {len(results) - len(remaining)}/{len(results)}")
+        if remaining:
+            with open(journal, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(r, ensure_ascii=False) + '\n' for r in remaining)
+        else:
+            journal.unlink()
 
 
 async def trigger_container_stop_hooks(job_id: str, task_info: Dict[str, Any]):
@@ -298,12 +380,12 @@ async def trigger_container_stop_hooks(job_id: str, task_info: Dict[str, Any]):
             logger.error(f"Error in container stop hook: {e}")
 
 async def clean_expired_containers():
-    """清理创建时间超过一天且状态为退出的容器"""
+    """清理创建时间超过一天且状态为退出的容器(任务日志由 log_archive_store 按保留策略清理)"""
     logger.info("开始执行过期容器清理任务")
     try:
         one_day_ago = datetime.now() - timedelta(days=1)
         # 获取所有容器（包括已停止状态）
-        containers = await asyncio.to_thread(client.containers.list, all=True)
+        containers = await docker_client.list_containers(all=True)
 
         for container in containers:
             # 解析容器创建时间
@@ -315,8 +397,8 @@ async def clean_expired_containers():
                 logger.info(f"清理过期容器：{container.name} (ID: {container.id[:12]})")
                 try:
                     # 停止并删除容器
-                    await asyncio.to_thread(container.stop)
-                    await asyncio.to_thread(container.remove)
+                    await docker_client.stop(container)
+                    await docker_client.remove(container)
                     logger.success(f"容器 {container.name} 清理完成")
 
                     # 同步删除内存中的任务记录
@@ -336,11 +418,14 @@ async def clean_expired_containers():
 
 
 async def sync_task_and_container_status():
-    """同步数据库任务状态和容器实际状态"""
+    """
+    同步任务状态和容器实际状态
+    状态变化由Docker事件流驱动, 这里只作为兜底(事件流断开期间或漏掉事件时)
+    """
     logger.info("开始同步任务状态与容器状态")
     try:
-        # 获取所有容器并构建名称映射
-        containers = await asyncio.to_thread(client.containers.list, all=True)
+        # 获取agent创建的容器并构建名称映射
+        containers = await docker_client.list_containers(all=True, filters={"label": CONTAINER_LABEL})
         container_map: Dict[str, Any] = {container.name: container for container in containers}
 
         # 检查所有任务状态
@@ -350,16 +435,24 @@ async def sync_task_and_container_status():
 
             # 任务存在但容器已消失的情况
             if not container:
-                if task_info["status"] not in ["succeeded", "failed", "stopped"]:
+                # 排队中或正在准备代码/依赖环境的任务还没有容器
+                if task_info["status"] not in [*TERMINAL_STATUSES, "queued", "created"]:
                     logger.warning(f"任务 {job_id} 的容器已消失, 更新状态为failed")
+                    if container_events.resolve(job_id, -1):
+                        continue
                     task_info["status"] = "failed"
                     await trigger_container_stop_hooks(job_id, task_info)
                 continue
 
             # 根据容器状态更新任务状态
             if container.status == "exited":
-                if task_info["status"] not in ["succeeded", "failed", "stopped"]:
-                    exit_code = container.attrs["State"]["ExitCode"]
+                if task_info["status"] not in TERMINAL_STATUSES:
+                    state = container.attrs["State"]
+                    exit_code = state["ExitCode"]
+                    # 有协程在等待该容器时交给它处理(漏掉了die事件)
+                    if container_events.resolve(job_id, exit_code, state.get("OOMKilled", False)):
+                        logger.warning(f"容器 {container_name} 已退出但未收到die事件, 由状态同步补发")
+                        continue
                     new_status = "succeeded" if exit_code == 0 else "failed"
                     logger.info(f"容器 {container_name} 已退出，更新任务状态为 {new_status}")
                     task_info["status"] = new_status
@@ -379,7 +472,7 @@ async def sync_task_and_container_status():
 
 
 async def periodic_task():
-    """定时任务主函数, 每60秒执行一次"""
+    """定时任务主函数, 事件流正常时每 RECONCILE_INTERVAL 秒执行一次, 事件流断开时每60秒执行一次"""
     while True:
         try:
             # 执行容器清理
@@ -389,15 +482,18 @@ async def periodic_task():
         except Exception as e:
             logger.error(f"定时任务执行出错: {str(e)}")
 
-        # 等待60秒后再次执行
-        await asyncio.sleep(60)
+        await asyncio.sleep(RECONCILE_INTERVAL if container_events.connected else 60)
 
 
 def start_periodic_tasks():
-    """启动定时任务"""
+    """启动Docker事件订阅和定时任务"""
     loop = asyncio.get_event_loop()
+    loop.create_task(container_events.run(trigger_container_stop_hooks))
     loop.create_task(periodic_task())
-    logger.info("定时任务已启动, 将每60秒执行一次")
+    loop.create_task(log_archive_store.run())
+    loop.create_task(notify_outbox.run())
+    loop.create_task(warm_pool.run())
+    logger.info(f"定时任务已启动, 事件流正常时每{RECONCILE_INTERVAL}秒执行一次状态同步")
 
 
 # 注册默认hook
@@ -0,0 +1,375 @@
+import asyncio
+import os
+import shlex
+import shutil
+import tempfile
+import time
+import uuid
+
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from docker.models.containers import Container
+from loguru import logger
+from const import (
+    CACHE_DIR,
+    CONTAINER_LABEL,
+    ENV_CACHE_DIR,
+    LOG_HOST_DIR,
+    REPO_CACHE_DIR,
+    WARM_POOL_IDLE_TIMEOUT,
+    WARM_POOL_IMAGES,
+    WARM_POOL_LABEL,
+    WARM_POOL_SIZE,
+    WORKTREE_DIR,
+)
+from container_events import container_events
+from docker_adapter import docker_client
+
+SLOT_MOUNT_PATH = '/warm'  # 预热容器内等待任务脚本的目录
+RUN_SCRIPT = 'run.sh'
+REPLENISH_INTERVAL = 5.0  # 补充/淘汰检查间隔(秒)
+CREATE_RETRY_DELAY = 60.0  # 创建预热容器失败后(如镜像不存在)暂停补充的时间(秒)
+COPY_DIR = 'volumes'  # 脚本目录下存放可写副本的子目录
+# 所有预热容器共享挂载的主机目录(主机路径 -> (容器内路径, 模式)), 任务的挂载卷在认领时以符号链接的方式接入;
+# 只有只读目录和冷启动的任务容器同样共享的 pip 缓存
+SHARED_ROOTS = {
+    REPO_CACHE_DIR: ('/host/repos', 'ro'),  # 仓库镜像; 其下的用例索引需要写入, 认领时复制一份
+    ENV_CACHE_DIR: ('/host/envs', 'ro'),
+    CACHE_DIR / 'pip': ('/host/pip', 'rw'),
+    Path(__file__).parent / 'test_runner_plugin': ('/host/plugins', 'ro'),
+}
+# 存放任务独占目录(日志、代码检出)的主机目录(主机路径 -> 容器内路径): 每个预热容器只挂载其下自己的槽位目录
+# <root>/<容器名>, 认领时把任务的目录移入槽位目录(原路径留下符号链接), 任务结束后移回, 任务看不到其他任务的目录
+SLOT_ROOTS = {
+    LOG_HOST_DIR: '/host/logs',
+    WORKTREE_DIR: '/host/worktrees',
+}
+# 预热容器的启动命令: 预先加载解释器, 然后等待认领时写入的任务脚本
+IDLE_COMMAND = (
+    f'python -c "import json, sqlite3" >/dev/null 2>&1; '
+    f'while [ ! -f {SLOT_MOUNT_PATH}/{RUN_SCRIPT} ]; do sleep 0.1; done; '
+    f'exec sh {SLOT_MOUNT_PATH}/{RUN_SCRIPT}'
+)
+
+
+class ImagePool:
+    """单个镜像的预热容器及命中统计"""
+    def __init__(self, image: str):
+        self.image = image
+        self.idle: List[Container] = []
+        self.last_demand = time.monotonic()  # 最近一次有任务使用该镜像的时间
+        self.paused_until = 0.0  # 创建失败后暂停补充
+        self.hits = 0
+        self.misses = 0
+        self.created = 0
+        self.evicted = 0
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "idle": len(self.idle),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else None,
+            "created": self.created,
+            "evicted": self.evicted,
+            "idle_seconds": round(time.monotonic() - self.last_demand, 1),
+        }
+
+
+class WarmPool:
+    """
+    预热容器池
+    为常用镜像预先创建并启动若干空闲容器(容器内只运行等待脚本), 任务认领时重命名为 task-<job_id>,
+    写入任务脚本(按挂载卷建立符号链接、导出环境变量、执行测试命令), 省去创建和启动容器的开销;
+    池在后台补充, 镜像超过 WARM_POOL_IDLE_TIMEOUT 秒没有任务使用时淘汰其空闲容器, 下次使用时再恢复
+    """
+    def __init__(self, size: int, images: List[str], idle_timeout: float, slot_dir: Path):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.slot_dir = slot_dir
+        self.pools: Dict[str, ImagePool] = {image: ImagePool(image) for image in images}
+        self._claims: Dict[str, Tuple[str, List[Tuple[Path, Path]]]] = {}  # job_id -> (槽位名, [(原目录, 副本)])
+        self._wakeup: asyncio.Event | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    @property
+    def wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _plan(
+        self, name: str, volumes: Dict[str, Dict[str, str]],
+    ) -> Tuple[Dict[str, str], List[Tuple[Path, Path]], List[Tuple[Path, Path]]] | None:
+        """
+        将任务的挂载卷映射到预热容器 name 内的路径, 有挂载卷无法映射时返回None
+        :return: (挂载点 -> 预热容器内的路径, [(移入槽位的目录, 槽位内路径)], [(复制的目录, 副本路径)])
+        """
+        links, lends, copies = {}, [], []
+        for host_path, mount in volumes.items():
+            path = Path(host_path)
+            if path.parent in SLOT_ROOTS:
+                lends.append((path, path.parent / name / path.name))
+                links[mount['bind']] = f'{SLOT_ROOTS[path.parent]}/{path.name}'
+                continue
+            for root, (target, mode) in SHARED_ROOTS.items():
+                if path == root or root in path.parents:
+                    break
+            else:
+                return None
+            if mount['mode'] == 'rw' and mode == 'ro':
+                copy = self.slot_dir / name / COPY_DIR / str(len(copies))
+                copies.append((path, copy))
+                links[mount['bind']] = f'{SLOT_MOUNT_PATH}/{COPY_DIR}/{copy.name}'
+            else:
+                links[mount['bind']] = str(Path(target) / path.relative_to(root))
+        return links, lends, copies
+
+    @staticmethod
+    def _lend(lends: List[Tuple[Path, Path]], copies: List[Tuple[Path, Path]]):
+        """将任务的目录移入槽位(原路径改为指向槽位的符号链接), 复制需要写入的共享目录"""
+        for source, dest in lends:
+            os.rename(source, dest)
+            os.symlink(dest, source)
+        for source, copy in copies:
+            shutil.copytree(source, copy)
+
+    @staticmethod
+    def _restore(name: str):
+        """将移入槽位 name 的任务目录移回原路径, 然后删除槽位目录"""
+        for root in SLOT_ROOTS:
+            slot_root = root / name
+            if not slot_root.exists():
+                continue
+            restored = True
+            for entry in slot_root.iterdir():
+                original = root / entry.name
+                if original.is_symlink():
+                    original.unlink()
+                elif original.exists():
+                    logger.warning(f"{original} 已存在, 保留预热容器槽位中的 {entry}")
+                    restored = False
+                    continue
+                entry.rename(original)
+            if restored:
+                shutil.rmtree(slot_root, True)
+
+    @staticmethod
+    def _write_back(copy: Path, target: Path):
+        """将副本中的文件原子替换回共享目录"""
+        for path in copy.rglob('*'):
+            if not path.is_file() or path.suffix == '.tmp':
+                continue
+            dest = target / path.relative_to(copy)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=dest.parent, prefix=f'{dest.name}.', suffix='.tmp')
+            os.close(fd)
+            try:
+                shutil.copyfile(path, tmp)
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, dest)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+    def _discard(self, name: str):
+        """归还槽位 name 中的任务目录并删除其脚本目录"""
+        self._restore(name)
+        shutil.rmtree(self.slot_dir / name, True)
+
+    def _script(self, command: str, environment: Dict[str, str], links: Dict[str, str]) -> str:
+        lines = []
+        for target, source in links.items():
+            parent = os.path.dirname(target)
+            lines.append(f'rm -rf {shlex.quote(target)} 2>/dev/null; mkdir -p {shlex.quote(parent)}; '
+                         f'ln -s {shlex.quote(source)} {shlex.quote(target)}')
+        lines.extend(f'export {name}={shlex.quote(value)}' for name, value in environment.items())
+        lines.append(command)
+        return '\n'.join(lines) + '\n'
+
+    async def claim(
+        self,
+        job_id: str,
+        image: str,
+        name: str,
+        command: str,
+        environment: Dict[str, str],
+        volumes: Dict[str, Dict[str, str]],
+        nano_cpus: int | None = None,
+    ) -> Container | None:
+        """
+        认领预热容器并开始执行任务, 没有可用的预热容器时返回None(由调用方创建新容器)
+        :param volumes: 与 docker run 相同格式的挂载卷
+        """
+        if not self.enabled:
+            return None
+        pool = self.pools.setdefault(image, ImagePool(image))
+        pool.last_demand = time.monotonic()
+        container = None
+        while pool.idle:
+            candidate = pool.idle.pop()
+            try:
+                await docker_client.reload(candidate)
+                if candidate.status == 'running':
+                    container = candidate
+                    break
+            except Exception as e:
+                logger.warning(f"预热容器 {candidate.name} 不可用: {e}")
+            await self._remove(candidate)
+        self.wakeup.set()  # 补充空闲容器
+        if container is None:
+            pool.misses += 1
+            return None
+
+        slot_name = container.name
+        slot = self.slot_dir / slot_name
+        plan = self._plan(slot_name, volumes)
+        if plan is None:
+            logger.warning(f"任务 {job_id} 的挂载卷不在预热容器可接入的目录下, 不使用预热容器")
+            pool.idle.append(container)
+            pool.misses += 1
+            return None
+        links, lends, copies = plan
+        # 预热容器的标签里没有任务ID, 先登记容器与任务的对应关系, 再开始执行
+        container_events.bind(container.id, job_id)
+        try:
+            await docker_client.rename(container, name)
+            if nano_cpus:
+                await docker_client.update(container, cpu_period=100000, cpu_quota=nano_cpus // 10000)
+            await asyncio.to_thread(self._lend, lends, copies)
+            script = self._script(command, environment, links)
+            # 先写临时文件再重命名, 容器内的等待脚本只会看到完整的任务脚本
+            tmp = slot / f'{RUN_SCRIPT}.tmp'
+            await asyncio.to_thread(tmp.write_text, script)
+            await asyncio.to_thread(tmp.rename, slot / RUN_SCRIPT)
+        except Exception as e:
+            logger.warning(f"认领预热容器 {slot_name} 失败: {e}")
+            container_events.unbind(container.id)
+            await self._remove(container, slot_name)  # 同时移回已移入槽位的任务目录
+            pool.misses += 1
+            return None
+        self._claims[job_id] = (slot_name, copies)
+        pool.hits += 1
+        logger.info(f"任务 {job_id} 使用预热容器 {container.short_id} ({image})")
+        return container
+
+    async def release(self, job_id: str):
+        """任务结束后写回副本, 将任务目录移回原路径并删除槽位(需在清理任务目录之前调用)"""
+        claim = self._claims.pop(job_id, None)
+        if not claim:
+            return
+        slot_name, copies = claim
+        for source, copy in copies:
+            try:
+                await asyncio.to_thread(self._write_back, copy, source)
+            except Exception as e:
+                logger.error(f"写回任务 {job_id} 的 {source} 失败: {e}")
+        await asyncio.to_thread(self._discard, slot_name)
+
+    async def _create(self, pool: ImagePool):
+        name = f'warm-{uuid.uuid4().hex[:12]}'
+        slot = self.slot_dir / name
+        slot.mkdir(parents=True, exist_ok=True, mode=0o777)
+        volumes = {str(slot): {'bind': SLOT_MOUNT_PATH, 'mode': 'rw'}}
+        for root, (target, mode) in SHARED_ROOTS.items():
+            root.mkdir(parents=True, exist_ok=True)
+            volumes[str(root)] = {'bind': target, 'mode': mode}
+        for root, target in SLOT_ROOTS.items():
+            (root / name).mkdir(parents=True, exist_ok=True, mode=0o777)
+            volumes[str(root / name)] = {'bind': target, 'mode': 'rw'}
+        try:
+            container = await docker_client.run_container(
+                pool.image,
+                command=['sh', '-c', IDLE_COMMAND],
+                name=name,
+                detach=True,
+                auto_remove=False,
+                volumes=volumes,
+                labels={CONTAINER_LABEL: "1", WARM_POOL_LABEL: pool.image},
+            )
+        except Exception:
+            await asyncio.to_thread(self._discard, name)
+            raise
+        pool.idle.append(container)
+        pool.created += 1
+
+    async def _remove(self, container: Container, slot_name: str | None = None):
+        try:
+            await docker_client.remove(container, force=True)
+        except Exception as e:
+            logger.warning(f"删除预热容器 {container.name} 失败: {e}")
+        await asyncio.to_thread(self._discard, slot_name or container.name)
+
+    async def _evict(self, pool: ImagePool):
+        logger.info(f"镜像 {pool.image} 超过 {self.idle_timeout}s 未使用, 淘汰 {len(pool.idle)} 个预热容器")
+        while pool.idle:
+            await self._remove(pool.idle.pop())
+            pool.evicted += 1
+
+    async def replenish(self):
+        """补充各镜像的空闲容器, 淘汰长时间未使用的镜像的空闲容器"""
+        now = time.monotonic()
+        for pool in list(self.pools.values()):
+            if now - pool.last_demand > self.idle_timeout:
+                if pool.idle:
+                    await self._evict(pool)
+                continue
+            while len(pool.idle) < self.size and now >= pool.paused_until:
+                try:
+                    await self._create(pool)
+                except Exception as e:
+                    logger.error(f"创建预热容器失败({pool.image}): {e}")
+                    pool.paused_until = time.monotonic() + CREATE_RETRY_DELAY
+
+    async def cleanup(self):
+        """删除上次运行遗留的预热容器(未被认领的), 归还不再运行的容器的槽位"""
+        containers = await docker_client.list_containers(all=True, filters={"label": WARM_POOL_LABEL})
+        in_use = set()
+        for container in containers:
+            if container.name.startswith('warm-'):
+                await self._remove(container)
+            elif container.status == 'running':
+                # 认领后已改名的任务容器, 通过挂载的脚本目录找到其槽位
+                in_use.update(
+                    Path(mount['Source']).name for mount in container.attrs.get('Mounts', [])
+                    if Path(mount['Source']).parent == self.slot_dir
+                )
+        slots = {slot.name for slot in self.slot_dir.glob('warm-*')}
+        for root in SLOT_ROOTS:
+            slots.update(slot.name for slot in root.glob('warm-*'))
+        for slot_name in slots - in_use:
+            await asyncio.to_thread(self._discard, slot_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "idle_timeout": self.idle_timeout,
+            "images": {image: pool.stats() for image, pool in self.pools.items()},
+        }
+
+    async def run(self):
+        """后台补充预热容器"""
+        if not self.enabled:
+            return
+        try:
+            await self.cleanup()
+        except Exception as e:
+            logger.error(f"清理遗留的预热容器失败: {e}")
+        while True:
+            self.wakeup.clear()
+            try:
+                await self.replenish()
+            except Exception as e:
+                logger.error(f"补充预热容器失败: {e}")
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), REPLENISH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+warm_pool = WarmPool(WARM_POOL_SIZE, WARM_POOL_IMAGES, WARM_POOL_IDLE_TIMEOUT, CACHE_DIR / 'warm')
@@ -0,0 +1,38 @@
+"""unique case record per task record
+
+Revision ID: 3f1a9c2d7b10
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1a9c2d7b10'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 去重: 同一任务记录下相同用例只保留最新一条, 否则无法建立唯一索引
+    op.execute(
+        """
+        DELETE r1 FROM test_case_record r1
+        JOIN test_case_record r2
+          ON r1.task_record_id = r2.task_record_id
+         AND r1.case_index = r2.case_index
+         AND r1.id < r2.id
+        """
+    )
+    op.create_unique_constraint(
+        'uq_task_record_case_index', 'test_case_record', ['task_record_id', 'case_index']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_task_record_case_index', 'test_case_record', type_='unique')
@@ -0,0 +1,44 @@
+"""add agent registry
+
+Revision ID: 8b2e4f6a1c03
+Revises: 3f1a9c2d7b10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4f6a1c03'
+down_revision: Union[str, None] = '3f1a9c2d7b10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 应用启动时 create_all 可能已按模型建好该表
+    if sa.inspect(op.get_bind()).has_table('agent'):
+        return
+    op.create_table(
+        'agent',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('host', sa.String(length=100), nullable=False),
+        sa.Column('port', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('capacity', sa.JSON(), nullable=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('host', 'port', name='uq_agent_host_port'),
+    )
+    op.create_index(op.f('ix_agent_id'), 'agent', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_agent_id'), table_name='agent')
+    op.drop_table('agent')
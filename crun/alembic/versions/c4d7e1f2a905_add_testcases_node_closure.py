@@ -0,0 +1,55 @@
+"""add testcases_node closure table
+
+Revision ID: c4d7e1f2a905
+Revises: 8b2e4f6a1c03
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d7e1f2a905'
+down_revision: Union[str, None] = '8b2e4f6a1c03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 应用启动时 create_all 可能已按模型建好空表, 此时只做回填
+    if not sa.inspect(op.get_bind()).has_table('testcases_node_closure'):
+        op.create_table(
+            'testcases_node_closure',
+            sa.Column('ancestor_id', sa.Integer(), nullable=False),
+            sa.Column('descendant_id', sa.Integer(), nullable=False),
+            sa.Column('depth', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('ancestor_id', 'descendant_id'),
+        )
+        op.create_index('ix_testcases_node_closure_descendant', 'testcases_node_closure',
+                        ['descendant_id', 'depth'], unique=False)
+    # 回填: 递归展开现有节点的所有 (祖先, 子孙) 关系, 根节点的 parent_id 为 NULL 或 0;
+    # 跳过已存在的行(迁移前已运行的新代码写入的)
+    op.execute(
+        """
+        INSERT INTO testcases_node_closure (ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree (ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM testcases_node
+            UNION ALL
+            SELECT tree.ancestor_id, node.id, tree.depth + 1
+            FROM tree JOIN testcases_node AS node ON node.parent_id = tree.descendant_id
+        )
+        SELECT ancestor_id, descendant_id, depth FROM tree
+        WHERE NOT EXISTS (
+            SELECT 1 FROM testcases_node_closure AS closure
+            WHERE closure.ancestor_id = tree.ancestor_id AND closure.descendant_id = tree.descendant_id
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_testcases_node_closure_descendant', table_name='testcases_node_closure')
+    op.drop_table('testcases_node_closure')
@@ -0,0 +1,52 @@
+"""add testcases_node stats table
+
+Revision ID: d9a3b6c1e472
+Revises: c4d7e1f2a905
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9a3b6c1e472'
+down_revision: Union[str, None] = 'c4d7e1f2a905'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 应用启动时 create_all 可能已按模型建好该表, 此时只做回填
+    if not sa.inspect(op.get_bind()).has_table('testcases_node_stats'):
+        op.create_table(
+            'testcases_node_stats',
+            sa.Column('node_id', sa.Integer(), nullable=False),
+            sa.Column('project_id', sa.Integer(), nullable=False),
+            sa.Column('case_count', sa.Integer(), nullable=False),
+            sa.Column('automated_count', sa.Integer(), nullable=False),
+            sa.Column('automation_count', sa.Integer(), nullable=False),
+            sa.PrimaryKeyConstraint('node_id'),
+        )
+        op.create_index(op.f('ix_testcases_node_stats_project_id'), 'testcases_node_stats', ['project_id'], unique=False)
+    # 回填: 每个用例计入其节点的所有祖先(含自身)
+    # 闭包表回填前写入的增量计数不完整, 计数是派生数据, 整表重新统计
+    op.execute("DELETE FROM testcases_node_stats")
+    op.execute(
+        """
+        INSERT INTO testcases_node_stats (node_id, project_id, case_count, automated_count, automation_count)
+        SELECT closure.ancestor_id, node.project_id, COUNT(*),
+               COALESCE(SUM(testcases.automated), 0), COALESCE(SUM(testcases.automation), 0)
+        FROM testcases
+        JOIN testcases_node_closure AS closure ON closure.descendant_id = testcases.node_id
+        JOIN testcases_node AS node ON node.id = closure.ancestor_id
+        GROUP BY closure.ancestor_id, node.project_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_testcases_node_stats_project_id'), table_name='testcases_node_stats')
+    op.drop_table('testcases_node_stats')
@@ -0,0 +1,34 @@
+"""add testcases tree version table
+
+Revision ID: e5f8a2d4b716
+Revises: d9a3b6c1e472
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5f8a2d4b716'
+down_revision: Union[str, None] = 'd9a3b6c1e472'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 应用启动时 create_all 可能已按模型建好该表
+    if sa.inspect(op.get_bind()).has_table('testcases_tree_version'):
+        return
+    op.create_table(
+        'testcases_tree_version',
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('project_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('testcases_tree_version')
@@ -0,0 +1,29 @@
+"""add task_config cpus
+
+Revision ID: f1b7c3e9a250
+Revises: e5f8a2d4b716
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b7c3e9a250'
+down_revision: Union[str, None] = 'e5f8a2d4b716'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # 启动时 create_all 可能已按模型建好该列
+    columns = {column['name'] for column in sa.inspect(op.get_bind()).get_columns('task_config')}
+    if 'cpus' not in columns:
+        op.add_column('task_config', sa.Column('cpus', sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('task_config', 'cpus')
@@ -1,6 +1,6 @@
-from typing import Any, Optional
+from typing import Any, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
@@ -8,12 +8,14 @@ from app.crud import case_node as crud
 from app.crud import project as crud_project
 from app.crud import cases as crud_case
 from app.core import deps
+from app.core.tree_cache import case_tree_cache
 from app.schemas import (
     TestCaseNode,
-    TestCaseUpdate,
     TestCaseNodeCreate,
     TestCaseNodeUpdate,
     TestCaseNodeList,
+    TestCaseNodeChild,
+    TestCaseCursorPage,
 )
 
 router = APIRouter(prefix="/api/case_node")
@@ -59,41 +61,80 @@ async def create(
 @router.get("/tree", response_model=list, operation_id='listTestCaseNodeTree')
 async def read_tree(
     *,
+    request: Request,
     db: AsyncSession = Depends(deps.get_db),
     project_id: int = Depends(deps.current_project_id),
 ) -> Any:
-    """获取用例节点树"""
-    tree = await crud.get_tree(db=db, project_id=project_id)
-    return tree
+    """获取用例节点树(带 ETag, 未变化时返回304)"""
+    # 先读版本号: 同一事务内随后构建的树与该版本一致
+    version = await crud.get_version(db, project_id)
+    return await case_tree_cache.response(
+        request, "tree", project_id, version, lambda: crud.get_tree(db=db, project_id=project_id))
 
 
 @router.get("/tree/cases", response_model=list, operation_id='listTestCaseNodeTreeCases')
 async def read_tree_cases(
     *,
+    request: Request,
     db: AsyncSession = Depends(deps.get_db),
     project_id: int = Depends(deps.current_project_id),
 ) -> Any:
-    """获取用例节点树中的用例"""
-    async def get_cases(nodes):
+    """获取用例节点树中的用例(带 ETag, 未变化时返回304)"""
+    def attach_cases(nodes, cases_by_node):
         for node in nodes:
             if not node['children']:
-                cases = []
-                cases = await crud_case.get_by_node_id(db=db, node_id=node['key'])
                 node['children'] = [
                     {
-                        "key": case.index,
-                        "title": case.name,
-                        "index": case.index,
+                        "key": index,
+                        "title": name,
+                        "index": index,
                         "children": [],
-                    } for case in cases
+                    } for index, name in cases_by_node.get(int(node['key']), [])
                 ]
             else:
-                await get_cases(node['children'])
-        return
+                attach_cases(node['children'], cases_by_node)
 
-    tree = await crud.get_tree(db=db, project_id=project_id)
-    await get_cases(tree)
-    return tree
+    async def build():
+        tree = await crud.get_tree(db=db, project_id=project_id)
+        # 一次查出项目所有用例再按节点挂载, 不再逐个叶子节点查询
+        attach_cases(tree, await crud_case.get_briefs_by_node(db=db, project_id=project_id))
+        return tree
+
+    version = await crud.get_version(db, project_id)
+    return await case_tree_cache.response(request, "tree_cases", project_id, version, build)
+
+
+@router.get("/children", response_model=List[TestCaseNodeChild], operation_id='listTestCaseNodeChildren')
+async def read_children(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    project_id: int = Depends(deps.current_project_id),
+    parent_id: Optional[int] = None,
+    depth: int = Query(1, ge=1, le=5),
+) -> Any:
+    """懒加载用例节点树: 获取子节点及其用例计数, 不传 parent_id 时为根节点, depth 为预先展开的层数"""
+    if parent_id and not await crud.get(db=db, id=parent_id, project_id=project_id):
+        raise HTTPException(status_code=404, detail=f"{source} not found")
+    return await crud.get_children(db=db, project_id=project_id, parent_id=parent_id, depth=depth)
+
+
+@router.get("/{id}/cases", response_model=TestCaseCursorPage, operation_id='listTestCaseNodeCases')
+async def read_node_cases(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    project_id: int = Depends(deps.current_project_id),
+    id: int,
+    recursive: bool = False,
+    cursor: Optional[int] = None,
+    limit: int = Query(50, ge=1, le=500),
+) -> Any:
+    """按游标分页获取节点下的用例, recursive 为真时包含所有子孙节点的用例"""
+    datas, next_cursor = await crud_case.get_page_by_node(
+        db=db, project_id=project_id, node_id=id, recursive=recursive, cursor=cursor, limit=limit)
+    return {
+        "list": datas,
+        "next_cursor": next_cursor,
+    }
 
 
 @router.patch("/{id}", response_model=TestCaseNode, operation_id='updateTestCaseNode')
@@ -108,7 +149,11 @@ async def update(
     if not data:
         raise HTTPException(status_code=404, detail=f"{source} not found")
     logger.info(data_in)
-    data = await crud.update(db=db, db_obj=data, obj_in=TestCaseUpdate(**data_in.model_dump()))
+    try:
+        # parent_id 变化时连同子树一起移动
+        data = await crud.update(db=db, db_obj=data, obj_in=data_in.model_dump(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return data
 
 
@@ -2,7 +2,7 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core import deps
-from app.schemas import CaseResultCreate, CaseRecord
+from app.schemas import CaseResultCreate, CaseRecord, CaseResultBatchCreate, CaseResultBatchOut
 from app.services import TaskRecordService, get_task_record_service
 
 
@@ -18,3 +18,14 @@ async def case_result(
 ) -> CaseRecord:
     """创建或更新测试用例执行记录"""
     return await service.update_case_record(db, data_in)
+
+
+@router.post('/case_results', response_model=CaseResultBatchOut)
+async def case_results(
+    *,
+    data_in: CaseResultBatchCreate,
+    db: AsyncSession = Depends(deps.get_db),
+    service: TaskRecordService = Depends(get_task_record_service),
+) -> CaseResultBatchOut:
+    """批量更新测试用例执行记录"""
+    return await service.bulk_update_case_records(db, data_in)
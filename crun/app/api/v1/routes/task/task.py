@@ -10,10 +10,9 @@ from app.models import user as UserModels
 from app.schemas.task import task as TaskSchemas
 from app.schemas.task import task_record as TaskRecordSchemas
 from app.schemas.case import case_node as CaseNodeSchemas
-from app.core.clients.agent_client import agent_client
+from app.core.clients.agent_pool import agent_pool
 from app.crud import project as crud_project
 from app.crud import case_node as crud_case_node
-from app.core.clients.agent_client import agent_client
 from app.core import deps
 from app.services import TaskService, get_task_service
 from app.services import TaskRecordService, get_task_record_service
@@ -142,12 +141,10 @@ async def logs_sse(
 ):
     """获取任务日志流"""
     task_record = await record_service.get_task_record(db, task_id=task.id) # 查询任务记录，根据任务ID获取任务记录对象。
-    queue = asyncio.Queue() # 创建一个异步队列，用于在任务记录ID和代理客户端之间传递日志消息。
-    # task_queues[str(task_record.id)] = queue
-
-    asyncio.create_task(agent_client.start_ws_to_agent(str(task_record.id), queue)) # 启动一个异步任务，将任务记录ID和队列传递给代理客户端，开始从代理接收日志消息。
+    agent_client = await agent_pool.get(db, task_record.agent_id) # 日志从执行该任务记录的 Agent 获取
     return StreamingResponse(
-        task_service.log_stream(request, queue), media_type="text/event-stream"   # SSE 协议的 MIME 类型，告诉客户端这是一个持续的事件流，需要保持连接并持续接收数据。
+        task_service.log_stream(request, str(task_record.id), agent_client), # 通过日志中继订阅, 同一任务记录共用一条到 Agent 的连接
+        media_type="text/event-stream"   # SSE 协议的 MIME 类型，告诉客户端这是一个持续的事件流，需要保持连接并持续接收数据。
     )
 
 
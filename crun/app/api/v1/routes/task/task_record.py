@@ -7,10 +7,10 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from loguru import logger
 
 from app.core import deps
-from app.schemas import ContainerStopData
+from app.schemas import ContainerStopData, ContainerStopBatch, ContainerStopBatchOut
 from app.crud import task_record as crud
 from app.services.task_record import TaskRecordService, get_task_record_service
-from app.core.clients.agent_client import agent_client
+from app.core.clients.agent_pool import agent_pool
 
 
 router = APIRouter(prefix="/api/test_task/record")
@@ -18,16 +18,39 @@ router = APIRouter(prefix="/api/test_task/record")
 
 @router.get("/{record_id}/log/download", operation_id='getTestTaskLogFile')
 async def download_log(
+    request: Request,
     db: AsyncSession = Depends(deps.get_db),
     record_id: int = Path(..., description="The ID of the task record to get"),
 ):
-    """下载任务记录日志"""
+    """下载任务记录日志(支持 Range 断点续传)"""
     task_record = await crud.get(db=db, id=record_id)
     if not task_record:
         raise HTTPException(status_code=404, detail="Task record not found")
     elif not task_record.task:
         raise HTTPException(status_code=404, detail="Task not found")
-    return await agent_client.download_log(task_record.task.name, task_record.id)
+    agent_client = await agent_pool.get(db, task_record.agent_id)  # 从执行该任务记录的 Agent 下载
+    return await agent_client.download_log(
+        task_record.task.name,
+        task_record.id,
+        range_header=request.headers.get("range"),
+        if_range=request.headers.get("if-range"),
+        accept_encoding=request.headers.get("accept-encoding"),
+    )
+
+
+@router.post(
+    "/container_stops",
+    response_model=ContainerStopBatchOut,
+    operation_id='containerStopTestTaskBatch'
+)
+async def container_stops(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    data_in: ContainerStopBatch,
+    service: TaskRecordService = Depends(get_task_record_service),
+) -> ContainerStopBatchOut:
+    """批量处理容器停止通知"""
+    return await service.bulk_container_stop(db=db, data_in=data_in)
 
 
 @router.post(
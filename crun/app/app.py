@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
@@ -18,7 +19,11 @@ from app.api.v1.routes.case import cases, case_node
 from app.api.v1.routes.resource import server
 from app.api.v1.routes.bug.bug import bug_router
 from app.api.v1.routes.report.report import report_router
-from app.core.database import create_db_and_tables
+from app.core.database import async_session, create_db_and_tables, engine
+from app.core.locks import LeaderLock
+from app.core.clients.agent_pool import agent_pool
+from app.core.clients.log_relay import log_relays
+from app.services.case_tree import case_count_verifier
 
 settings = get_settings()
 
@@ -33,7 +38,15 @@ origins = [
 async def lifespan(app: FastAPI):
     """FastAPI 应用生命周期管理"""
     await create_db_and_tables()
+    # 定时发现 Agent 并刷新容量, 多个 worker 中只有持有锁的一个执行
+    agent_pool_task = asyncio.create_task(agent_pool.run(async_session, LeaderLock(engine, 'crun_agent_pool')))
+    # 定时校验用例树节点计数, 同样只在一个 worker 中执行
+    case_count_task = asyncio.create_task(case_count_verifier.run(async_session, LeaderLock(engine, 'case_count_verify')))
     yield
+    agent_pool_task.cancel()
+    case_count_task.cancel()
+    log_relays.close()  # 关闭所有实时日志中继
+    await agent_pool.close()  # 关闭与各 Agent 的长连接
 
 
 def create_app() -> FastAPI:
@@ -27,6 +27,33 @@ class Settings(LarkSettings, MysqlSettings):
     TIME_ZONE: str = "RPC"
     # HOST_GATEWAY: str = "host.docker.internal"
     HOST_GATEWAY: str = "172.17.0.1"
+    # Agent 发现: 配置 AGENT_HOSTS(逗号分隔的 host[:port]) 时使用静态列表, 否则从 Consul 发现;
+    # 两者都未配置时只使用 HOST_GATEWAY 上的 Agent
+    AGENT_HOSTS: str = ""
+    AGENT_PORT: int = 9001
+    CONSUL_HOST: str = ""
+    CONSUL_PORT: int = 8500
+    # Agent 以各自的 AGENT_NAME 注册为 Consul 服务并带有 agent 标签: 默认按标签在所有服务中发现,
+    # 配置 AGENT_SERVICE_NAME 时只查询该服务
+    AGENT_SERVICE_NAME: str = ""
+    AGENT_SERVICE_TAG: str = "agent"
+    AGENT_REFRESH_INTERVAL: int = 10
+    # Agent 健康状态: 超过 TTL(秒)未探测成功的 Agent 不分配任务; 连续失败达到阈值后熔断, 冷却时间(秒)随抖动翻倍
+    AGENT_HEALTH_TTL: int = 30
+    AGENT_BREAKER_FAILURES: int = 3
+    AGENT_BREAKER_COOLDOWN: int = 30
+    AGENT_BREAKER_MAX_COOLDOWN: int = 300
+    # 用例树节点计数的校验间隔(秒), 发现与用例表不一致时重建
+    CASE_COUNT_VERIFY_INTERVAL: int = 3600
+    # 进程内缓存的已序列化用例树个数(按 项目+树类型 计)
+    CASE_TREE_CACHE_SIZE: int = 128
+    # 实时日志中继: 每个订阅者缓冲的行数(超出丢弃最旧的)、新订阅者回放的行数、最后一个订阅者离开后保持上游连接的秒数
+    LOG_RELAY_BUFFER_LINES: int = 2000
+    LOG_RELAY_BACKLOG_LINES: int = 500
+    LOG_RELAY_GRACE: int = 30
+    # 与每个 Agent 的长连接池: 最大连接数、空闲连接保持时间(秒)
+    AGENT_HTTP_POOL_SIZE: int = 32
+    AGENT_HTTP_KEEPALIVE: int = 30
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
@@ -1,20 +1,107 @@
 import asyncio
-from typing import List
+import json
+import random
+from typing import Any, Callable, Dict, List
 
 import aiohttp
 from fastapi.responses import StreamingResponse
 from fastapi import HTTPException
 from loguru import logger
+from prometheus_client import Counter, Gauge
 import websockets
 
 from app.config.config import get_settings
 
 
+AGENT_CONNECTIONS_CREATED = Counter(
+    'agent_http_connections_created_total', 'New TCP connections opened to agents', ['agent'])
+AGENT_CONNECTIONS_REUSED = Counter(
+    'agent_http_connections_reused_total', 'Requests to agents served by a pooled keep-alive connection', ['agent'])
+AGENT_REQUESTS_IN_FLIGHT = Gauge(
+    'agent_http_requests_in_flight', 'HTTP requests to agents currently in flight', ['agent'])
+AGENT_REQUEST_RETRIES = Counter(
+    'agent_http_request_retries_total', 'Retried HTTP requests to agents', ['agent'])
+
+# 各操作的超时时间
+HEARTBEAT_TIMEOUT = aiohttp.ClientTimeout(total=1, sock_connect=1)
+RUN_TASK_TIMEOUT = aiohttp.ClientTimeout(total=30, sock_connect=3)
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=60)
+
+
+def _trace_config(agent: str) -> aiohttp.TraceConfig:
+    """连接池指标: 新建连接数、复用连接数、进行中的请求数"""
+    trace_config = aiohttp.TraceConfig()
+
+    async def on_connection_create_end(session, context, params):
+        AGENT_CONNECTIONS_CREATED.labels(agent).inc()
+
+    async def on_connection_reuseconn(session, context, params):
+        AGENT_CONNECTIONS_REUSED.labels(agent).inc()
+
+    async def on_request_start(session, context, params):
+        AGENT_REQUESTS_IN_FLIGHT.labels(agent).inc()
+
+    async def on_request_end(session, context, params):
+        AGENT_REQUESTS_IN_FLIGHT.labels(agent).dec()
+
+    trace_config.on_connection_create_end.append(on_connection_create_end)
+    trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_end)
+    return trace_config
+
+
 class AgentClient:
-    def __init__(self, base_url: str):
+    def __init__(self, base_url: str, port: int = 9001, agent_id: int | None = None):
+        self.id = agent_id
         self.domain = base_url
-        self.http_url = f'http://{base_url}:9001'
-        self.ws_url = f'ws://{base_url}:9001'
+        self.port = port
+        self.http_url = f'http://{base_url}:{port}'
+        self.ws_url = f'ws://{base_url}:{port}'
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """与该 Agent 共用的长连接会话(首次使用时创建, 由 Agent 池在关闭时释放)"""
+        if self._session is None or self._session.closed:
+            settings = get_settings()
+            connector = aiohttp.TCPConnector(
+                limit=settings.AGENT_HTTP_POOL_SIZE,
+                limit_per_host=settings.AGENT_HTTP_POOL_SIZE,
+                keepalive_timeout=settings.AGENT_HTTP_KEEPALIVE,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                auto_decompress=False,  # 下载日志时原样转发压缩内容
+                headers={'Accept-Encoding': 'identity'},  # 其余请求不使用压缩
+                trace_configs=[_trace_config(f'{self.domain}:{self.port}')],
+            )
+        return self._session
+
+    async def close(self):
+        """关闭会话"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def _request(self, method: str, path: str, *, idempotent: bool, retries: int = 2, **kwargs) -> aiohttp.ClientResponse:
+        """
+        发送请求, 失败时按指数退避加随机抖动重试
+        幂等请求在连接错误和超时时重试; 非幂等请求只在连接未建立(请求未发出)时重试
+        """
+        retry_on = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if idempotent else (aiohttp.ClientConnectorError,)
+        for attempt in range(retries + 1):
+            try:
+                return await self.session.request(method, f'{self.http_url}{path}', **kwargs)
+            except retry_on as e:
+                if attempt == retries:
+                    raise
+                delay = random.uniform(0, 0.2 * 2 ** attempt)
+                logger.warning(f'{method} {path} to agent {self.domain} failed ({e!r}), retry in {delay:.2f}s')
+                AGENT_REQUEST_RETRIES.labels(f'{self.domain}:{self.port}').inc()
+                await asyncio.sleep(delay)
+        raise RuntimeError('unreachable')
 
     async def heartbeat(self) -> dict:
         """
@@ -22,12 +109,13 @@ class AgentClient:
         :return: 包含心跳信息的字典
         """
         try:
-            async with aiohttp.ClientSession() as s:
-                async with s.get(f'{self.http_url}/heartbeat', timeout=aiohttp.ClientTimeout(total=1, sock_connect=1)) as resp:
-                    if resp.status != 200:
-                        raise HTTPException(status_code=resp.status, detail=f'heartbeat failed, status: {resp.status}')
-                    logger.info(f'heartbeat success, status: {resp.status}')
-                    return await resp.json()
+            async with await self._request('GET', '/heartbeat', idempotent=True, retries=1, timeout=HEARTBEAT_TIMEOUT) as resp:
+                if resp.status != 200:
+                    raise HTTPException(status_code=resp.status, detail=f'heartbeat failed, status: {resp.status}')
+                logger.info(f'heartbeat success, status: {resp.status}')
+                return await resp.json()
+        except HTTPException:
+            raise
         except asyncio.CancelledError:
             logger.warning("Agent heartbeat cancelled")
             raise HTTPException(status_code=500, detail="Agent is not running")
@@ -41,20 +129,41 @@ class AgentClient:
             logger.exception(f"Unexpected error during agent heartbeat: {e}")
             raise HTTPException(status_code=500, detail="Agent is not running")
 
-    async def start_ws_to_agent(self, task_id: str, queue: asyncio.Queue):
+    async def start_ws_to_agent(self, task_id: str, on_line: Callable[[str], None], offset: int | None = None, max_retries: int = 3):
         """
         建立 WebSocket 连接获取实时日志
+        Agent 推送的每条消息是一个JSON帧 {"offset", "next", "data"}, 拆分成行后逐行回调 on_line;
+        连接异常断开时携带 ?offset=<上一帧的next> 重连, 只接收缺失的内容
         :param task_id: 任务ID
-        :param queue: 用于存储日志消息的队列
+        :param on_line: 收到每一行日志时的回调
+        :param offset: 从指定字节偏移开始接收, 为空时从最后500行开始
+        :param max_retries: 连续重连失败的最大次数
         :return: None
         """
-        uri = f"{self.ws_url}/ws/logs/{task_id}"
-        async with websockets.connect(uri) as ws:
+        retries = 0
+        while True:
+            uri = f"{self.ws_url}/ws/logs/{task_id}"
+            if offset is not None:
+                uri = f"{uri}?offset={offset}"
             try:
-                async for msg in ws:
-                    await queue.put(msg)
+                async with websockets.connect(uri) as ws:
+                    retries = 0
+                    async for msg in ws:
+                        frame = json.loads(msg)
+                        offset = frame["next"]
+                        for line in frame["data"].splitlines():
+                            on_line(line)
+                return
+            except (websockets.ConnectionClosedError, OSError) as e:
+                retries += 1
+                if retries > max_retries:
+                    on_line(f"[ERROR]: {e}")
+                    return
+                logger.warning(f"log websocket of task {task_id} disconnected, reconnecting from offset {offset}: {e}")
+                await asyncio.sleep(min(2 ** retries, 10))
             except Exception as e:
-                await queue.put(f"[ERROR]: {e}")\
+                on_line(f"[ERROR]: {e}")
+                return
 
     async def run_task(self, job_id: int,
                        repo: str,
@@ -62,7 +171,9 @@ class AgentClient:
                        image: str,
                        branch: str,
                        env_vars: List[dict] | None = None,
-                       server: dict | None = None) -> dict:
+                       server: dict | None = None,
+                       case_durations: Dict[str, float] | None = None,
+                       cpus: float | None = None) -> dict:
         """
         触发任务执行
         :param job_id: 任务ID
@@ -72,45 +183,57 @@ class AgentClient:
         :param branch: 分支名称
         :param env_vars: 环境变量列表
         :param server: 服务器配置
+        :param case_durations: 用例历史耗时 {用例索引: 秒}，Agent 据此对用例分片并行执行
+        :param cpus: 容器CPU配额(核数), 设置后 Agent 按配额并行执行用例, 为空时串行执行
         :return: 包含任务执行信息的字典
         """
-        async with aiohttp.ClientSession() as s:
-            payload = {
-                'job_id': job_id,
-                'repo': repo,
-                'cases_index': cases_index,
-                'image': image,
-                'branch': branch,
-                'env_vars': env_vars,
-                'server': server,
-            }
-            # 发送 POST 请求到 Agent 的 /run 接口，触发任务执行
-            async with s.post(f'{self.http_url}/run', json=payload) as resp:
-                if resp.status != 200:
-                    logger.error(f'run task payload: {payload}')
-                    logger.error(f'run task failed, status: {resp.status}')
-                    logger.error(await resp.text())
-                response = await resp.json()
-                logger.debug(f'run task response: {response}')
-                return response
-
-    async def download_log(self, task_name: str, job_id: int) -> StreamingResponse:
+        payload = {
+            'job_id': job_id,
+            'repo': repo,
+            'cases_index': cases_index,
+            'image': image,
+            'branch': branch,
+            'env_vars': env_vars,
+            'server': server,
+            'case_durations': case_durations or {},
+            'cpus': cpus,
+        }
+        # 发送 POST 请求到 Agent 的 /run 接口，触发任务执行(非幂等, 只在连接未建立时重试)
+        async with await self._request('POST', '/run', idempotent=False, json=payload, timeout=RUN_TASK_TIMEOUT) as resp:
+            if resp.status != 200:
+                logger.error(f'run task payload: {payload}')
+                logger.error(f'run task failed, status: {resp.status}')
+                logger.error(await resp.text())
+            response = await resp.json()
+            logger.debug(f'run task response: {response}')
+            return response
+
+    async def download_log(self, task_name: str, job_id: int,
+                           range_header: str | None = None,
+                           if_range: str | None = None,
+                           accept_encoding: str | None = None) -> StreamingResponse:
         """
         下载任务完整日志
+        Range/If-Range/Accept-Encoding 原样透传给 Agent, 响应体不解压直接转发, 以支持断点续传和压缩传输
         :param task_name: 任务名称
         :param job_id: 任务ID
-        :return: 包含任务日志的 StreamingResponse
+        :param range_header: 客户端请求的 Range 头
+        :param if_range: 客户端请求的 If-Range 头
+        :param accept_encoding: 客户端请求的 Accept-Encoding 头
+        :return: 包含任务日志的 StreamingResponse(200 或 206)
         """
-        url = f"{self.http_url}/tasks/{job_id}/log"
-
-        session_timeout = aiohttp.ClientTimeout(total=60)
-        session = aiohttp.ClientSession(timeout=session_timeout)
+        headers = {"Accept-Encoding": accept_encoding or "identity"}
+        if range_header:
+            headers["Range"] = range_header
+            if if_range:
+                headers["If-Range"] = if_range
 
-        resp = await session.get(url)
-        if resp.status != 200:
+        resp = await self._request('GET', f'/tasks/{job_id}/log', idempotent=True, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+        if resp.status not in (200, 206):
             text = await resp.text()
-            await session.close()
-            raise HTTPException(status_code=resp.status, detail=f"Agent error: {text}")
+            resp.release()
+            exc_headers = {"Content-Range": resp.headers["Content-Range"]} if "Content-Range" in resp.headers else None
+            raise HTTPException(status_code=resp.status, detail=f"Agent error: {text}", headers=exc_headers)
 
         # ✔ 直接返回 aiohttp 的原始 stream，包装成 StreamingResponse
         async def stream():
@@ -124,18 +247,15 @@ class AgentClient:
             except Exception as e:
                 print(f"[Master Error] while streaming: {e}")
             finally:
-                await resp.release() # 释放响应资源
-                await session.close() # 关闭会话
+                resp.release() # 释放响应资源, 连接归还连接池
 
+        response_headers = {"Content-Disposition": f"attachment; filename={task_name}_{job_id}.log"}
+        for name in ("Content-Length", "Content-Range", "Content-Encoding", "Accept-Ranges", "ETag", "Last-Modified", "Vary"):
+            if name in resp.headers:
+                response_headers[name] = resp.headers[name]
         return StreamingResponse(
             stream(),
+            status_code=resp.status,
             media_type="text/plain",
-            headers={
-                "Content-Disposition": f"attachment; filename={task_name}_{job_id}.log",
-                "Content-Length": resp.headers.get("Content-Length", "0")  # ✅ 添加Content-Length头
-            }
+            headers=response_headers,
         )
-
-
-
-agent_client = AgentClient(get_settings().HOST_GATEWAY)
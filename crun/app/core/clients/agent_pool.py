@@ -0,0 +1,283 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+import aiohttp
+from fastapi import HTTPException
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config.config import get_settings
+from app.core.clients.agent_client import AgentClient
+from app.core.locks import LeaderLock
+from app.crud import crud_agent
+from app.schemas import AgentCapacity, AgentStatus
+
+
+def normalize_repo_url(repo: str) -> str:
+    """去掉认证信息、协议和 .git 后缀的仓库地址, 与 Agent 上报的已缓存仓库格式一致"""
+    url = repo.split('@', 1)[-1] if repo.startswith('https://') and '@' in repo else repo
+    url = url.replace('https://', '').rstrip('/')
+    if url.endswith('.git'):
+        url = url[:-4]
+    return url
+
+
+class AgentHealth:
+    """
+    Agent 的健康状态和熔断器
+    连续失败 AGENT_BREAKER_FAILURES 次后熔断(不再分配任务), 冷却期结束后由下一次探测决定是否恢复;
+    恢复后不久再次熔断(抖动)时冷却时间翻倍, 直到 AGENT_BREAKER_MAX_COOLDOWN
+    """
+    def __init__(self, failure_threshold: int, cooldown: float, max_cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.failures = 0  # 连续失败次数
+        self.last_success = 0.0  # 最近一次探测成功的时间(monotonic)
+        self.last_failure = 0.0
+        self.open_until = 0.0  # 熔断截止时间, 0 表示未熔断
+        self.closed_at = 0.0  # 最近一次从熔断中恢复的时间
+
+    @property
+    def is_open(self) -> bool:
+        """是否处于熔断中(冷却期内)"""
+        return time.monotonic() < self.open_until
+
+    def is_fresh(self, ttl: float) -> bool:
+        """最近 ttl 秒内探测成功过"""
+        return time.monotonic() - self.last_success <= ttl
+
+    def record_success(self) -> None:
+        now = time.monotonic()
+        if self.open_until:
+            self.open_until = 0.0
+            self.closed_at = now
+        elif self.closed_at and now - self.closed_at > self.max_cooldown:
+            self.cooldown = self.base_cooldown  # 恢复后稳定运行足够久, 重置冷却时间
+        self.failures = 0
+        self.last_success = now
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        self.failures += 1
+        self.last_failure = now
+        if self.failures < self.failure_threshold and not self.open_until:
+            return
+        if self.open_until or (self.closed_at and now - self.closed_at < self.max_cooldown):
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)  # 冷却后探测仍失败, 或刚恢复又失败
+        self.open_until = now + self.cooldown
+
+
+class AgentPool:
+    """
+    Agent 池
+    多个 worker 进程中只有持有主进程锁的一个定时从 Consul(或静态列表)发现 Agent, 探测健康状态(含熔断)和容量并写入 agent 表;
+    各 worker 分配任务时读取 agent 表中在线且状态未过期(AGENT_HEALTH_TTL)的 Agent, 按空闲槽位、已缓存的镜像和仓库选择,
+    并在库中原子地扣减槽位, 多个 worker 不会同时占用同一个 Agent 的最后一个槽位;
+    本进程分配时请求失败过的 Agent 先重新探测, 本进程内熔断的 Agent 不参与分配
+    """
+    def __init__(self):
+        self.settings = get_settings()
+        self.clients: Dict[int, AgentClient] = {}  # agent_id -> 已发现的 Agent
+        self.health: Dict[int, AgentHealth] = {}  # agent_id -> 健康状态
+        # 所有用过的 Agent 客户端(含已离线的), 复用各自的长连接会话
+        self._known: Dict[int | None, AgentClient] = {}
+        self.capacity: Dict[int, AgentCapacity] = {}  # agent_id -> 最近一次上报的容量
+        self._lock = asyncio.Lock()
+
+    async def discover(self) -> List[Tuple[str, str, int]]:
+        """
+        发现 Agent
+        :return: [(名称, 地址, 端口)]
+        """
+        if self.settings.AGENT_HOSTS:
+            agents = []
+            for item in self.settings.AGENT_HOSTS.split(','):
+                host, _, port = item.strip().partition(':')
+                if host:
+                    agents.append((item.strip(), host, int(port or self.settings.AGENT_PORT)))
+            return agents
+        if not self.settings.CONSUL_HOST:
+            return [(self.settings.HOST_GATEWAY, self.settings.HOST_GATEWAY, self.settings.AGENT_PORT)]
+
+        consul = f'http://{self.settings.CONSUL_HOST}:{self.settings.CONSUL_PORT}'
+        tag = self.settings.AGENT_SERVICE_TAG
+        agents = {}
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as s:
+            if self.settings.AGENT_SERVICE_NAME:
+                names = [self.settings.AGENT_SERVICE_NAME]
+            else:
+                # 各 Agent 的服务名不同(AGENT_NAME), 找出所有带 Agent 标签的服务
+                async with s.get(f'{consul}/v1/catalog/services') as resp:
+                    resp.raise_for_status()
+                    names = [name for name, tags in (await resp.json()).items() if tag in (tags or [])]
+            for name in names:
+                params = {'passing': 'true'}
+                if tag:
+                    params['tag'] = tag
+                async with s.get(f'{consul}/v1/health/service/{name}', params=params) as resp:
+                    resp.raise_for_status()
+                    for entry in await resp.json():
+                        service = entry['Service']
+                        agents[service['ID']] = (
+                            service['ID'], service['Address'] or entry['Node']['Address'], service['Port'])
+        return list(agents.values())
+
+    @staticmethod
+    def _parse_capacity(data: Dict[str, Any]) -> AgentCapacity:
+        """解析心跳响应中的容量"""
+        return AgentCapacity(
+            **data.get('scheduler', {}),
+            images=data.get('images', []),
+            repos=data.get('repos', []),
+        )
+
+    def _health(self, agent_id: int) -> AgentHealth:
+        if agent_id not in self.health:
+            self.health[agent_id] = AgentHealth(
+                self.settings.AGENT_BREAKER_FAILURES,
+                self.settings.AGENT_BREAKER_COOLDOWN,
+                self.settings.AGENT_BREAKER_MAX_COOLDOWN,
+            )
+        return self.health[agent_id]
+
+    async def probe(self, client: AgentClient) -> bool:
+        """探测单个 Agent, 更新健康状态和容量"""
+        health = self._health(client.id)
+        try:
+            data = await client.heartbeat()
+        except Exception as e:
+            logger.warning(f'agent {client.domain}:{client.port} heartbeat failed: {e}')
+            health.record_failure()
+            return False
+        self.capacity[client.id] = self._parse_capacity(data)
+        health.record_success()
+        return True
+
+    def report_failure(self, agent_id: int | None) -> None:
+        """分配任务时请求失败, 计入本进程的熔断器; 下一次分配到该 Agent 前会重新探测"""
+        if agent_id:
+            self._health(agent_id).record_failure()
+
+    def is_available(self, agent_id: int) -> bool:
+        """Agent 是否可以分配任务: 未熔断且状态未过期"""
+        health = self._health(agent_id)
+        return not health.is_open and health.is_fresh(self.settings.AGENT_HEALTH_TTL) and agent_id in self.capacity
+
+    async def refresh(self, db: AsyncSession) -> None:
+        """重新发现 Agent 并探测健康状态和容量"""
+        try:
+            discovered = await self.discover()
+        except Exception as e:
+            logger.error(f'discover agents failed: {e}')
+            discovered = None
+
+        if discovered is not None:
+            clients: Dict[int, AgentClient] = {}
+            for name, host, port in discovered:
+                agent = await crud_agent.upsert(db, name=name, host=host, port=port)
+                clients[agent.id] = await self._client(agent.id, host, port)
+            async with self._lock:
+                self.clients = clients
+                self.health = {agent_id: self._health(agent_id) for agent_id in clients}
+                self.capacity = {k: v for k, v in self.capacity.items() if k in clients}
+
+        # 探测请求并发, 写库串行(共用一个会话)
+        clients = list(self.clients.values())
+        await asyncio.gather(*(self.probe(client) for client in clients))
+        online_ids = []
+        for client in clients:
+            if self.is_available(client.id):
+                online_ids.append(client.id)
+                await crud_agent.update_capacity(
+                    db, agent_id=client.id, status=AgentStatus.ONLINE, capacity=self.capacity[client.id].model_dump())
+            else:
+                await crud_agent.update_capacity(db, agent_id=client.id, status=AgentStatus.OFFLINE, capacity=None)
+        await crud_agent.mark_offline(db, online_ids=online_ids)
+
+    async def _client(self, agent_id: int | None, host: str, port: int) -> AgentClient:
+        """获取 Agent 客户端, 地址变化时关闭旧的会话"""
+        client = self._known.get(agent_id)
+        if client and (client.domain, client.port) == (host, port):
+            return client
+        if client:
+            await client.close()
+        client = self._known[agent_id] = AgentClient(host, port, agent_id=agent_id)
+        return client
+
+    async def close(self) -> None:
+        """关闭所有 Agent 客户端的会话"""
+        await asyncio.gather(*(client.close() for client in self._known.values()), return_exceptions=True)
+        self._known.clear()
+        self.clients = {}
+
+    async def run(self, session_factory, leader: LeaderLock) -> None:
+        """后台定时刷新 Agent 池(只在持有主进程锁的 worker 中执行)"""
+        try:
+            while True:
+                try:
+                    if await leader.acquire():
+                        async with session_factory() as db:
+                            await self.refresh(db)
+                except Exception as e:
+                    logger.exception(f'refresh agent pool failed: {e}')
+                await asyncio.sleep(self.settings.AGENT_REFRESH_INTERVAL)
+        finally:
+            await leader.release()
+
+    def _score(self, agent_id: int, capacity: AgentCapacity, image: str | None, repo: str | None) -> tuple:
+        return (
+            capacity.free_slots > 0,  # 有空闲槽位的优先, 都没有时选排队最少的
+            self._health(agent_id).failures == 0,  # 最近没有失败过的优先
+            bool(repo) and normalize_repo_url(repo) in capacity.repos,  # 已缓存仓库, 只需增量拉取
+            bool(image) and image in capacity.images,  # 已缓存依赖环境
+            capacity.free_slots,
+            -capacity.queued,
+            -capacity.running,
+        )
+
+    async def select(self, db: AsyncSession, *, image: str | None = None, repo: str | None = None) -> AgentClient:
+        """
+        选择执行任务的 Agent
+        :param image: 任务镜像
+        :param repo: 任务仓库地址
+        """
+        agents = {
+            agent.id: agent
+            for agent in await crud_agent.list_available(db, ttl=self.settings.AGENT_HEALTH_TTL)
+            if not self._health(agent.id).is_open
+        }
+        capacities = {agent_id: AgentCapacity(**agent.capacity) for agent_id, agent in agents.items()}
+        while capacities:
+            agent_id = max(capacities, key=lambda i: self._score(i, capacities[i], image, repo))
+            agent = agents[agent_id]
+            client = await self._client(agent.id, agent.host, agent.port)
+            # 本进程最近请求失败过(但未熔断)的 Agent 先重新探测, 其余直接使用库中的状态
+            if self._health(agent_id).failures and not await self.probe(client):
+                del capacities[agent_id]
+                continue
+            # 在下一次心跳之前先在库中扣减容量, 避免各 worker 连续的任务都分配到同一个 Agent
+            if capacities[agent_id].free_slots <= 0:
+                await crud_agent.add_queued(db, agent_id=agent_id)
+                return client
+            if await crud_agent.claim_slot(db, agent_id=agent_id):
+                return client
+            capacities[agent_id].free_slots = 0  # 最后的槽位已被其他 worker 占用, 重新选择
+        raise HTTPException(status_code=503, detail="No agent is available")
+
+    async def get(self, db: AsyncSession, agent_id: int | None) -> AgentClient:
+        """
+        获取任务记录所在的 Agent(用于日志、下载等), Agent 已离线时仍按登记的地址访问
+        """
+        if agent_id in self.clients:
+            return self.clients[agent_id]
+        agent = await crud_agent.get(db=db, id=agent_id) if agent_id else None
+        if not agent:
+            # 早期记录的 agent_id 为 0, 对应 HOST_GATEWAY 上的 Agent
+            return await self._client(None, self.settings.HOST_GATEWAY, self.settings.AGENT_PORT)
+        return await self._client(agent.id, agent.host, agent.port)
+
+
+agent_pool = AgentPool()
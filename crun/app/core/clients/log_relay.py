@@ -0,0 +1,150 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Set
+
+from loguru import logger
+
+from app.config.config import get_settings
+from app.core.clients.agent_client import AgentClient
+
+
+class LogSubscriber:
+    """
+    单个日志订阅者(浏览器标签页)
+    使用有界的环形缓冲区, 消费过慢时丢弃最旧的行, 并在下一次读取时插入一条丢弃提示
+    """
+    def __init__(self, max_lines: int):
+        self.lines: Deque[str] = deque(maxlen=max_lines)
+        self.dropped = 0  # 尚未提示的丢弃行数
+        self.closed = False  # 上游已结束
+        self._event = asyncio.Event()
+
+    def push(self, line: str) -> None:
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+        self._event.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self._event.set()
+
+    async def get(self, timeout: float | None = None) -> str | None:
+        """
+        读取下一行; 超时返回None, 上游结束且缓冲区已读完时抛出 StopAsyncIteration
+        """
+        if not self.lines and not self.dropped:
+            if self.closed:
+                raise StopAsyncIteration
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            return f"[WARN]: 日志输出过快, 已跳过 {dropped} 行"
+        if not self.lines:
+            raise StopAsyncIteration
+        return self.lines.popleft()
+
+
+class LogRelay:
+    """
+    单个任务记录的日志中继
+    与 Agent 只保持一条 WebSocket 连接, 收到的日志行分发给所有订阅者;
+    最近的若干行作为回放缓存, 新订阅者先收到这些行
+    """
+    def __init__(self, record_id: str, agent_client: AgentClient, backlog_lines: int):
+        self.record_id = record_id
+        self.agent_client = agent_client
+        self.backlog: Deque[str] = deque(maxlen=backlog_lines)
+        self.subscribers: Set[LogSubscriber] = set()
+        self.finished = False
+        self._task: asyncio.Task | None = None
+        self._close_handle: asyncio.TimerHandle | None = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._close_handle:
+            self._close_handle.cancel()
+        if self._task:
+            self._task.cancel()
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+    def _on_line(self, line: str) -> None:
+        self.backlog.append(line)
+        for subscriber in self.subscribers:
+            subscriber.push(line)
+
+    async def _run(self) -> None:
+        try:
+            await self.agent_client.start_ws_to_agent(self.record_id, self._on_line)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"log relay of record {self.record_id} failed: {e}")
+        self.finished = True
+        for subscriber in self.subscribers:
+            subscriber.close()
+
+    def add(self, subscriber: LogSubscriber) -> None:
+        if self._close_handle:
+            self._close_handle.cancel()
+            self._close_handle = None
+        for line in self.backlog:
+            subscriber.push(line)
+        if self.finished:
+            subscriber.close()
+        self.subscribers.add(subscriber)
+
+    def remove(self, subscriber: LogSubscriber, grace: float, on_close) -> None:
+        """移除订阅者, 最后一个订阅者离开 grace 秒后仍无人订阅时关闭上游连接"""
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and not self._close_handle:
+            self._close_handle = asyncio.get_running_loop().call_later(grace, on_close, self)
+
+
+class LogRelayRegistry:
+    """按任务记录管理日志中继, Agent 连接数和内存占用不随查看人数增长"""
+    def __init__(self):
+        self.settings = get_settings()
+        self.relays: Dict[str, LogRelay] = {}
+
+    def _close(self, relay: LogRelay) -> None:
+        if relay.subscribers:
+            return
+        relay.stop()
+        if self.relays.get(relay.record_id) is relay:
+            del self.relays[relay.record_id]
+        logger.info(f"log relay of record {relay.record_id} closed")
+
+    @asynccontextmanager
+    async def subscribe(self, record_id: str, agent_client: AgentClient) -> AsyncIterator[LogSubscriber]:
+        """订阅任务记录的实时日志"""
+        relay = self.relays.get(record_id)
+        if relay is None or (relay.finished and not relay.subscribers):
+            if relay is not None:
+                relay.stop()
+            relay = self.relays[record_id] = LogRelay(
+                record_id, agent_client, self.settings.LOG_RELAY_BACKLOG_LINES)
+            relay.start()
+        subscriber = LogSubscriber(self.settings.LOG_RELAY_BUFFER_LINES)
+        relay.add(subscriber)
+        try:
+            yield subscriber
+        finally:
+            relay.remove(subscriber, self.settings.LOG_RELAY_GRACE, self._close)
+
+    def close(self) -> None:
+        """关闭所有中继"""
+        for relay in self.relays.values():
+            relay.stop()
+        self.relays.clear()
+
+
+log_relays = LogRelayRegistry()
@@ -0,0 +1,60 @@
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+
+class LeaderLock:
+    """
+    基于 MySQL GET_LOCK 的主进程锁
+    多个 worker 进程中只有持有锁的一个执行后台任务(Agent 探测、计数校验等);
+    锁绑定在一直占用的一条连接上, 进程退出或连接断开时由 MySQL 释放, 其他 worker 下一次尝试时接替
+    """
+    def __init__(self, engine: AsyncEngine, name: str):
+        self.engine = engine
+        self.name = name
+        self._conn: AsyncConnection | None = None
+
+    @property
+    def held(self) -> bool:
+        return self._conn is not None
+
+    async def _execute(self, conn: AsyncConnection, sql: str):
+        result = (await conn.execute(text(sql), {"name": self.name})).scalar()
+        await conn.commit()  # 锁是会话级的, 不需要保持事务(长事务会阻止 undo 清理)
+        return result
+
+    async def acquire(self) -> bool:
+        """尝试获取锁(不等待), 已持有时检查连接仍然可用"""
+        if self._conn is not None:
+            try:
+                if await self._execute(self._conn, "SELECT IS_USED_LOCK(:name) = CONNECTION_ID()") == 1:
+                    return True
+                logger.warning(f'leader lock {self.name} lost')
+            except Exception as e:
+                logger.warning(f'leader lock {self.name} connection lost: {e}')
+            await self.release()
+        conn = await self.engine.connect()
+        try:
+            acquired = await self._execute(conn, "SELECT GET_LOCK(:name, 0)") == 1
+        except Exception:
+            await conn.close()
+            raise
+        if not acquired:
+            await conn.close()
+            return False
+        self._conn = conn
+        logger.info(f'acquired leader lock {self.name}')
+        return True
+
+    async def release(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            await self._execute(conn, "SELECT RELEASE_LOCK(:name)")
+        except Exception:
+            pass
+        try:
+            await conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,70 @@
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from app.config.config import get_settings
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match 是否包含当前 ETag(忽略弱校验前缀 W/)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in (tag.removeprefix("W/") for tag in candidates)
+
+
+class CaseTreeCache:
+    """
+    用例树缓存
+    按 (树类型, 项目) 缓存已序列化的 JSON, 以数据库中项目的用例树版本号判断是否过期, 多个 worker 进程各自缓存也能保持一致;
+    同一棵树同时只构建一次, 超出容量时淘汰最久未使用的
+    """
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[Tuple[str, int], Tuple[int, bytes]] = OrderedDict()
+        self._locks: Dict[Tuple[str, int], asyncio.Lock] = {}
+
+    @staticmethod
+    def etag(kind: str, project_id: int, version: int) -> str:
+        return f'"{kind}-{project_id}-{version}"'
+
+    async def get(self, kind: str, project_id: int, version: int, build: Callable[[], Awaitable[Any]]) -> bytes:
+        """获取指定版本的树, 缓存中没有或版本不同时调用 build 构建并序列化"""
+        key = (kind, project_id)
+        cached = self.entries.get(key)
+        if cached and cached[0] == version:
+            self.entries.move_to_end(key)
+            return cached[1]
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            cached = self.entries.get(key)
+            if cached and cached[0] == version:
+                return cached[1]
+            tree = await build()
+            payload = json.dumps(tree, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+            # 并发请求可能读到更旧的版本, 不覆盖更新的缓存
+            if not cached or cached[0] < version:
+                self.entries[key] = (version, payload)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    evicted, _ = self.entries.popitem(last=False)
+                    self._locks.pop(evicted, None)
+        return payload
+
+    async def response(
+        self, request: Request, kind: str, project_id: int, version: int, build: Callable[[], Awaitable[Any]]
+    ) -> Response:
+        """返回缓存的树, 客户端的副本仍是当前版本时返回304"""
+        etag = self.etag(kind, project_id, version)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        payload = await self.get(kind, project_id, version, build)
+        return Response(content=payload, media_type="application/json", headers=headers)
+
+
+case_tree_cache = CaseTreeCache(get_settings().CASE_TREE_CACHE_SIZE)
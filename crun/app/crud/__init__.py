@@ -7,3 +7,4 @@ from .task.task_config import *
 from .task.task import *
 from .test_plan import *
 from .resource.server import *
+from .resource.agent import *
@@ -2,15 +2,17 @@ from ast import TypeVar
 import json
 import pdb
 from pydantic import BaseModel
-from sqlalchemy import Row, update, func
+from sqlalchemy import Integer, Row, cast, delete, insert, literal, or_, true, update, func
 from sqlalchemy.future import select
+from sqlalchemy.orm import aliased
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Any, List, Optional, Protocol, Sequence, Type, Dict, Set, Tuple, runtime_checkable
 
 from loguru import logger
 
 from app.crud.base import CRUDBase
-from app.models import TestCase, TestCaseNode, TestTask
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from app.models import TestCase, TestCaseNode, TestCaseNodeClosure, TestCaseNodeStat, TestCaseTreeVersion, TestTask
 from app.schemas import TestCaseCreate, TestCaseUpdate
 from app.schemas import TestCaseNodeTreeItem, TestCaseNodeTreeItemOfTask
 
@@ -42,11 +44,11 @@ class TreeBuilder:
         # 获取所有节点
         nodes = await self._get_all_nodes(db, project_id)
 
-        # 用例总数统计：{node_id -> count}
-        total_case_counts = await self._get_case_counts(db)
+        # 节点计数(已含子孙节点)：{node_id -> (用例总数, 已自动化数, 可自动化数)}
+        case_counts = await self._get_case_counts(db, project_id)
         # 选中的用例数统计：{node_id -> count}
         selected_case_counts = (
-            await self._get_selected_case_counts(db, selected_case_indexes)
+            await self._get_selected_case_counts(db, project_id, selected_case_indexes)
             if selected_case_indexes else {}
         )
 
@@ -58,7 +60,7 @@ class TreeBuilder:
 
         # 递归添加 case_count 和 selected_case_count
         for root in root_nodes:
-            self._accumulate_counts(root, total_case_counts, selected_case_counts)
+            self._accumulate_counts(root, case_counts, selected_case_counts)
         return root_nodes
 
     async def _get_all_nodes(self, db: AsyncSession, project_id: int) -> List[TestCaseNode]:
@@ -70,24 +72,26 @@ class TreeBuilder:
         )
         return result.scalars().all()
 
-    async def _get_case_counts(self, db: AsyncSession) -> Dict[int | None, int]:
+    async def _get_case_counts(self, db: AsyncSession, project_id: int) -> Dict[int, Tuple[int, int, int]]:
         """
-        获取每个节点下的用例总数
+        获取项目各节点的计数(已含子孙节点), 直接读取节点计数表
         """
+        stat = TestCaseNodeStat
         result = await db.execute(
-            select(TestCase.node_id, func.count(TestCase.index)).group_by(TestCase.node_id)
+            select(stat.node_id, stat.case_count, stat.automated_count, stat.automation_count)
+            .where(stat.project_id == project_id)
         )
-        return {row[0]: row[1] for row in result.all()}
+        return {row[0]: (row[1], row[2], row[3]) for row in result.all()}
 
     async def _get_selected_case_counts(
-        self, db: AsyncSession, selected_case_indexes: Set[str]
+        self, db: AsyncSession, project_id: int, selected_case_indexes: Set[str]
     ) -> Dict[int, int]:
         """
         获取选中的用例数统计
         """
         result = await db.execute(
             select(TestCase.node_id, func.count(TestCase.index))
-            .where(TestCase.index.in_(selected_case_indexes))
+            .where(TestCase.project_id == project_id, TestCase.index.in_(selected_case_indexes))
             .group_by(TestCase.node_id)
         )
         return {row[0]: row[1] for row in result.all()}
@@ -122,23 +126,20 @@ class TreeBuilder:
     def _accumulate_counts(
         self,
         node: CaseNode,
-        case_counts: Dict[int | None, int],
+        case_counts: Dict[int, Tuple[int, int, int]],
         selected_counts: Dict[int, int]
-    ) -> Tuple[int, int]:
+    ) -> int:
         """
-        递归累加节点下的用例总数和选中用例数
+        填充节点计数, 并递归累加选中用例数(用例计数已含子孙节点, 无需累加)
         """
         node_id = int(node["key"])
-        total = case_counts.get(node_id, 0)
+        node["case_count"], node["automated_count"], node["automation_count"] = case_counts.get(node_id, (0, 0, 0))
         selected = selected_counts.get(node_id, 0)
         for child in node["children"]:
-            child_total, child_selected = self._accumulate_counts(child, case_counts, selected_counts)
-            total += child_total
-            selected += child_selected
-        node["case_count"] = total
+            selected += self._accumulate_counts(child, case_counts, selected_counts)
         if selected:
             node["selected_case_count"] = selected
-        return total, selected
+        return selected
 
 
 class CRUDTestCaseNode(CRUDBase[TestCaseNode, TestCaseCreate, TestCaseUpdate]):
@@ -156,41 +157,244 @@ class CRUDTestCaseNode(CRUDBase[TestCaseNode, TestCaseCreate, TestCaseUpdate]):
             result = await db.execute(select(self.model).filter(self.model.id == id, self.model.project_id == project_id))
         return result.scalars().first()
 
-    async def remove(self, db: AsyncSession, *, id: int) -> Optional[TestCaseNode]:
+    async def _link(self, db: AsyncSession, node_id: int, parent_id: int | None) -> None:
+        """
+        维护闭包表: 新节点与自身(depth 0), 以及父节点的所有祖先
         """
-        Remove a case node and all its children recursively.
+        closure = TestCaseNodeClosure
+        await db.execute(insert(closure).values(ancestor_id=node_id, descendant_id=node_id, depth=0))
+        if parent_id:
+            await db.execute(insert(closure).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(closure.ancestor_id, literal(node_id), closure.depth + 1)
+                .where(closure.descendant_id == parent_id),
+            ))
+
+    def subtree_query(self, node_id: int, include_self: bool = True):
         """
-        nodes_to_delete_ids = [id]
+        子树(含自身)所有节点ID的查询, 可直接用作 IN 子查询
+        """
+        closure = TestCaseNodeClosure
+        query = select(closure.descendant_id).where(closure.ancestor_id == node_id)
+        if not include_self:
+            query = query.where(closure.depth > 0)
+        return query
 
-        async def collect_children_ids(node_id: int):
-            children_query = await db.execute(select(self.model.id).filter(self.model.parent_id == node_id))
-            children_ids = children_query.scalars().all()
-            for child_id in children_ids:
-                nodes_to_delete_ids.append(child_id)
-                await collect_children_ids(child_id)
+    async def subtree_ids(self, db: AsyncSession, node_id: int, include_self: bool = True) -> List[int]:
+        """
+        获取子树所有节点ID
+        """
+        result = await db.execute(self.subtree_query(node_id, include_self))
+        return list(result.scalars().all())
 
-        await collect_children_ids(id)
+    async def bump_version(self, db: AsyncSession, project_id: int) -> None:
+        """
+        递增项目用例树的版本号, 与节点/用例的变更在同一事务内提交, 不提交
+        """
+        version = TestCaseTreeVersion
+        await db.execute(
+            mysql_insert(version).values(project_id=project_id, version=1)
+            .on_duplicate_key_update(version=version.version + 1)
+        )
 
-        # Update related TestCases
+    async def get_version(self, db: AsyncSession, project_id: int) -> int:
+        """
+        获取项目用例树的版本号, 从未变更过的项目为0
+        """
+        result = await db.execute(
+            select(TestCaseTreeVersion.version).where(TestCaseTreeVersion.project_id == project_id)
+        )
+        return result.scalar_one_or_none() or 0
+
+    async def shift_counts(
+        self,
+        db: AsyncSession,
+        project_id: int,
+        node_id: int | None,
+        case_count: int,
+        automated_count: int = 0,
+        automation_count: int = 0,
+        include_self: bool = True,
+    ) -> None:
+        """
+        将用例数的变化累加到节点的所有祖先(默认含自身)的计数上, 不提交
+        """
+        if not node_id or not (case_count or automated_count or automation_count):
+            return
+        stat = TestCaseNodeStat
+        closure = TestCaseNodeClosure
+        ancestors = select(
+            closure.ancestor_id, literal(project_id), literal(case_count),
+            literal(automated_count), literal(automation_count),
+        ).where(closure.descendant_id == node_id)
+        if not include_self:
+            ancestors = ancestors.where(closure.depth > 0)
+        stmt = mysql_insert(stat).from_select(
+            ["node_id", "project_id", "case_count", "automated_count", "automation_count"], ancestors
+        ).on_duplicate_key_update(
+            case_count=stat.case_count + case_count,
+            automated_count=stat.automated_count + automated_count,
+            automation_count=stat.automation_count + automation_count,
+        )
+        await db.execute(stmt)
+
+    async def get_counts(self, db: AsyncSession, node_id: int) -> Tuple[int, int, int]:
+        """
+        获取节点的计数(含子孙节点): (用例总数, 已自动化数, 可自动化数)
+        """
+        stat = TestCaseNodeStat
+        result = await db.execute(
+            select(stat.case_count, stat.automated_count, stat.automation_count).where(stat.node_id == node_id)
+        )
+        row = result.first()
+        return (row[0], row[1], row[2]) if row else (0, 0, 0)
+
+    def _count_query(self, project_id: int):
+        """
+        从用例表重新统计项目各节点计数的查询
+        """
+        closure = TestCaseNodeClosure
+        return (
+            select(
+                closure.ancestor_id, literal(project_id), func.count(),
+                func.coalesce(func.sum(cast(TestCase.automated, Integer)), 0),
+                func.coalesce(func.sum(cast(TestCase.automation, Integer)), 0),
+            )
+            .select_from(TestCase)
+            .join(closure, closure.descendant_id == TestCase.node_id)
+            .where(TestCase.project_id == project_id)
+            .group_by(closure.ancestor_id)
+        )
+
+    async def recount(self, db: AsyncSession, project_id: int) -> None:
+        """
+        从用例表重建项目的节点计数(批量导入后、校验发现偏差时), 不提交
+        """
+        stat = TestCaseNodeStat
+        await db.execute(delete(stat).where(stat.project_id == project_id))
+        await db.execute(insert(stat).from_select(
+            ["node_id", "project_id", "case_count", "automated_count", "automation_count"],
+            self._count_query(project_id),
+        ))
+
+    async def verify_counts(self, db: AsyncSession, project_id: int) -> int:
+        """
+        校验项目的节点计数, 有偏差时重建并提交, 返回有偏差的节点数
+        """
+        stat = TestCaseNodeStat
+        expected = {
+            row[0]: (row[2], int(row[3]), int(row[4]))
+            for row in (await db.execute(self._count_query(project_id))).all()
+        }
+        stored = {
+            row[0]: (row[1], row[2], row[3])
+            for row in (await db.execute(
+                select(stat.node_id, stat.case_count, stat.automated_count, stat.automation_count)
+                .where(stat.project_id == project_id)
+            )).all()
+            if any(row[1:])
+        }
+        drift = sum(1 for node_id in expected.keys() | stored.keys() if expected.get(node_id) != stored.get(node_id))
+        if drift:
+            await self.recount(db, project_id)
+            await self.bump_version(db, project_id)
+            await db.commit()
+        return drift
+
+    async def create(self, db: AsyncSession, *, project_id: int, obj_in: TestCaseCreate | dict) -> TestCaseNode:
+        """
+        创建节点, 同时写入闭包表
+        """
+        obj_in_data = obj_in if isinstance(obj_in, dict) else obj_in.model_dump()
+        db_obj = self.model(**{
+            "project_id": project_id,
+            **obj_in_data
+        })
+        db.add(db_obj)
+        await db.flush()
+        await self._link(db, db_obj.id, db_obj.parent_id)
+        await self.bump_version(db, project_id)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def move(self, db: AsyncSession, node: TestCaseNode, parent_id: int | None) -> None:
+        """
+        将节点(连同子树)移动到新的父节点下, 不提交
+        """
+        closure = TestCaseNodeClosure
+        if parent_id:
+            parent = await self.get(db, id=parent_id)
+            if not parent or parent.project_id != node.project_id:
+                raise ValueError("Parent node not found in this project")
+            in_subtree = await db.execute(select(closure.ancestor_id).where(
+                closure.ancestor_id == node.id, closure.descendant_id == parent_id))
+            if in_subtree.first():
+                raise ValueError("Cannot move a node into its own subtree")
+
+        # 子树的用例计数从原祖先上减去, 关系更新后再加到新祖先上
+        counts = await self.get_counts(db, node.id)
+        await self.shift_counts(db, node.project_id, node.id, *(-count for count in counts), include_self=False)
+
+        # MySQL 不允许在 DELETE 的子查询中引用被删除的表(错误1093), 先查出子树节点ID
+        subtree_ids = await self.subtree_ids(db, node.id)
+        # 断开子树与原祖先的关系
         await db.execute(
-            update(TestCase)
-            .where(TestCase.node_id.in_(nodes_to_delete_ids))
-            .values(node_id=None)
+            delete(closure)
+            .where(closure.descendant_id.in_(subtree_ids), closure.ancestor_id.not_in(subtree_ids))
         )
+        # 新祖先 x 子树
+        if parent_id:
+            supertree = aliased(closure)
+            subtree = aliased(closure)
+            await db.execute(insert(closure).from_select(
+                ["ancestor_id", "descendant_id", "depth"],
+                select(supertree.ancestor_id, subtree.descendant_id, supertree.depth + subtree.depth + 1)
+                .select_from(supertree)
+                .join(subtree, true())
+                .where(supertree.descendant_id == parent_id, subtree.ancestor_id == node.id),
+            ))
+            await self.shift_counts(db, node.project_id, node.id, *counts, include_self=False)
+        node.parent_id = parent_id
+
+    async def update(self, db: AsyncSession, *, db_obj: TestCaseNode, obj_in: TestCaseUpdate | Dict[str, Any]) -> TestCaseNode:
+        """
+        更新节点, parent_id 变化时移动子树
+        """
+        update_data = dict(obj_in) if isinstance(obj_in, dict) else obj_in.model_dump(exclude_unset=True)
+        if "parent_id" in update_data:
+            parent_id = update_data.pop("parent_id")
+            if (parent_id or None) != (db_obj.parent_id or None):
+                await self.move(db, db_obj, parent_id)
+        await self.bump_version(db, db_obj.project_id)
+        return await super().update(db, db_obj=db_obj, obj_in=update_data)
 
-        # Delete all collected nodes
-        obj_query = await db.execute(select(self.model).filter(self.model.id.in_(nodes_to_delete_ids)))
-        objs_to_delete = obj_query.scalars().all()
-        
-        if not objs_to_delete:
+    async def remove(self, db: AsyncSession, *, id: int) -> Optional[TestCaseNode]:
+        """
+        Remove a case node and all its children.
+        """
+        node = await self.get(db, id=id)
+        if not node:
             return None
+        # 先查出子树节点ID, 避免 MySQL 错误1093
+        nodes_to_delete_ids = await self.subtree_ids(db, id) or [id]
 
-        for obj in objs_to_delete:
-            await db.delete(obj)
+        # 子树的用例不再属于任何节点, 从祖先的计数上减去
+        counts = await self.get_counts(db, id)
+        await self.shift_counts(db, node.project_id, id, *(-count for count in counts), include_self=False)
+        await db.execute(delete(TestCaseNodeStat).where(TestCaseNodeStat.node_id.in_(nodes_to_delete_ids)))
 
+        # Update related TestCases
+        await db.execute(
+            update(TestCase)
+            .where(TestCase.node_id.in_(nodes_to_delete_ids))
+            .values(node_id=None)
+        )
+        await db.execute(delete(TestCaseNodeClosure).where(TestCaseNodeClosure.descendant_id.in_(nodes_to_delete_ids)))
+        await db.execute(delete(self.model).where(self.model.id.in_(nodes_to_delete_ids)))
+        await self.bump_version(db, node.project_id)
         await db.commit()
-        
-        return objs_to_delete[0]
+        return node
 
     async def get_tree(self, db: AsyncSession, project_id: int) -> List[TestCaseNodeTreeItem]:
         tree: List[TestCaseNodeTreeItem] = await self.tree_builder.build_tree_with_case_counts(
@@ -199,6 +403,62 @@ class CRUDTestCaseNode(CRUDBase[TestCaseNode, TestCaseCreate, TestCaseUpdate]):
         )
         return tree
     
+    async def get_children(
+        self, db: AsyncSession, project_id: int, parent_id: int | None = None, depth: int = 1
+    ) -> List[Dict[str, Any]]:
+        """
+        懒加载: 获取节点的子节点(不传 parent_id 时为根节点)及其计数, depth > 1 时一并展开下面几层
+        通过闭包表一次查询取出所需的所有节点
+        """
+        closure = TestCaseNodeClosure
+        stat = TestCaseNodeStat
+        node = self.model
+        if parent_id:
+            scope = select(closure.descendant_id).where(
+                closure.ancestor_id == parent_id, closure.depth.between(1, depth))
+        else:
+            roots = select(node.id).where(
+                node.project_id == project_id, or_(node.parent_id.is_(None), node.parent_id == 0))
+            scope = select(closure.descendant_id).where(closure.ancestor_id.in_(roots), closure.depth < depth)
+        children = aliased(closure)
+        child_count = (
+            select(func.count()).select_from(children)
+            .where(children.ancestor_id == node.id, children.depth == 1)
+            .correlate(node).scalar_subquery().label("child_count")
+        )
+        result = await db.execute(
+            select(
+                node.id, node.name, node.parent_id,
+                stat.case_count, stat.automated_count, stat.automation_count, child_count,
+            )
+            .outerjoin(stat, stat.node_id == node.id)
+            .where(node.project_id == project_id, node.id.in_(scope))
+            .order_by(node.id)
+        )
+        node_map: Dict[int, Dict[str, Any]] = {}
+        for row in result.all():
+            node_map[row.id] = {
+                "key": str(row.id),
+                "title": row.name,
+                "parent_id": row.parent_id,
+                "case_count": row.case_count or 0,
+                "automated_count": row.automated_count or 0,
+                "automation_count": row.automation_count or 0,
+                "child_count": row.child_count,
+                "is_leaf": not row.child_count,
+                "children": None,
+            }
+        items = []
+        for item in node_map.values():
+            parent = node_map.get(item["parent_id"])
+            if parent is None:
+                items.append(item)
+            else:
+                if parent["children"] is None:
+                    parent["children"] = []
+                parent["children"].append(item)
+        return items
+
     async def get_tree_with_task_selected(
         self, db: AsyncSession, project_id: int, task_id: int
     ) -> List[TestCaseNodeTreeItemOfTask]:
@@ -251,6 +511,8 @@ class CRUDTestCaseNode(CRUDBase[TestCaseNode, TestCaseCreate, TestCaseUpdate]):
                 })
                 db.add(node)
                 await db.flush()
+                await self._link(db, node.id, parent_id)
+                await self.bump_version(db, project_id)
             parent_id = node.id
         return node.id if node else None
 
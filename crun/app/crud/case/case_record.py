@@ -1,11 +1,19 @@
-from typing import List
+from typing import Dict, List
 from fastapi import HTTPException
+from sqlalchemy import func
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from app.crud.base import CRUDBase
 from app.models import TestTaskRecord, TestCaseRecord
-from app.schemas import CaseResultCreate, CaseRecordUpdate
+from app.schemas import (
+    CaseResultCreate,
+    CaseRecordUpdate,
+    CaseResultBatchCreate,
+    CaseResultBatchFailure,
+    CaseResultBatchOut,
+)
 
 
 class CRUDCaseRecord(CRUDBase[TestCaseRecord, CaseResultCreate, CaseRecordUpdate]):
@@ -27,6 +35,23 @@ class CRUDCaseRecord(CRUDBase[TestCaseRecord, CaseResultCreate, CaseRecordUpdate
         )
         return result.scalars().first() # 返回第一个匹配的记录
 
+    async def get_case_durations(self, db: AsyncSession, *, project_id: int, case_indexes: List[str]
+    ) -> Dict[str, float]:
+        """获取用例的历史平均耗时 {用例索引: 秒}，用于执行时按耗时分片"""
+        if not case_indexes:
+            return {}
+        result = await db.execute(
+            select(self.model.case_index, func.avg(self.model.duration))
+            .join(TestTaskRecord, TestTaskRecord.id == self.model.task_record_id)
+            .where(
+                TestTaskRecord.project_id == project_id,
+                self.model.case_index.in_(case_indexes),
+                self.model.duration.is_not(None),
+            )
+            .group_by(self.model.case_index)
+        )
+        return {row[0]: float(row[1]) for row in result.all()}
+
     async def update_case_record(self, db: AsyncSession, record_id: str, data_in: CaseResultCreate,) -> TestCaseRecord:
         """更新测试用例记录"""
         tr = await db.get(TestTaskRecord, record_id)
@@ -50,5 +75,50 @@ class CRUDCaseRecord(CRUDBase[TestCaseRecord, CaseResultCreate, CaseRecordUpdate
         await db.refresh(case_record)
         return case_record
 
+    async def bulk_update_case_records(self, db: AsyncSession, data_in: CaseResultBatchCreate) -> CaseResultBatchOut:
+        """批量更新测试用例记录: 一次查询 + 一条多行 upsert + 一次提交"""
+        tr = await db.get(TestTaskRecord, data_in.record_id)
+        if not tr:
+            raise HTTPException(status_code=404, detail="Task record not found")
+
+        # 同一用例多次上报时以最后一次为准
+        items = {item.case_index: item for item in data_in.results}
+        existing = await db.execute(
+            select(self.model.case_index).where(
+                self.model.task_record_id == tr.id,
+                self.model.case_index.in_(items.keys()),
+            )
+        )
+        existing_indexes = set(existing.scalars().all())
+
+        out = CaseResultBatchOut()
+        rows = []
+        for case_index, item in items.items():
+            if case_index not in existing_indexes:
+                out.failed.append(CaseResultBatchFailure(case_index=case_index, detail="Case record not found"))
+                continue
+            rows.append({
+                'task_record_id': tr.id,
+                'case_index': case_index,
+                'result': item.result,
+                'start_time': item.start_time,
+                'end_time': item.end_time,
+                'duration': item.duration,
+            })
+
+        if rows:
+            stmt = mysql_insert(self.model).values(rows)
+            stmt = stmt.on_duplicate_key_update(
+                result=stmt.inserted.result,
+                start_time=stmt.inserted.start_time,
+                end_time=stmt.inserted.end_time,
+                duration=stmt.inserted.duration,
+                updated_at=func.now(),  # ON DUPLICATE KEY UPDATE 不会触发列的 onupdate
+            )
+            await db.execute(stmt)
+            await db.commit()
+        out.succeeded = len(rows)
+        return out
+
 
 crud_case_record = CRUDCaseRecord(TestCaseRecord)
\ No newline at end of file
@@ -1,12 +1,14 @@
-from typing import Optional, List, Sequence
+from typing import Any, Dict, Optional, List, Sequence
 
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import func
+from sqlalchemy.orm import noload
 from sqlalchemy.dialects.mysql import insert as mysql_insert
 
 from app.crud.base import CRUDBase
-from app.models import TestCase, TestCaseNode
+from app.crud.case.case_node import case_node as crud_case_node
+from app.models import TestCase, TestCaseNode, TestCaseNodeClosure
 from app.schemas import TestCaseCreate, TestCaseUpdate
 
 
@@ -24,28 +26,28 @@ class CRUDTestCase(CRUDBase[TestCase, TestCaseCreate, TestCaseUpdate]):
         return result.scalars().first()
 
     async def get_all_child_nodes(self, db: AsyncSession, node_id: int) -> List[int]:
-        """递归获取所有子节点ID"""
-        query = select(TestCaseNode.id).where(TestCaseNode.parent_id == node_id)
-        result = await db.execute(query)
-        direct_child_ids = result.scalars().all()
-
-        all_child_ids = list(direct_child_ids)
-        for child_id in direct_child_ids:
-            all_child_ids.extend(await self.get_all_child_nodes(db, child_id))
-
-        return all_child_ids
+        """获取所有子孙节点ID(闭包表, 一次查询)"""
+        result = await db.execute(
+            select(TestCaseNodeClosure.descendant_id)
+            .where(TestCaseNodeClosure.ancestor_id == node_id, TestCaseNodeClosure.depth > 0)
+        )
+        return list(result.scalars().all())
+
+    @staticmethod
+    def _subtree_filter(query, node_id: int):
+        """限定为节点子树(含自身)下的用例"""
+        subtree = select(TestCaseNodeClosure.descendant_id).where(TestCaseNodeClosure.ancestor_id == node_id)
+        return query.where(TestCase.node_id.in_(subtree))
 
     async def get_multi(
         self, db: AsyncSession, *, skip: int = 0, limit: int = 100, **kwargs
     ) -> Sequence[TestCase]:
-        """根据节点ID递归获取所有子节点的测试用例"""
+        """获取节点子树下的测试用例"""
         query = select(self.model)
         node_id = kwargs.pop('node_id', None)
 
         if node_id is not None:
-            child_node_ids = await self.get_all_child_nodes(db, node_id)
-            all_node_ids = [node_id] + child_node_ids
-            query = query.where(self.model.node_id.in_(all_node_ids))
+            query = self._subtree_filter(query, node_id)
 
         for key, value in kwargs.items():
             if value is not None:
@@ -55,14 +57,12 @@ class CRUDTestCase(CRUDBase[TestCase, TestCaseCreate, TestCaseUpdate]):
         return result.scalars().all()
 
     async def count(self, db: AsyncSession, **kwargs) -> int:
-        """根据节点ID递归统计所有子节点的测试用例数量"""
+        """统计节点子树下的测试用例数量"""
         query = select(func.count()).select_from(self.model)
         node_id = kwargs.pop('node_id', None)
 
         if node_id is not None:
-            child_node_ids = await self.get_all_child_nodes(db, node_id)
-            all_node_ids = [node_id] + child_node_ids
-            query = query.where(self.model.node_id.in_(all_node_ids))
+            query = self._subtree_filter(query, node_id)
 
         for key, value in kwargs.items():
             if value is not None:
@@ -71,6 +71,53 @@ class CRUDTestCase(CRUDBase[TestCase, TestCaseCreate, TestCaseUpdate]):
         result = await db.execute(query)
         return result.scalar_one()
 
+    @staticmethod
+    def _counts_of(case: TestCase, sign: int = 1) -> tuple[int, int, int]:
+        """用例对节点计数的贡献: (用例数, 已自动化数, 可自动化数)"""
+        return sign, sign * int(bool(case.automated)), sign * int(bool(case.automation))
+
+    async def create(self, db: AsyncSession, *, project_id: int, obj_in: TestCaseCreate | dict) -> TestCase:
+        """创建测试用例, 同一事务内更新节点计数"""
+        obj_in_data = obj_in if isinstance(obj_in, dict) else obj_in.model_dump()
+        db_obj = self.model(**{
+            "project_id": project_id,
+            **obj_in_data
+        })
+        db.add(db_obj)
+        await db.flush()
+        await crud_case_node.shift_counts(db, db_obj.project_id, db_obj.node_id, *self._counts_of(db_obj))
+        await crud_case_node.bump_version(db, db_obj.project_id)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def update(
+        self, db: AsyncSession, *, db_obj: TestCase, obj_in: TestCaseUpdate | Dict[str, Any]
+    ) -> TestCase:
+        """更新测试用例, 节点或自动化状态变化时同一事务内更新节点计数"""
+        update_data = obj_in if isinstance(obj_in, dict) else obj_in.model_dump(exclude_unset=True)
+        old_node_id, old_counts = db_obj.node_id, self._counts_of(db_obj)
+        for field, value in update_data.items():
+            setattr(db_obj, field, value)
+        if old_node_id != db_obj.node_id or old_counts != self._counts_of(db_obj):
+            await crud_case_node.shift_counts(db, db_obj.project_id, old_node_id, *(-count for count in old_counts))
+            await crud_case_node.shift_counts(db, db_obj.project_id, db_obj.node_id, *self._counts_of(db_obj))
+        await crud_case_node.bump_version(db, db_obj.project_id)
+        db.add(db_obj)
+        await db.commit()
+        await db.refresh(db_obj)
+        return db_obj
+
+    async def remove(self, db: AsyncSession, *, id: int) -> Optional[TestCase]:
+        """删除测试用例, 同一事务内更新节点计数"""
+        obj = await self.get_by_id(db, id=id)
+        if obj:
+            await crud_case_node.shift_counts(db, obj.project_id, obj.node_id, *self._counts_of(obj, -1))
+            await crud_case_node.bump_version(db, obj.project_id)
+            await db.delete(obj)
+            await db.commit()
+        return obj
+
     async def get_by_name(self, db: AsyncSession, *, name: str) -> Optional[TestCase]:
         """根据用例名称获取测试用例"""
         result = await db.execute(select(TestCase).filter(TestCase.name == name))
@@ -86,8 +133,45 @@ class CRUDTestCase(CRUDBase[TestCase, TestCaseCreate, TestCaseUpdate]):
         result = await db.execute(select(TestCase).filter(TestCase.node_id == node_id))
         return result.scalars().all()
 
+    async def get_page_by_node(
+        self,
+        db: AsyncSession,
+        *,
+        project_id: int,
+        node_id: int,
+        recursive: bool = False,
+        cursor: int | None = None,
+        limit: int = 50,
+    ) -> tuple[Sequence[TestCase], int | None]:
+        """
+        按用例ID游标分页获取节点(recursive 时为整个子树)下的用例, 返回 (本页用例, 下一页游标)
+        """
+        query = select(TestCase).options(noload(TestCase.bugs)).where(TestCase.project_id == project_id)
+        if recursive:
+            query = self._subtree_filter(query, node_id)
+        else:
+            query = query.where(TestCase.node_id == node_id)
+        if cursor:
+            query = query.where(TestCase.id > cursor)
+        result = await db.execute(query.order_by(TestCase.id).limit(limit + 1))
+        datas = result.scalars().all()
+        next_cursor = datas[limit - 1].id if len(datas) > limit else None
+        return datas[:limit], next_cursor
+
+    async def get_briefs_by_node(self, db: AsyncSession, *, project_id: int) -> dict[int, list]:
+        """一次查询项目所有用例的 (node_id, index, name), 按节点分组"""
+        result = await db.execute(
+            select(TestCase.node_id, TestCase.index, TestCase.name)
+            .where(TestCase.project_id == project_id, TestCase.node_id.is_not(None))
+            .order_by(TestCase.id)
+        )
+        groups: dict[int, list] = {}
+        for node_id, index, name in result.all():
+            groups.setdefault(node_id, []).append((index, name))
+        return groups
+
     async def create_or_update_cases(self, db: AsyncSession, cases: list[TestCaseCreate]) -> None:
-        """创建或更新测试用例"""
+        """创建或更新测试用例, 同一事务内重建所涉及项目的节点计数"""
         case_dicts = [case.model_dump() for case in cases] # model_dump将模型实例转换为字典
         stmt = mysql_insert(TestCase).values(case_dicts) # 构建插入语句
 
@@ -101,6 +185,10 @@ class CRUDTestCase(CRUDBase[TestCase, TestCaseCreate, TestCaseUpdate]):
         stmt = stmt.on_duplicate_key_update(**update_dict)
 
         await db.execute(stmt)
+        # 批量导入可能同时新增、移动和修改大量用例, 直接按项目重新统计
+        for project_id in {case.get("project_id") for case in case_dicts} - {None}:
+            await crud_case_node.recount(db, project_id)
+            await crud_case_node.bump_version(db, project_id)
         await db.commit()
 
 
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+from sqlalchemy import func, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.crud.base import CRUDBase
+from app.models import Agent
+from app.schemas import AgentStatus
+
+
+class CRUDAgent(CRUDBase[Agent, Any, Any]):
+    """
+    Agent CRUD: 执行节点注册表
+    """
+    async def upsert(self, db: AsyncSession, *, name: str, host: str, port: int) -> Agent:
+        """
+        按 (host, port) 注册 Agent, 已存在时更新名称
+        """
+        stmt = mysql_insert(self.model).values(name=name, host=host, port=port, status=AgentStatus.ONLINE)
+        stmt = stmt.on_duplicate_key_update(name=stmt.inserted.name)
+        await db.execute(stmt)
+        await db.commit()
+        return await db.scalar(select(self.model).where(self.model.host == host, self.model.port == port))
+
+    async def update_capacity(
+        self, db: AsyncSession, *, agent_id: int, status: AgentStatus, capacity: Dict[str, Any] | None
+    ) -> None:
+        """
+        记录心跳结果
+        """
+        values: Dict[str, Any] = {"status": status}
+        if status == AgentStatus.ONLINE:
+            values.update(capacity=capacity, last_seen=datetime.now())
+        await db.execute(update(self.model).where(self.model.id == agent_id).values(**values))
+        await db.commit()
+
+    async def list_available(self, db: AsyncSession, *, ttl: int) -> List[Agent]:
+        """
+        在线且最近 ttl 秒内心跳成功的 Agent(由主进程探测写入)
+        """
+        result = await db.execute(select(self.model).where(
+            self.model.status == AgentStatus.ONLINE,
+            self.model.capacity.is_not(None),
+            self.model.last_seen >= datetime.now() - timedelta(seconds=ttl),
+        ))
+        return list(result.scalars().all())
+
+    async def claim_slot(self, db: AsyncSession, *, agent_id: int) -> bool:
+        """
+        原子地占用 Agent 的一个空闲槽位, 多个 worker 进程并发分配时不会超额; 没有空闲槽位时返回False
+        """
+        free_slots = func.json_extract(self.model.capacity, '$.free_slots')
+        running = func.json_extract(self.model.capacity, '$.running')
+        result = await db.execute(
+            update(self.model)
+            .where(self.model.id == agent_id, free_slots > 0)
+            .values(capacity=func.json_set(self.model.capacity, '$.free_slots', free_slots - 1, '$.running', running + 1))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        return result.rowcount == 1
+
+    async def add_queued(self, db: AsyncSession, *, agent_id: int) -> None:
+        """
+        所有 Agent 都没有空闲槽位时, 任务在 Agent 上排队
+        """
+        queued = func.json_extract(self.model.capacity, '$.queued')
+        await db.execute(
+            update(self.model)
+            .where(self.model.id == agent_id)
+            .values(capacity=func.json_set(self.model.capacity, '$.queued', queued + 1))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+    async def mark_offline(self, db: AsyncSession, *, online_ids: List[int]) -> None:
+        """
+        未被发现的 Agent 标记为离线
+        """
+        query = update(self.model).where(self.model.status != AgentStatus.OFFLINE)
+        if online_ids:
+            query = query.where(self.model.id.not_in(online_ids))
+        await db.execute(query.values(status=AgentStatus.OFFLINE))
+        await db.commit()
+
+
+crud_agent = CRUDAgent(Agent)
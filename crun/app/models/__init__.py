@@ -4,6 +4,7 @@ from .case.case_node import *
 from .task.task_record import *
 from .case.case_record import *
 from .resource.server import *
+from .resource.agent import *
 from .user import *
 from .test_plan import *
 from .task.task import *
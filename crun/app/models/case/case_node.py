@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, DateTime
+from sqlalchemy import Integer, String, DateTime, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql import func
 
@@ -19,3 +19,44 @@ class TestCaseNode(Base):
     updated_at: Mapped[DateTime] = mapped_column(
         DateTime, server_default=func.now(), onupdate=func.now(), doc="Timestamp of the last update to the node."
     )
+
+
+class TestCaseNodeClosure(Base):
+    """
+    Closure table of the test case node hierarchy.
+    One row per (ancestor, descendant) pair, including each node with itself at depth 0,
+    so subtree queries, counts, deletes and moves are single set-based statements.
+    """
+    __tablename__ = "testcases_node_closure"
+    __table_args__ = (
+        Index("ix_testcases_node_closure_descendant", "descendant_id", "depth"),
+    )
+
+    ancestor_id: Mapped[int] = mapped_column(Integer, primary_key=True, doc="The ID of the ancestor node.")
+    descendant_id: Mapped[int] = mapped_column(Integer, primary_key=True, doc="The ID of the descendant node.")
+    depth: Mapped[int] = mapped_column(Integer, default=0, doc="Distance from ancestor to descendant, 0 for the node itself.")
+
+
+class TestCaseNodeStat(Base):
+    """
+    Inclusive case counters of a test case node (cases of the node and all its descendants).
+    Kept up to date in the same transaction as case and node mutations; nodes without cases have no row.
+    """
+    __tablename__ = "testcases_node_stats"
+
+    node_id: Mapped[int] = mapped_column(Integer, primary_key=True, doc="The ID of the test case node.")
+    project_id: Mapped[int] = mapped_column(Integer, index=True, doc="The ID of the project this node belongs to.")
+    case_count: Mapped[int] = mapped_column(Integer, default=0, doc="Number of cases in the subtree.")
+    automated_count: Mapped[int] = mapped_column(Integer, default=0, doc="Number of automated cases in the subtree.")
+    automation_count: Mapped[int] = mapped_column(Integer, default=0, doc="Number of automatable cases in the subtree.")
+
+
+class TestCaseTreeVersion(Base):
+    """
+    Version counter of a project's case tree, bumped in the same transaction as every node or case mutation.
+    Cached tree payloads are keyed by it, so all workers see a change as soon as it commits.
+    """
+    __tablename__ = "testcases_tree_version"
+
+    project_id: Mapped[int] = mapped_column(Integer, primary_key=True, doc="The ID of the project.")
+    version: Mapped[int] = mapped_column(Integer, default=1, doc="Incremented on every node or case mutation.")
@@ -1,7 +1,7 @@
 from typing import Any
 
 from datetime import datetime
-from sqlalchemy import Integer, String, DateTime
+from sqlalchemy import UniqueConstraint, Integer, String, DateTime
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.sql import func
 
@@ -10,6 +10,9 @@ from app.core.orm import Base
 
 class TestCaseRecord(Base):
     __tablename__ = "test_case_record"
+    __table_args__ = (
+        UniqueConstraint("task_record_id", "case_index", name="uq_task_record_case_index"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, doc="测试任务记录的唯一标识")
     task_record_id: Mapped[int] = mapped_column(Integer, index=True, doc="关联的测试任务记录ID")
@@ -0,0 +1,27 @@
+from typing import Any
+
+from sqlalchemy import Integer, String, DateTime, JSON, UniqueConstraint, func
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.core.orm import Base
+
+
+class Agent(Base):
+    """Represents a test agent (执行测试任务的节点)."""
+    __tablename__ = "agent"
+    __table_args__ = (
+        UniqueConstraint("host", "port", name="uq_agent_host_port"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, doc="Agent的唯一标识")
+    name: Mapped[str] = mapped_column(String(100), doc="Agent名称(Consul服务ID或静态配置的地址)")
+    host: Mapped[str] = mapped_column(String(100), doc="Agent地址")
+    port: Mapped[int] = mapped_column(Integer, doc="Agent端口")
+    status: Mapped[str | None] = mapped_column(String(50), nullable=True, doc="Agent状态")
+    capacity: Mapped[dict[str, Any] | None] = mapped_column(JSON, nullable=True, doc="最近一次心跳上报的容量")
+    last_seen: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True, doc="最近一次心跳成功的时间")
+
+    created_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now(), doc="创建时间")
+    updated_at: Mapped[DateTime] = mapped_column(
+        DateTime, server_default=func.now(), onupdate=func.now(), doc="更新时间"
+    )
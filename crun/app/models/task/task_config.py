@@ -1,6 +1,6 @@
 from typing import Any
 
-from sqlalchemy import Integer, String, DateTime, JSON
+from sqlalchemy import Integer, String, DateTime, JSON, Float
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
@@ -18,6 +18,7 @@ class TaskConfig(Base):
     owner_id: Mapped[int] = mapped_column(Integer, index=True, doc="拥有或负责此配置的用户")
     description: Mapped[str | None] = mapped_column(String(500), doc="任务配置的描述", nullable=True)
     env_vars: Mapped[list[Any] | None] = mapped_column(JSON, doc="环境变量配置", nullable=True)
+    cpus: Mapped[float | None] = mapped_column(Float, doc="任务容器的CPU配额(核数), 设置后容器内按配额并行执行用例", nullable=True)
     created_at: Mapped[DateTime] = mapped_column(DateTime, server_default=func.now(), doc="配置创建时间")
     updated_at: Mapped[DateTime] = mapped_column(
         DateTime, server_default=func.now(), onupdate=func.now(), doc="配置最后更新时间"
@@ -8,3 +8,4 @@ from .task.task import *
 from .task.task_config import *
 from .task.task_record import *
 from .resource.server import *
+from .resource.agent import *
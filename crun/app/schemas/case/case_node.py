@@ -39,8 +39,23 @@ class TestCaseNodeTreeItem(BaseModel):
     title: str
     children: Optional[List['TestCaseNodeTreeItem']] = []
     case_count: Optional[int] = 0
+    automated_count: Optional[int] = 0
+    automation_count: Optional[int] = 0
 
 
 class TestCaseNodeTreeItemOfTask(TestCaseNodeTreeItem):
     selected_case_count: Optional[int] = 0
     children: Optional[List['TestCaseNodeTreeItemOfTask']] = []
+
+
+class TestCaseNodeChild(BaseModel):
+    """懒加载的用例节点, children 为 None 表示未展开(由前端按需加载)"""
+    key: str
+    title: str
+    parent_id: Optional[int] = None
+    case_count: int = 0
+    automated_count: int = 0
+    automation_count: int = 0
+    child_count: int = 0
+    is_leaf: bool = True
+    children: Optional[List['TestCaseNodeChild']] = None
@@ -1,5 +1,5 @@
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -42,5 +42,20 @@ class CaseResultCreate(BaseModel):
     result: CaseRecordCreateItem
 
 
+class CaseResultBatchCreate(BaseModel):
+    record_id: str
+    results: List[CaseRecordCreateItem]
+
+
+class CaseResultBatchFailure(BaseModel):
+    case_index: str
+    detail: str
+
+
+class CaseResultBatchOut(BaseModel):
+    succeeded: int = 0
+    failed: List[CaseResultBatchFailure] = []
+
+
 class CaseRecordUpdate(BaseModel):
     ...
\ No newline at end of file
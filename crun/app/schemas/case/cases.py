@@ -53,6 +53,23 @@ class TestCaseList(BaseModel):
     total: int
 
 
+class TestCaseBrief(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    index: Optional[str] = None
+    name: str
+    priority: Optional[str] = None
+    automated: int = 0
+    automation: int = 0
+    node_id: Optional[int] = None
+
+
+class TestCaseCursorPage(BaseModel):
+    list: List[TestCaseBrief]
+    next_cursor: Optional[int] = None  # 下一页从该用例ID之后开始, 为空表示没有更多
+
+
 # 用例文件上传
 class BatchTestCaseCreate(TestCaseCreate):
     project_id: int
@@ -0,0 +1,32 @@
+from enum import Enum
+from typing import List
+from datetime import datetime
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class AgentStatus(str, Enum):
+    ONLINE = 'ONLINE'
+    OFFLINE = 'OFFLINE'
+
+
+class AgentCapacity(BaseModel):
+    """Agent 心跳上报的容量"""
+    slots: int = Field(0, description="可同时运行的任务数")
+    running: int = Field(0, description="运行中的任务数")
+    queued: int = Field(0, description="排队中的任务数")
+    free_slots: int = Field(0, description="空闲槽位数")
+    images: List[str] = Field([], description="已缓存依赖环境的镜像")
+    repos: List[str] = Field([], description="已缓存的仓库(不含协议和认证信息)")
+
+
+class Agent(BaseModel):
+    """Schema for retrieving an agent"""
+    id: int = Field(..., description="Agent ID")
+    name: str = Field(..., description="Agent名称")
+    host: str = Field(..., description="Agent地址")
+    port: int = Field(..., description="Agent端口")
+    status: AgentStatus | None = Field(None, description="Agent状态")
+    capacity: AgentCapacity | None = Field(None, description="最近一次上报的容量")
+    last_seen: datetime | None = Field(None, description="最近一次心跳成功的时间")
+
+    model_config = ConfigDict(from_attributes=True)
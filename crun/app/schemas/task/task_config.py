@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional, List
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 
 from app.schemas import UserSearch
 
@@ -14,6 +14,7 @@ class TaskConfigBase(BaseModel):
     name: str
     description: Optional[str] = None
     env_vars: Optional[List[EnvVar]] = None
+    cpus: Optional[float] = Field(default=None, gt=0)  # 任务容器的CPU配额(核数), 为空表示不限制且串行执行
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -74,3 +74,22 @@ class ContainerStopData(BaseModel):
     status: Optional[ContainerStatus] = None
     container_id: str
     timestamp: str
+
+
+class ContainerStopItem(ContainerStopData):
+    job_id: int
+
+
+class ContainerStopBatch(BaseModel):
+    items: List[ContainerStopItem]
+
+
+class ContainerStopBatchFailure(BaseModel):
+    job_id: int
+    status_code: int
+    detail: str
+
+
+class ContainerStopBatchOut(BaseModel):
+    succeeded: int = 0
+    failed: List[ContainerStopBatchFailure] = []
@@ -0,0 +1,48 @@
+import asyncio
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.config.config import get_settings
+from app.core.locks import LeaderLock
+from app.crud import case_node as crud_case_node
+from app.models import TestCaseNode
+
+
+class CaseCountVerifier:
+    """
+    用例树节点计数校验
+    计数随用例和节点的变更增量维护, 后台定时与用例表重新统计的结果比对, 发现偏差(如直接改库)时重建该项目的计数;
+    多个 worker 中只有持有锁的一个执行
+    """
+    def __init__(self):
+        self.settings = get_settings()
+
+    async def verify(self, db: AsyncSession) -> int:
+        """校验所有项目, 返回有偏差的节点数"""
+        result = await db.execute(select(TestCaseNode.project_id).distinct())
+        drift = 0
+        for project_id in result.scalars().all():
+            project_drift = await crud_case_node.verify_counts(db, project_id)
+            if project_drift:
+                logger.warning(f'case counts of project {project_id} drifted on {project_drift} nodes, rebuilt')
+            drift += project_drift
+        return drift
+
+    async def run(self, session_factory, leader: LeaderLock) -> None:
+        """后台定时校验"""
+        try:
+            while True:
+                await asyncio.sleep(self.settings.CASE_COUNT_VERIFY_INTERVAL)
+                try:
+                    if await leader.acquire():
+                        async with session_factory() as db:
+                            await self.verify(db)
+                except Exception as e:
+                    logger.exception(f'verify case counts failed: {e}')
+        finally:
+            await leader.release()
+
+
+case_count_verifier = CaseCountVerifier()
@@ -7,10 +7,13 @@ from loguru import logger
 from fastapi import Depends, HTTPException, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.clients.agent_client import agent_client
+from app.core.clients.agent_client import AgentClient
+from app.core.clients.agent_pool import agent_pool
+from app.core.clients.log_relay import log_relays
 from app.core import deps
 from app.crud import tasks as crud
 from app.crud import task_record as crud_task_record
+from app.crud import crud_case_record
 from app.models import (
     User,
     Project as ProjectModel,
@@ -30,6 +33,8 @@ from app.schemas import (
     ServerOnTaskRun,
 )
 
+TASK_IMAGE = "python:3.10"
+
 
 class TaskService():
     """ TestTask Service"""
@@ -37,15 +42,25 @@ class TaskService():
     def __init__(self):
         ...
 
-    async def log_stream(self, request: Request, queue: asyncio.Queue):
-        while not await request.is_disconnected():
-            line = await queue.get()
-            yield f"{line}\r\n"
+    async def log_stream(self, request: Request, record_id: str, agent_client: AgentClient):
+        """
+        推送任务记录的实时日志, 同一任务记录的所有订阅者共用一条到 Agent 的连接
+        没有新日志时每秒检查一次客户端是否已断开, 断开后立即退出并取消订阅
+        """
+        async with log_relays.subscribe(record_id, agent_client) as subscriber:
+            while not await request.is_disconnected():
+                try:
+                    line = await subscriber.get(timeout=1)
+                except StopAsyncIteration:
+                    return
+                if line is not None:
+                    yield f"{line}\r\n"
 
     async def build_task_record_create(
         self,
         task: TestTaskModel,
         project: ProjectModel,
+        agent_id: int | None = None,
         db: AsyncSession = Depends(deps.get_db)
     ) -> TestTaskRecordModel:
         task_record: TestTaskRecordModel = await crud_task_record.create(
@@ -59,9 +74,9 @@ class TaskService():
                 status=TaskRecordStatus.Created,
                 container_id='',
                 branch=project.branch,
-                image="python:3.10",
+                image=TASK_IMAGE,
                 repo=project.git_repo,
-                agent_id=0,  # TODO 目前只有一个 agent
+                agent_id=agent_id,
                 env_vars=task.config.env_vars if task.config else None,
             )
         )
@@ -116,9 +131,12 @@ class TaskService():
         if not task.cases:
             raise HTTPException(status_code=400, detail="测试任务中必须包含至少一个测试用例")
 
+        # 按空闲槽位和缓存情况选择执行任务的 Agent
+        agent_client = await agent_pool.select(db, image=TASK_IMAGE, repo=project.git_repo)
         task_record: TestTaskRecordModel = await self.build_task_record_create(
             task=task,
             project=project,
+            agent_id=agent_client.id,
             db=db,
         )
 
@@ -137,9 +155,10 @@ class TaskService():
         await db.flush()
 
         try:
-            await agent_client.heartbeat()
             test_env = ServerOnTaskRun.model_validate(task.server) if task.server else None
             server = test_env.model_dump_json() if test_env else {}
+            case_durations = await crud_case_record.get_case_durations(
+                db=db, project_id=task.project_id, case_indexes=[case.index for case in task.cases])
             data = await agent_client.run_task(
                 job_id=task_record.id,
                 repo=str(task_record.repo),
@@ -148,8 +167,10 @@ class TaskService():
                 branch=str(task_record.branch),
                 env_vars=task.config.env_vars if task.config else None,
                 server=json.loads(server) if isinstance(server, str) else server,
+                case_durations=case_durations,
+                cpus=task.config.cpus if task.config else None,
             )
-            if data['status'] != 'created':
+            if data['status'] not in ('created', 'queued'):
                 await self.update_status_error(db=db, task=task, task_record=task_record)
                 raise HTTPException(status_code=500, detail="Task run failed")
             await self.update_status_running(db=db, task=task, task_record=task_record)
@@ -160,10 +181,12 @@ class TaskService():
             raise HTTPException(status_code=500, detail="Task was cancelled")
         except asyncio.TimeoutError as e:
             logger.error('Agent timeout from timeout error')
+            agent_pool.report_failure(agent_client.id)
             await self.update_status_error(db=db, task=task, task_record=task_record)
             raise HTTPException(status_code=500, detail="Agent timeout")
         except aiohttp.ClientError as e:
             logger.error('Agent is not running from client error')
+            agent_pool.report_failure(agent_client.id)
             await self.update_status_error(db=db, task=task, task_record=task_record)
             raise HTTPException(status_code=500, detail="Agent is not running") from e
         except HTTPException as e:
@@ -10,11 +10,16 @@ from app.models import (
 from app.schemas import (
     ContainerStatus,
     ContainerStopData,
+    ContainerStopBatch,
+    ContainerStopBatchFailure,
+    ContainerStopBatchOut,
     TaskRecord,
     TaskRecordStatus,
     CaseRecord,
     CaseRecordStatus,
     CaseResultCreate,
+    CaseResultBatchCreate,
+    CaseResultBatchOut,
     TaskStatus
 )
 from app.crud import (
@@ -81,6 +86,19 @@ class TaskRecordService():
         return CaseRecord.model_validate(case_record, from_attributes=True)
 
 
+    async def bulk_update_case_records(
+        self,
+        db: AsyncSession,
+        data_in: CaseResultBatchCreate,
+    ) -> CaseResultBatchOut:
+        """批量更新测试用例执行记录"""
+        logger.info(f'bulk_update_case_records, record_id={data_in.record_id}, count={len(data_in.results)}')
+        out = await crud_case_record.bulk_update_case_records(db=db, data_in=data_in)
+        if out.failed:
+            logger.warning(f'bulk_update_case_records, record_id={data_in.record_id}, failed={out.failed}')
+        return out
+
+
     async def container_stop(
         self,
         db: AsyncSession,
@@ -132,6 +150,30 @@ class TaskRecordService():
         )
 
 
+    async def bulk_container_stop(
+        self,
+        db: AsyncSession,
+        data_in: ContainerStopBatch,
+    ) -> ContainerStopBatchOut:
+        """批量处理容器停止通知(Agent 发件箱积压的通知), 逐条处理, 单条失败不影响其他通知"""
+        logger.info(f'bulk_container_stop, count={len(data_in.items)}')
+        out = ContainerStopBatchOut()
+        for item in data_in.items:
+            try:
+                await self.container_stop(
+                    db=db, job_id=item.job_id, data_in=ContainerStopData(**item.model_dump(exclude={'job_id'})))
+                out.succeeded += 1
+            except HTTPException as e:
+                out.failed.append(ContainerStopBatchFailure(job_id=item.job_id, status_code=e.status_code, detail=str(e.detail)))
+            except Exception as e:
+                logger.exception(f'bulk_container_stop, job_id={item.job_id} failed')
+                await db.rollback()
+                out.failed.append(ContainerStopBatchFailure(job_id=item.job_id, status_code=500, detail=str(e)))
+        if out.failed:
+            logger.warning(f'bulk_container_stop, failed={out.failed}')
+        return out
+
+
 def get_task_record_service() -> TaskRecordService:
     """获取任务记录服务"""
     return TaskRecordService()